@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+"""
+Безбраузерный доступ к админке tickets.afisha.ru.
+
+Страницы показа и меню месяца — обычный серверный HTML, поэтому вместо
+Chrome достаточно одной HTTP-сессии: логинимся формой один раз, куки
+живут в общей банке, соединения переиспользуются пулом urllib3.
+Истёкшая сессия (редирект на форму входа) лечится повторным входом на
+месте — через LoginGuard, чтобы из толпы запросов логинился один. С
+CookieFile куки переживают перезапуск, и форма входа не нужна вовсе.
+Если вход не удался или пришла заглушка антибота, поднимаем исключение —
+вызывающий код может откатиться на Selenium.
+"""
+
+import logging
+from typing import Optional
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from afisha_session import CookieFile, LoginBackoff, LoginGuard, cookies_from_jar, cookies_to_jar
+
+log = logging.getLogger("neuroseagull.http")
+
+LOGIN_PATH = "/admin/login"
+
+# Признаки страницы-заглушки вместо админки
+_BLOCK_MARKERS = ("captcha", "cf-chl", "ddos-guard", "challenge-platform", "access denied")
+
+_USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0 Safari/537.36"
+)
+
+
+class AfishaHttpError(Exception):
+    """HTTP-путь не смог отдать страницу админки."""
+
+
+class AfishaAuthError(AfishaHttpError):
+    """Нас отправили на форму входа (логин не принят или сессия истекла)."""
+
+
+class AfishaBlocked(AfishaHttpError):
+    """Вместо админки пришла капча/антибот/неожиданная страница."""
+
+
+class AfishaHttpClient:
+    """Одна залогиненная requests-сессия на процесс, безопасна для потоков."""
+
+    def __init__(
+            self,
+            base_url: str,
+            email: str,
+            password: str,
+            timeout: float = 15.0,
+            pool_size: int = 8,
+            guard: Optional[LoginGuard] = None,
+            cookies: Optional[CookieFile] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self._email = email
+        self._password = password
+        self._timeout = timeout
+        self._pool_size = pool_size
+        self._guard = guard or LoginGuard()
+        self._cookies = cookies
+        self._seen = -1             # поколение входа, чьи куки лежат в сессии
+        self._session = self._new_session()
+
+    def _new_session(self) -> requests.Session:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        s.headers.update({
+            "User-Agent": _USER_AGENT,
+            "Accept-Language": "ru-RU,ru;q=0.9",
+        })
+        return s
+
+    # ── логин ────────────────────────────────────────────────────────────────
+
+    def login(self) -> None:
+        """Войти формой (без single-flight — его даёт _relogin)."""
+        login_url = self.base_url + LOGIN_PATH
+        r = self._session.get(login_url, timeout=self._timeout)
+        r.raise_for_status()
+        action, data, email_field, password_field = _login_form(r.text, login_url)
+        data[email_field] = self._email
+        data[password_field] = self._password
+
+        r = self._session.post(
+            action, data=data, timeout=self._timeout, headers={"Referer": login_url},
+        )
+        if _is_login_page(r):
+            raise AfishaAuthError("форма входа не приняла логин/пароль")
+        self._check_blocked(r)
+        if self._cookies is not None:
+            self._cookies.save(cookies_from_jar(self._session.cookies))
+        log.info("Вошли в админку по HTTP")
+
+    def warm(self) -> None:
+        """Войти заранее (фоновый прогрев), если в сессии ещё нет рабочих кук."""
+        self._adopt()
+        r = self._get("/admin")
+        if _is_login_page(r):
+            self._relogin(self._seen)
+
+    def reset(self) -> None:
+        """Забыть сессию и куки: следующий запрос войдёт формой заново."""
+        # старую сессию не закрываем: ею могут ещё дочитывать страницу
+        self._session = self._new_session()
+        self._seen = -1
+        if self._cookies is not None:
+            self._cookies.clear()
+        self._guard.reset()
+
+    def _adopt(self) -> None:
+        """Взять куки последнего входа (свои, с диска или от Chrome)."""
+        gen = self._guard.generation
+        if self._seen == gen:
+            return
+        if self._cookies is not None:
+            cookies_to_jar(self._session.cookies, self._cookies.load())
+        self._seen = gen
+
+    def _relogin(self, seen_generation: int) -> None:
+        """
+        Single-flight: из толпы потоков, упёршихся в форму входа,
+        логинится только первый, остальные просто берут свежие куки.
+        """
+        try:
+            self._guard.ensure(seen_generation, self.login)
+        except LoginBackoff as e:
+            raise AfishaAuthError(str(e)) from e
+        self._adopt()
+
+    # ── страницы ─────────────────────────────────────────────────────────────
+
+    def get_page(self, path: str, marker: str = "") -> str:
+        """
+        HTML страницы админки по пути (например, /admin/events/info/123).
+        marker — строка, которая обязана быть в настоящей странице.
+        """
+        self._adopt()
+        gen = self._seen
+        r = self._get(path)
+        # второй заход — если сессию сбросили снова между входом и повтором
+        for _ in range(2):
+            if not _is_login_page(r):
+                break
+            self._relogin(gen)
+            gen = self._seen
+            r = self._get(path)
+        else:
+            raise AfishaAuthError(f"после логина всё равно форма входа: {path}")
+
+        self._check_blocked(r, marker)
+        return r.text
+
+    def _get(self, path: str) -> requests.Response:
+        return self._session.get(self.base_url + path, timeout=self._timeout)
+
+    @staticmethod
+    def _check_blocked(r: requests.Response, marker: str = "") -> None:
+        if r.status_code in (403, 429, 503):
+            raise AfishaBlocked(f"HTTP {r.status_code} на {r.url}")
+        r.raise_for_status()
+        head = r.text[:20000].lower()
+        if any(m in head for m in _BLOCK_MARKERS):
+            raise AfishaBlocked(f"заглушка антибота на {r.url}")
+        if marker and marker not in r.text:
+            raise AfishaBlocked(f"на {r.url} нет ожидаемой разметки")
+
+    def close(self) -> None:
+        self._session.close()
+
+
+def _is_login_page(r: requests.Response) -> bool:
+    return LOGIN_PATH in r.url or 'id="password"' in r.text
+
+
+def _login_form(html: str, page_url: str) -> tuple[str, dict, str, str]:
+    """
+    (URL отправки, скрытые поля вроде CSRF-токена, имя поля e-mail, имя поля пароля).
+    """
+    from bs4 import BeautifulSoup     # нужен только на входе, не при запуске
+
+    soup = BeautifulSoup(html, "html.parser")
+    pwd = soup.find("input", id="password")
+    form = pwd.find_parent("form") if pwd else None
+    if form is None:
+        raise AfishaBlocked("на странице входа нет формы")
+
+    data = {}
+    for inp in form.find_all("input"):
+        name = inp.get("name")
+        if name and inp.get("type", "text") in ("hidden", "checkbox") and inp.has_attr("value"):
+            data[name] = inp["value"]
+
+    email = form.find("input", id="email")
+    email_field = (email.get("name") if email else None) or "email"
+    action = urljoin(page_url, form.get("action") or page_url)
+    return action, data, email_field, pwd.get("name") or "password"
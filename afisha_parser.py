@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+
+"""
+Разбор страниц админки: карточка показа и меню месяца.
+
+Каждая страница разбирается ровно один раз: через lxml, если он
+установлен, иначе скомпилированными регулярками по сырому HTML.
+На выходе — типизированные записи, а не готовый текст для Telegram.
+
+Проверка на записанных страницах из fixtures/afisha (карточка показа и
+меню месяца на 120 показов): оба движка должны вернуть ровно то, что лежит
+в expected.json, — иначе код выхода 1. Запускать после любой правки разбора:
+
+    python afisha_parser.py
+
+Скорость обоих движков и нераспознанные поля на своих сохранённых страницах:
+
+    python afisha_parser.py saved/info_12345.html saved/menu_09.2025.html
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import html as htmllib
+from dataclasses import asdict, dataclass, fields
+from typing import Optional, Union
+
+try:
+    import lxml.html
+except ImportError:       # не обязателен: есть запасной разбор регулярками
+    lxml = None
+
+Number = Union[int, float]
+
+PAGE_MARKER = "pull-right text-primary"
+SHOW_LINK = "/admin/events/info/"
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "afisha")
+
+
+@dataclass(frozen=True, slots=True)
+class ShowInfo:
+    code: str
+    title: str
+    date: str
+    sold_cnt: Optional[int] = None
+    sold_sum: Optional[Number] = None
+    fact_cnt: Optional[int] = None
+    fact_sum: Optional[Number] = None
+    booked_cnt: Optional[int] = None
+    booked_sum: Optional[Number] = None
+
+    def missing(self) -> list[str]:
+        """Какие числовые поля не нашлись — признак, что вёрстка поменялась."""
+        return [f.name for f in fields(self) if getattr(self, f.name) is None]
+
+
+@dataclass(frozen=True, slots=True)
+class MenuItem:
+    code: str
+    text: str       # строка меню целиком, как её видит человек
+    date: str       # "12.09 19:00"
+    title: str
+
+    @property
+    def is_seagull(self) -> bool:
+        return "ЧАЙКА" in self.text
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Общие помощники
+# ──────────────────────────────────────────────────────────────────────────────
+
+_WS_RE = re.compile(r"\s+")
+_TAG_RE = re.compile(r"<[^>]+>")
+_DATE_RE = re.compile(r"\d{1,2}\.\d{2}(?:\.\d{4})?\s+\d{1,2}:\d{2}")
+_NUM_JUNK = str.maketrans({" ": None, "\xa0": None, "\u2009": None, "\u202f": None, ",": "."})
+
+# Подписи строк с продажами → поля ShowInfo
+_LABELS = {
+    "Продано": ("sold_cnt", "sold_sum"),
+    "Продано фактически": ("fact_cnt", "fact_sum"),
+    "Забронировано": ("booked_cnt", "booked_sum"),
+}
+
+
+def to_number(text: Optional[str]) -> Optional[Number]:
+    """'1 234' → 1234, '34 500.00' → 34500, '12,50' → 12.5; мусор → None."""
+    if not text:
+        return None
+    s = text.translate(_NUM_JUNK).strip()
+    try:
+        v = float(s)
+    except ValueError:
+        return None
+    return int(v) if v.is_integer() else v
+
+
+def fmt_number(v: Optional[Number]) -> str:
+    if v is None:
+        return "—"
+    if isinstance(v, float) and not v.is_integer():
+        return f"{v:,.2f}".replace(",", " ")
+    return f"{int(v):,}".replace(",", " ")
+
+
+def format_show(info: ShowInfo) -> str:
+    """Текст карточки продаж для Telegram."""
+    return (
+        f'Спектакль "{info.title}"\n'
+        f"{info.date}\n"
+        f"Продано билетов: {fmt_number(info.sold_cnt)} на {fmt_number(info.sold_sum)} рублей\n"
+        f"Продано фактически: {fmt_number(info.fact_cnt)} на {fmt_number(info.fact_sum)} рублей\n"
+        f"Забронировано: {fmt_number(info.booked_cnt)} на {fmt_number(info.booked_sum)} рублей"
+    )
+
+
+def _date_from_header(text: str) -> str:
+    # "Показ (№ 123)12.09.2025 19:00 (пт)" → "12.09.2025 19:00"
+    _, _, rest = text.partition(")")
+    return (rest or text).split(")")[0].strip()
+
+
+def _menu_item(code: str, text: str) -> MenuItem:
+    m = _DATE_RE.search(text)
+    if m:
+        date, title = m.group(0), text[m.end():].strip()
+    else:
+        date, title = text[4:15], text[16:]
+    return MenuItem(code=code, text=text, date=date, title=title)
+
+
+def _code_from_href(href: str) -> str:
+    return href.split(SHOW_LINK, 1)[1].split("?")[0].strip("/")
+
+
+def _sales(values: dict, label: str, cnt: Optional[str], total: Optional[str]) -> None:
+    keys = _LABELS.get(_WS_RE.sub(" ", label).strip())
+    if keys and keys[0] not in values:
+        values[keys[0]] = to_number(cnt)
+        values[keys[1]] = to_number(total)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# lxml
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _has_class(*names: str) -> str:
+    return " and ".join(
+        f'contains(concat(" ", normalize-space(@class), " "), " {n} ")' for n in names
+    )
+
+_X_TITLE = '//a[contains(@href, "/admin/shows?name=")]'
+_X_HEADER = f"//div[{_has_class('pull-right', 'text-primary')}]"
+_X_PLACES = '//p[contains(translate(@style, " ", ""), "margin-bottom:4px")]'
+_X_MENU_LINKS = f'//*[{_has_class("extend-menu")}]//a[contains(@href, "{SHOW_LINK}")]'
+
+
+def _lxml_doc(page: str):
+    try:
+        return lxml.html.fromstring(page)
+    except ValueError:      # строка с <?xml encoding=...?> — отдаём байтами
+        return lxml.html.fromstring(page.encode("utf-8"))
+
+
+def _parse_show_lxml(page: str, code: str) -> Optional[ShowInfo]:
+    doc = _lxml_doc(page)
+    title = doc.xpath(_X_TITLE)
+    header = doc.xpath(_X_HEADER)
+    if not title or not header:
+        return None
+
+    values: dict = {}
+    for p in doc.xpath(_X_PLACES):
+        bs = list(p.iter("b"))
+        if not bs:
+            continue
+        total = next((b.text for b in bs if (b.tail or "").strip().startswith("р.")), None)
+        _sales(values, p.text or "", bs[0].text, total)
+
+    return ShowInfo(
+        code=code,
+        title=title[0].text_content().strip(),
+        date=_date_from_header("".join(t.strip() for t in header[0].itertext())),
+        **values,
+    )
+
+
+def _parse_month_lxml(page: str) -> list[MenuItem]:
+    items, seen = [], set()
+    for a in _lxml_doc(page).xpath(_X_MENU_LINKS):
+        code = _code_from_href(a.get("href", ""))
+        if not code or code in seen:
+            continue
+        seen.add(code)
+        text = _WS_RE.sub(" ", " ".join(t.strip() for t in a.itertext() if t.strip()))
+        items.append(_menu_item(code, text))
+    return items
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Регулярки (без зависимостей)
+# ──────────────────────────────────────────────────────────────────────────────
+
+_RE_TITLE = re.compile(r'<a\b[^>]*href="[^"]*/admin/shows\?name=[^"]*"[^>]*>(.*?)</a>', re.S | re.I)
+_RE_HEADER = re.compile(
+    r'<div\b[^>]*class="(?=[^"]*\bpull-right\b)(?=[^"]*\btext-primary\b)[^"]*"[^>]*>(.*?)</div>',
+    re.S | re.I,
+)
+_RE_PLACES = re.compile(r'<p\b[^>]*style="\s*margin-bottom:\s*4px;?\s*"[^>]*>(.*?)</p>', re.S | re.I)
+_RE_BOLD = re.compile(r"<b\b[^>]*>(.*?)</b>([^<]*)", re.S | re.I)
+_RE_MENU_START = re.compile(r'class="[^"]*\bextend-menu\b', re.I)
+_RE_LINK = re.compile(rf'<a\b[^>]*href="([^"]*{SHOW_LINK}[^"]*)"[^>]*>(.*?)</a>', re.S | re.I)
+
+
+def _strings(fragment: str) -> list[str]:
+    """Текстовые куски фрагмента, как stripped_strings у bs4."""
+    return [s for s in (htmllib.unescape(x).strip() for x in _TAG_RE.split(fragment)) if s]
+
+
+def _parse_show_re(page: str, code: str) -> Optional[ShowInfo]:
+    title = _RE_TITLE.search(page)
+    header = _RE_HEADER.search(page)
+    if not title or not header:
+        return None
+
+    values: dict = {}
+    for block in _RE_PLACES.finditer(page):
+        inner = block.group(1)
+        bs = _RE_BOLD.findall(inner)
+        if not bs:
+            continue
+        label = htmllib.unescape(_TAG_RE.sub("", inner.split("<b", 1)[0]))
+        total = next((v for v, tail in bs if tail.strip().startswith("р.")), None)
+        cnt = htmllib.unescape(_TAG_RE.sub("", bs[0][0]))
+        _sales(values, label, cnt, total and htmllib.unescape(_TAG_RE.sub("", total)))
+
+    return ShowInfo(
+        code=code,
+        title=" ".join(_strings(title.group(1))),
+        date=_date_from_header("".join(_strings(header.group(1)))),
+        **values,
+    )
+
+
+def _parse_month_re(page: str) -> list[MenuItem]:
+    start = _RE_MENU_START.search(page)
+    if not start:
+        return []
+    items, seen = [], set()
+    for m in _RE_LINK.finditer(page, start.start()):
+        code = _code_from_href(htmllib.unescape(m.group(1)))
+        if not code or code in seen:
+            continue
+        seen.add(code)
+        items.append(_menu_item(code, _WS_RE.sub(" ", " ".join(_strings(m.group(2))))))
+    return items
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Публичный интерфейс
+# ──────────────────────────────────────────────────────────────────────────────
+
+def parse_show(page: str, code: str = "") -> Optional[ShowInfo]:
+    """Карточка показа; None, если на странице нет названия или даты."""
+    if lxml is not None:
+        return _parse_show_lxml(page, code)
+    return _parse_show_re(page, code)
+
+
+def parse_month(page: str) -> list[MenuItem]:
+    """Все показы из меню месяца, в порядке появления, без повторов."""
+    if lxml is not None:
+        return _parse_month_lxml(page)
+    return _parse_month_re(page)
+
+
+def _backends() -> dict:
+    backends = {"regex": (_parse_show_re, _parse_month_re)}
+    if lxml is not None:
+        backends["lxml"] = (_parse_show_lxml, _parse_month_lxml)
+    return backends
+
+
+def _check(rounds: int = 20) -> int:
+    """Записанные страницы против expected.json: каждое поле, оба движка."""
+    with open(os.path.join(FIXTURES, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    if lxml is None:
+        print("lxml не установлен — проверяется только разбор регулярками")
+
+    problems = []
+    for name, want in expected.items():
+        with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+            page = f.read()
+        for backend, (show_fn, month_fn) in _backends().items():
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                if want["kind"] == "menu":
+                    got = [asdict(it) for it in month_fn(page)]
+                else:
+                    res = show_fn(page, want["show"]["code"])
+                    got = asdict(res) if res else None
+            ms = (time.perf_counter() - t0) * 1000 / rounds
+            if want["kind"] == "menu":
+                diff = [f"{w['code']}: {w} ≠ {g}" for w, g in zip(want["items"], got) if w != g]
+                if len(got) != len(want["items"]):
+                    diff.insert(0, f"показов {len(got)} вместо {len(want['items'])}")
+            elif got is None:
+                diff = ["страница не распознана"]
+            else:
+                diff = [f"{k}: {got[k]!r} вместо {v!r}" for k, v in want["show"].items() if got[k] != v]
+            print(f"{'ok ' if not diff else 'ОШИБКА'}  {name} [{backend}] {ms:.3f} мс"
+                  + (f": {'; '.join(diff[:3])}" if diff else ""))
+            if diff:
+                problems.append(f"{name} [{backend}]")
+
+    print("OK" if not problems else f"ПРОБЛЕМЫ: {', '.join(problems)}")
+    return 1 if problems else 0
+
+
+def _bench(paths: list[str], rounds: int = 50) -> int:
+    backends = _backends()
+
+    bad = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            page = f.read()
+        is_menu = bool(_RE_MENU_START.search(page))
+        print(f"{path} ({'меню' if is_menu else 'показ'}, {len(page) // 1024} КБ)")
+        for name, (show_fn, month_fn) in backends.items():
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                res = month_fn(page) if is_menu else show_fn(page, "bench")
+            ms = (time.perf_counter() - t0) * 1000 / rounds
+            if is_menu:
+                summary = f"{len(res)} показов"
+                bad += not res
+            else:
+                lost = res.missing() if res else ["всё"]
+                summary = f"не распознано: {', '.join(lost)}" if lost else "все поля на месте"
+                bad += bool(lost)
+            print(f"  {name:6s} {ms:8.3f} мс  {summary}")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_bench(sys.argv[1:]) if sys.argv[1:] else _check())
@@ -0,0 +1,929 @@
+# -*- coding: utf-8 -*-
+
+"""
+Доступ к страницам админки — в боте или в отдельных процессах-воркерах.
+
+AfishaScraper — всё, что нужно, чтобы получить HTML страницы: HTTP-клиент,
+пул Chrome (запасной путь или основной при engine="selenium") и общий вход
+с куками на диске. Раньше это жило прямо в процессе бота, и зависшая
+загрузка страницы, падение рендерера или распухший Chrome замораживали
+или роняли опрос Telegram.
+
+ScrapeWorkers держит тот же AfishaScraper в N дочерних процессах и ходит
+к ним по локальному сокету (multiprocessing.connection поверх socketpair):
+
+    scraper = ScrapeWorkers(2, config, timeout=90, max_rss_mb=1024)
+    html = scraper.load("/admin/events/info/12345")
+
+• запрос уходит воркеру с наименьшим числом запросов в работе;
+• не ответил за timeout — воркер убивается вместе со своим Chrome и
+  перезапускается, вызывающий получает ScrapeFailed;
+• упал — то же, перезапуск с нарастающей паузой, если падает раз за разом;
+• память воркера вместе с его Chrome больше max_rss_mb — новые запросы
+  ему не даются, и как только он допишет начатое, его заменяет свежий.
+
+Бот при этом только ждёт ответа в своём потоке и на чат отвечает как
+обычно. Воркер завершается сам, если бот пропал (сокет закрылся).
+
+Проверка: пауза перезапуска и подсчёт памяти дерева процессов (assert),
+потом воркеры против подделки админки (зависание, падение, лимит памяти);
+код выхода 1 — что-то не так:
+
+    python afisha_scraper.py
+
+lean=True — «худой» Chrome для парсинга: картинки, шрифты, стили, медиа и
+чужие счётчики блокируются ещё в сети (CDP Network.setBlockedURLs, список —
+LEAN_BLOCKED_URLS), get() возвращается после разбора HTML (page load
+strategy "eager"), а дальше ждём только узел READY_CSS, без ожидания AJAX.
+Блокировка привязана к вкладке, поэтому каждый Chrome из пула всю жизнь
+ходит по страницам в одной и той же. Сравнение с обычным Chrome на
+записанных страницах (нужен Chrome):
+
+    python afisha_scraper.py --bench-chrome [страниц]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import socket
+import logging
+import tempfile
+import threading
+import subprocess
+import itertools
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, Optional
+
+import requests
+
+from afisha_http import LOGIN_PATH, AfishaAuthError, AfishaBlocked, AfishaHttpClient
+from afisha_session import CookieFile, LoginBackoff, LoginGuard
+from metrics import metrics
+from session_pool import PoolTimeout, SessionPool
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+log = logging.getLogger("neuroseagull.scraper")
+
+
+class ScrapeFailed(Exception):
+    """Воркер не ответил вовремя, упал или страница не открылась (сеть, Chrome)."""
+
+
+# Узел, без которого парсеру нечего читать (шапка показа/месяца)
+READY_CSS = "div.pull-right.text-primary"
+
+# Чего lean-Chrome не грузит: картинки, шрифты, стили, медиа, счётчики и
+# виджеты чужих сайтов. Разметку и скрипты самой админки — грузит.
+_LEAN_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "webp", "svg", "ico", "bmp",
+                    "woff", "woff2", "ttf", "otf", "eot", "css", "mp4", "webm", "mp3")
+LEAN_BLOCKED_URLS = tuple(f"*.{ext}{tail}" for ext in _LEAN_EXTENSIONS for tail in ("", "?*")) + (
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*mc.yandex.ru*",
+    "*top-fwz1.mail.ru*", "*vk.com/rtrg*", "*connect.facebook.net*", "*fonts.googleapis.com*",
+    "*fonts.gstatic.com*", "*jivosite.com*", "*code.jivo.ru*",
+)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Сам парсинг (в процессе бота или внутри воркера)
+# ──────────────────────────────────────────────────────────────────────────────
+
+class AfishaScraper:
+    """HTML страниц админки: по HTTP, а если не вышло — через Chrome из пула."""
+
+    def __init__(
+            self,
+            base_url: str,
+            email: str,
+            password: str,
+            engine: str = "http",
+            page_marker: str = "",
+            cookies_path: str = "",
+            login_backoff: float = 5.0,
+            login_max_backoff: float = 300.0,
+            pool_size: int = 2,
+            pool_timeout: float = 60.0,
+            lean: bool = False,
+            lean_block: tuple[str, ...] = (),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.engine = engine
+        # lean: Chrome без картинок/шрифтов/стилей/счётчиков, get() до DOMContentLoaded,
+        # ждём только READY_CSS; lean_block — ещё шаблоны URL к LEAN_BLOCKED_URLS
+        self.lean = lean
+        self._lean_block = tuple(lean_block)
+        self._email = email
+        self._password = password
+        self._marker = page_marker
+        # Вход общий для HTTP-клиента и всех браузеров: куки на диске
+        # переживают перезапуск, а при истёкшей сессии логинится кто-то один
+        self.cookies = CookieFile(cookies_path) if cookies_path else None
+        self.login = LoginGuard(backoff=login_backoff, max_backoff=login_max_backoff, cookies=self.cookies)
+        self.http = AfishaHttpClient(self.base_url, email, password, guard=self.login, cookies=self.cookies)
+        self.drivers: SessionPool["webdriver.Chrome"] = SessionPool(
+            self._create_driver,
+            size=pool_size,
+            timeout=pool_timeout,
+            check=_driver_alive,
+            dispose=_dispose_driver,
+            name="chrome",
+        )
+
+    def load(self, path: str) -> str:
+        """
+        HTML страницы. Наружу — только AfishaAuthError, PoolTimeout и
+        ScrapeFailed (сеть, HTTP 5xx, Chrome): так же, как из воркера.
+        """
+        if self.engine == "http":
+            try:
+                with metrics.stage("afisha.http"):
+                    return self.http.get_page(path, marker=self._marker)
+            except (AfishaAuthError, AfishaBlocked) as e:
+                log.warning("HTTP-движок не справился (%s), открываю в Chrome", e)
+            except requests.RequestException as e:
+                raise ScrapeFailed(f"HTTP: {e}") from e
+        return self._load_selenium(self.base_url + path)
+
+    def warm(self) -> None:
+        if self.engine == "selenium":
+            # Один браузер поднимаем заранее, остальные — по мере нагрузки
+            self.drivers.warm(1)
+        else:
+            self.http.warm()
+
+    def reload(self) -> int:
+        """Забыть куки и паузу после неудачных входов, заменить браузеры, войти заново."""
+        self.http.reset()
+        closed = self.drivers.recycle()
+        self.warm()
+        return closed
+
+    def stats(self) -> dict:
+        return self.login.stats()
+
+    def close(self) -> None:
+        self.drivers.close()
+        self.http.close()
+
+    # ── Chrome ───────────────────────────────────────────────────────────────
+
+    def _load_selenium(self, url: str) -> str:
+        """Открыть страницу админки в свободном браузере из пула и вернуть HTML."""
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            return self._chrome_page(url)
+        except WebDriverException as e:
+            # TimeoutException тоже здесь: шапка так и не появилась
+            raise ScrapeFailed(f"Chrome: {type(e).__name__} на {url}") from e
+
+    def _chrome_page(self, url: str) -> str:
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as ec
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        with self.drivers.session() as driver:
+            with metrics.stage("selenium.get"):
+                self._chrome_open(driver, url)
+            if self.lean:
+                # eager: get() вернулся, как только разобран HTML, — проверяем только нужный узел
+                with metrics.stage("selenium.wait"):
+                    WebDriverWait(driver, 10, poll_frequency=0.05).until(
+                        ec.presence_of_element_located((By.CSS_SELECTOR, READY_CSS))
+                    )
+                return driver.page_source
+            with metrics.stage("selenium.ajax"):
+                wait_ajax_complete(driver, timeout=25)
+            with metrics.stage("selenium.wait"):
+                WebDriverWait(driver, 25).until(
+                    ec.visibility_of_element_located((By.CSS_SELECTOR, READY_CSS))
+                )
+            return driver.page_source
+
+    def _create_driver(self) -> "webdriver.Chrome":
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        # У каждого Chrome свой профиль: два браузера не могут делить user-data-dir
+        profile_dir = tempfile.mkdtemp(prefix="chrome-profile-")
+        opts = Options()
+        opts.add_argument("--headless=new")
+        opts.add_argument("--disable-gpu")
+        opts.add_argument("--no-sandbox")
+        opts.add_argument("--disable-dev-shm-usage")
+        opts.add_argument("window-size=1920,1080")
+        opts.add_experimental_option("excludeSwitches", ["enable-automation"])
+        opts.add_experimental_option("useAutomationExtension", False)
+        opts.add_argument("--disable-blink-features=AutomationControlled")
+        # профиль — чтобы меньше светиться как автотест
+        opts.add_argument(f"--user-data-dir={profile_dir}")
+        # случайный порт для remote-debug
+        opts.add_argument(f'--remote-debugging-port={random.randint(9200, 9400)}')
+        if self.lean:
+            opts.page_load_strategy = "eager"
+            opts.add_argument("--blink-settings=imagesEnabled=false")
+            opts.add_argument("--disable-extensions")
+            opts.add_argument("--disable-background-networking")
+            opts.add_argument("--disable-component-update")
+            opts.add_argument("--mute-audio")
+            opts.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+
+        drv = webdriver.Chrome(options=opts)
+        drv.profile_dir = profile_dir
+        try:
+            if self.lean:
+                # блокировка живёт во вкладке — поэтому весь парсинг идёт в одной, из пула
+                drv.execute_cdp_cmd("Network.enable", {})
+                drv.execute_cdp_cmd("Network.setBlockedURLs", {"urls": [*LEAN_BLOCKED_URLS, *self._lean_block]})
+            # сохранённые куки — если живы, форму входа не увидим
+            self._chrome_open(drv, f"{self.base_url}/admin")
+        except Exception:
+            _dispose_driver(drv)
+            raise
+        return drv
+
+    def _chrome_open(self, drv: "webdriver.Chrome", url: str) -> None:
+        """
+        Открыть страницу админки. Если выкинуло на форму входа — войти заново
+        в этом же браузере (один вход на все браузеры и HTTP-клиент сразу).
+        """
+        gen = self.login.generation
+        if getattr(drv, "login_gen", None) != gen:
+            self._chrome_adopt_cookies(drv)
+        drv.get(url)
+        if not _chrome_on_login_page(drv):
+            return
+        log.info("Chrome: сессия админки истекла, вхожу заново")
+        try:
+            self.login.ensure(gen, lambda: self._chrome_form_login(drv))
+        except LoginBackoff as e:
+            raise AfishaAuthError(str(e)) from e
+        self._chrome_adopt_cookies(drv)
+        drv.get(url)
+        if _chrome_on_login_page(drv):
+            raise AfishaAuthError(f"после входа всё равно форма входа: {url}")
+
+    def _chrome_form_login(self, drv: "webdriver.Chrome") -> None:
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as ec
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        drv.get(f"{self.base_url}{LOGIN_PATH}")
+        drv.find_element(By.ID, "email").send_keys(self._email)
+        drv.find_element(By.ID, "password").send_keys(self._password)
+        drv.find_element(By.XPATH, "//button[contains(., 'Войти')]").click()
+
+        # Подождём, пока форма уйдёт (или вернётся с ошибкой)
+        WebDriverWait(drv, 20).until(
+            ec.any_of(
+                ec.url_contains("/admin"),
+                ec.presence_of_element_located((By.TAG_NAME, "body"))
+            )
+        )
+        if _chrome_on_login_page(drv):
+            raise AfishaAuthError("форма входа не приняла логин/пароль")
+        if self.cookies is not None:
+            self.cookies.save(drv.get_cookies())
+        log.info("Вошли в админку через Chrome")
+
+    def _chrome_adopt_cookies(self, drv: "webdriver.Chrome") -> None:
+        """Подложить браузеру куки последнего входа (его, соседнего Chrome или HTTP-клиента)."""
+        cookies = self.cookies.load() if self.cookies is not None else []
+        if cookies and not drv.current_url.startswith(self.base_url):
+            # add_cookie работает только на странице того же сайта
+            drv.get(f"{self.base_url}{LOGIN_PATH}")
+        for c in cookies:
+            try:
+                drv.add_cookie({k: v for k, v in c.items() if k != "domain"})
+            except Exception:
+                log.debug("Chrome не принял куку %s", c.get("name"), exc_info=True)
+        drv.login_gen = self.login.generation
+
+
+def wait_ajax_complete(drv, timeout=20):
+    from selenium.webdriver.support.ui import WebDriverWait
+    WebDriverWait(drv, timeout).until(lambda d: d.execute_script(
+        "return (document.readyState==='complete') && (window.jQuery ? jQuery.active==0 : true)"
+    ))
+
+
+def _chrome_on_login_page(drv: "webdriver.Chrome") -> bool:
+    from selenium.webdriver.common.by import By
+    return LOGIN_PATH in drv.current_url or bool(drv.find_elements(By.ID, "password"))
+
+
+def _driver_alive(drv: "webdriver.Chrome") -> bool:
+    # Дешёвый round-trip до браузера: упавший Chrome/chromedriver не ответит
+    return drv.execute_script("return 1") == 1
+
+
+def _dispose_driver(drv: "webdriver.Chrome") -> None:
+    try:
+        drv.quit()
+    finally:
+        shutil.rmtree(getattr(drv, "profile_dir", ""), ignore_errors=True)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Воркеры: отдельные процессы с тем же AfishaScraper внутри
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Исключения, которые переживают переход между процессами по имени;
+# всё остальное приходит как ScrapeFailed
+_REMOTE_ERRORS = {cls.__name__: cls for cls in (AfishaAuthError, AfishaBlocked, PoolTimeout, ScrapeFailed)}
+
+
+def tree_rss(pid: int) -> int:
+    """RSS процесса вместе со всеми потомками (Chrome, chromedriver), байт; 0 — не Linux."""
+    children: dict[int, list[int]] = {}
+    rss: dict[int, int] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return 0
+    page = os.sysconf("SC_PAGE_SIZE")
+    for name in entries:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # после имени процесса в скобках: state ppid ... rss — 24-е поле
+        fields = stat[stat.rfind(b")") + 2:].split()
+        p = int(name)
+        children.setdefault(int(fields[1]), []).append(p)
+        rss[p] = int(fields[21]) * page
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        total += rss.get(p, 0)
+        stack.extend(children.get(p, ()))
+    return total
+
+
+class _Worker:
+    """Один дочерний процесс: сокет, поток чтения ответов, запросы в работе."""
+
+    def __init__(self, slot: int, config: dict, threads: int):
+        self.slot = slot
+        parent, child = socket.socketpair()
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(child.fileno()), str(slot)],
+            pass_fds=(child.fileno(),),
+            close_fds=True,
+        )
+        child.close()
+        # Connection владеет копией дескриптора; сам сокет держим, чтобы
+        # shutdown() разбудил поток чтения и дал воркеру EOF
+        self._sock = parent
+        self.conn = Connection(os.dup(parent.fileno()))
+        self.started = time.monotonic()
+        self.pending: dict[int, Future] = {}
+        self.draining = False
+        self.dead = False
+        self.served = 0
+        self.login: dict = {}
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.send(("config", config, threads))
+        self._reader = threading.Thread(target=self._read, name=f"scrape-{slot}-reader", daemon=True)
+        self._reader.start()
+
+    @property
+    def inflight(self) -> int:
+        return len(self.pending)
+
+    def send(self, msg) -> None:
+        with self._send_lock:
+            self.conn.send(msg)
+
+    def call(self, req_id: int, op: str, arg) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            if self.dead:
+                raise ScrapeFailed(f"воркер {self.slot} остановлен")
+            self.pending[req_id] = fut
+        try:
+            self.send((req_id, op, arg))
+        except OSError as e:
+            self._fail_all(f"воркер {self.slot} недоступен: {e}")
+        return fut
+
+    def _read(self) -> None:
+        while True:
+            try:
+                req_id, ok, payload, stages, self.login = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                fut = self.pending.pop(req_id, None)
+            self.served += 1
+            if fut is not None and not fut.done():
+                fut.set_result((ok, payload, stages))
+        self._fail_all(f"воркер {self.slot} завершился (код {self.proc.poll()})")
+
+    def _fail_all(self, why: str) -> None:
+        with self._lock:
+            self.dead = True
+            pending, self.pending = self.pending, {}
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(ScrapeFailed(why))
+
+    def alive(self) -> bool:
+        return not self.dead and self.proc.poll() is None
+
+    def stop(self, grace: float = 5.0) -> None:
+        """Закрыть сокет (воркер выйдет сам и закроет Chrome), не вышел — убить."""
+        self._hangup()
+        try:
+            self.proc.wait(grace)
+        except subprocess.TimeoutExpired:
+            self.kill()
+
+    def kill(self) -> None:
+        """Убить процесс и всех его потомков (зависший Chrome сам не уйдёт)."""
+        pids = _descendants(self.proc.pid)
+        self.proc.kill()
+        for pid in pids:
+            try:
+                os.kill(pid, 9)
+            except OSError:
+                pass
+        self.proc.wait()
+        self._hangup()
+        self._fail_all(f"воркер {self.slot} убит")
+
+    def _hangup(self) -> None:
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def _respawn_pause(crashes: int) -> float:
+    """Пауза перед перезапуском после crashes падений подряд: первое — сразу, дальше 2, 4, … до минуты."""
+    return min(2 ** (crashes - 1), 60) if crashes > 1 else 0
+
+
+def _descendants(pid: int) -> list[int]:
+    out, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                kids = [int(x) for x in f.read().split()]
+        except OSError:
+            kids = []
+        out.extend(kids)
+        stack.extend(kids)
+    return out
+
+
+class ScrapeWorkers:
+    """
+    Тот же интерфейс, что у AfishaScraper (load/warm/reload/stats/close),
+    но работа идёт в count дочерних процессах под присмотром.
+    """
+
+    def __init__(
+            self,
+            count: int,
+            config: dict,
+            threads: int = 8,
+            timeout: float = 90.0,
+            max_rss_mb: float = 1024,
+            check_interval: float = 2.0,
+    ):
+        self.count = count
+        self.timeout = timeout
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self._config = config
+        self._threads = threads
+        self._cookies = CookieFile(config["cookies_path"]) if config.get("cookies_path") else None
+        self._slots: list[Optional[_Worker]] = [None] * count
+        self._respawn_at = [0.0] * count
+        self._crashes = [0] * count
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.restarts = {"crash": 0, "timeout": 0, "memory": 0, "reload": 0}
+        self._check_interval = check_interval
+        self._supervisor: Optional[threading.Thread] = None
+        self._logins_before = 0     # входы уже заменённых воркеров
+
+    # ── запросы ──────────────────────────────────────────────────────────────
+
+    def load(self, path: str) -> str:
+        return self._call("load", path, self.timeout)
+
+    def warm(self) -> None:
+        """Поднять все воркеры и войти в админку (в первом; остальные возьмут куки)."""
+        self._ensure_supervisor()
+        for slot in range(self.count):
+            self._worker(slot)
+        self._call("warm", None, self.timeout)
+
+    def reload(self) -> int:
+        """Заменить все воркеры свежими (вместе с их браузерами) и войти заново."""
+        if self._cookies is not None:
+            self._cookies.clear()
+        with self._lock:
+            old = [w for w in self._slots if w is not None]
+            self._slots = [None] * self.count
+            self._respawn_at = [0.0] * self.count
+            self._crashes = [0] * self.count
+            for w in old:
+                self._retire(w)
+            self.restarts["reload"] += len(old)
+        for w in old:
+            threading.Thread(target=w.stop, name=f"scrape-{w.slot}-stop", daemon=True).start()
+        self.warm()
+        return len(old)
+
+    def stats(self) -> dict:
+        with self._lock:
+            workers = [w for w in self._slots if w is not None]
+        # входы считаются в воркерах; каждый присылает свои вместе с ответом
+        logins = [w.login for w in workers if w.login]
+        return {
+            "logins": self._logins_before + sum(st["logins"] for st in logins),
+            "failures": max((st["failures"] for st in logins), default=0),
+            "retry_in": max((st["retry_in"] for st in logins), default=0.0),
+            "workers": sum(w.alive() for w in workers),
+            "inflight": sum(w.inflight for w in workers),
+            "restarts": dict(self.restarts),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._slots = [w for w in self._slots if w is not None], [None] * self.count
+        for w in workers:
+            w.stop()
+
+    def _call(self, op: str, arg, timeout: float):
+        self._ensure_supervisor()
+        worker = self._pick()
+        t0 = time.perf_counter()
+        fut = worker.call(next(self._ids), op, arg)
+        try:
+            ok, payload, stages = fut.result(timeout)
+        except FutureTimeout:
+            log.warning("Воркер %d не ответил за %.0f с на %s %s — перезапускаю", worker.slot, timeout, op, arg)
+            self._replace(worker, "timeout")
+            raise ScrapeFailed(f"воркер не ответил за {timeout:.0f} с")
+        # этапы воркера — в трассу запроса бота; остальное — цена пересылки
+        for name, seconds in stages.items():
+            metrics.observe_stage(name, seconds)
+        metrics.observe_stage("scrape.ipc", max(0.0, time.perf_counter() - t0 - sum(stages.values())))
+        if ok:
+            return payload
+        name, message = payload
+        raise _REMOTE_ERRORS.get(name, ScrapeFailed)(message if name in _REMOTE_ERRORS else f"{name}: {message}")
+
+    # ── присмотр ─────────────────────────────────────────────────────────────
+
+    def _pick(self) -> _Worker:
+        """Живой воркер с наименьшим числом запросов в работе."""
+        best = None
+        for slot in range(self.count):
+            w = self._worker(slot)
+            if w is None or w.draining:
+                continue
+            if best is None or w.inflight < best.inflight:
+                best = w
+        if best is None:
+            raise ScrapeFailed("все воркеры парсинга перезапускаются")
+        return best
+
+    def _worker(self, slot: int) -> Optional[_Worker]:
+        """Воркер слота; если его нет или он умер — запустить (не чаще, чем позволяет пауза)."""
+        with self._lock:
+            if self._closed:
+                raise ScrapeFailed("парсинг остановлен")
+            w = self._slots[slot]
+            if w is not None and w.alive():
+                return w
+            if w is not None:
+                self._slots[slot] = None
+                self._retire(w)
+                self._crash(slot, w)
+            if time.monotonic() < self._respawn_at[slot]:
+                return None
+            w = self._slots[slot] = _Worker(slot, self._config, self._threads)
+            return w
+
+    def _retire(self, w: _Worker) -> None:
+        """Под локом: воркер уходит, его входы остаются в общем счёте."""
+        self._logins_before += w.login.get("logins", 0)
+
+    def _crash(self, slot: int, w: _Worker) -> None:
+        """Под локом: воркер умер сам. Падает сразу после старта — пауза растёт."""
+        self.restarts["crash"] += 1
+        self._crashes[slot] = self._crashes[slot] + 1 if time.monotonic() - w.started < 30 else 1
+        pause = _respawn_pause(self._crashes[slot])
+        self._respawn_at[slot] = time.monotonic() + pause
+        log.warning("Воркер парсинга %d упал (код %s), перезапуск через %d с", slot, w.proc.poll(), pause)
+
+    def _replace(self, w: _Worker, why: str) -> None:
+        with self._lock:
+            if self._slots[w.slot] is w:
+                self._slots[w.slot] = None
+                self._retire(w)
+            self.restarts[why] += 1
+        if why == "memory":
+            # допишет начатое уже без нас; ждать его выхода незачем
+            threading.Thread(target=w.stop, name=f"scrape-{w.slot}-stop", daemon=True).start()
+        else:
+            w.kill()
+
+    def _ensure_supervisor(self) -> None:
+        if self._supervisor is None:
+            with self._lock:
+                if self._supervisor is None:
+                    self._supervisor = threading.Thread(target=self._supervise, name="scrape-supervisor", daemon=True)
+                    self._supervisor.start()
+
+    def _supervise(self) -> None:
+        while not self._closed:
+            time.sleep(self._check_interval)
+            for slot in range(self.count):
+                with self._lock:
+                    w = self._slots[slot]
+                if w is None:
+                    continue
+                if not w.alive():
+                    try:
+                        self._worker(slot)     # перезапуск, не дожидаясь следующего запроса
+                    except Exception:
+                        log.exception("Воркер парсинга %d не запустился", slot)
+                    continue
+                if not w.draining and self.max_rss and tree_rss(w.proc.pid) > self.max_rss:
+                    log.warning("Воркер парсинга %d занял больше %d МБ — заменяю", slot, self.max_rss >> 20)
+                    w.draining = True
+                if w.draining and not w.inflight:
+                    try:
+                        self._replace(w, "memory")
+                        self._worker(slot)
+                    except Exception:
+                        log.exception("Воркер парсинга %d не заменился", slot)
+
+
+def _worker_main(fd: int, slot: int) -> None:
+    """Внутри дочернего процесса: принимать запросы, отвечать, пока бот жив."""
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        format=f"%(asctime)s | %(levelname)s | scrape-{slot} | %(message)s",
+    )
+    conn = Connection(fd)
+    _, config, threads = conn.recv()
+    scraper = AfishaScraper(**config)
+    send_lock = threading.Lock()
+
+    def handle(req_id: int, op: str, arg) -> None:
+        try:
+            with metrics.collect() as stages:
+                if op == "load":
+                    result = (True, scraper.load(arg))
+                elif op == "warm":
+                    result = (True, scraper.warm())
+                else:
+                    raise ValueError(f"неизвестная операция {op}")
+        except Exception as e:
+            result = (False, (type(e).__name__, str(e)))
+        with send_lock:
+            conn.send((req_id, *result, stages, scraper.stats()))
+
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="scrape")
+    try:
+        while True:
+            try:
+                req_id, op, arg = conn.recv()
+            except (EOFError, OSError):
+                break       # бот закрыл сокет или умер
+            pool.submit(handle, req_id, op, arg)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        scraper.close()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Самопроверка: воркеры против подделки админки
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _asserts() -> None:
+    """Детерминированная часть: пауза перезапуска и память дерева процессов."""
+    assert [_respawn_pause(n) for n in range(1, 9)] == [0, 2, 4, 8, 16, 32, 60, 60]
+
+    # процесс с 64 МБ и ребёнком — как воркер со своим Chrome
+    child = subprocess.Popen(
+        [sys.executable, "-c",
+         "import subprocess, sys, time\n"
+         "kid = subprocess.Popen(['sleep', '30'])\n"
+         "buf = b'x' * (64 << 20)\n"
+         "print(kid.pid, flush=True)\n"
+         "time.sleep(30)\n"],
+        stdout=subprocess.PIPE,
+    )
+    kid = int(child.stdout.readline())
+    try:
+        assert _descendants(child.pid) == [kid]
+        if sys.platform.startswith("linux"):
+            alone, both = tree_rss(kid), tree_rss(child.pid)
+            assert alone > 0 and both >= alone + (64 << 20), (alone, both)
+    finally:
+        os.kill(kid, signal.SIGKILL)
+        child.kill()
+        child.wait()
+    print("ok   пауза перезапуска 0 → 2 → … → 60 с, память воркера вместе с потомками (assert)")
+
+
+def _selfcheck() -> int:
+    from loadtest import FakeAfisha
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    fake = FakeAfisha(shows_per_month=5, latency=0.1, jitter=0)
+    config = {
+        "base_url": fake.url, "email": "load", "password": "load", "engine": "http",
+        "page_marker": "pull-right", "pool_size": 1,
+        "cookies_path": os.path.join(tempfile.mkdtemp(prefix="scrape-workers-"), "cookies.json"),
+    }
+    path = f"/admin/events/info/{fake.codes()[0]}"
+    workers = ScrapeWorkers(2, config, timeout=3, max_rss_mb=0, check_interval=0.3)
+    problems = []
+
+    def expect(what: str, ok: bool, detail="") -> None:
+        print(f"{'ok ' if ok else 'ОШИБКА'}  {what}" + (f": {detail}" if detail != "" else ""))
+        if not ok:
+            problems.append(what)
+
+    def burst(n: int = 20) -> list:
+        with ThreadPoolExecutor(n) as pool:
+            return list(pool.map(lambda _: _try(workers.load, path), range(n)))
+
+    try:
+        t0 = time.perf_counter()
+        workers.warm()
+        expect("два воркера подняты, вход один", fake.logins == 1 and workers.stats()["workers"] == 2,
+               f"{time.perf_counter() - t0:.2f} с, входов {fake.logins}")
+        res = burst()
+        served = [w.served for w in workers._slots]
+        expect("20 запросов разом, все ответы", sum(isinstance(r, str) for r in res) == 20,
+               f"распределение по воркерам {served}")
+
+        fake.expire()
+        res = burst()
+        expect("сессия истекла у обоих: повторный вход один", fake.logins == 2 and all(isinstance(r, str) for r in res),
+               f"входов {fake.logins}")
+
+        # воркер «завис»: админка молчит дольше таймаута
+        fake.latency = 5
+        t0 = time.perf_counter()
+        err = _try(workers.load, path)
+        took = time.perf_counter() - t0
+        fake.latency = 0.1
+        expect("зависший запрос: ScrapeFailed за таймаут", isinstance(err, ScrapeFailed) and took < 4,
+               f"{type(err).__name__} за {took:.1f} с")
+        time.sleep(1)
+        expect("зависший воркер заменён, следующий запрос проходит",
+               isinstance(_try(workers.load, path), str), workers.stats())
+
+        # воркер упал
+        victim = workers._slots[0]
+        os.kill(victim.proc.pid, 9)
+        time.sleep(1)
+        res = burst(6)
+        expect("упавший воркер перезапущен", all(isinstance(r, str) for r in res) and workers.stats()["workers"] == 2,
+               workers.stats())
+
+        # лимит памяти: 1 МБ — меньше любого питона, воркеры уходят на замену по очереди
+        workers.max_rss = 1 << 20
+        time.sleep(1.5)
+        workers.max_rss = 0
+        res = burst(6)
+        expect("замена по памяти без потерь запросов",
+               workers.restarts["memory"] >= 2 and all(isinstance(r, str) for r in res), workers.stats())
+    finally:
+        workers.close()
+        fake.close()
+
+    print("OK" if not problems else f"ПРОБЛЕМЫ: {', '.join(problems)}")
+    return 1 if problems else 0
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Chrome: lean против обычного на записанных страницах админки
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _png(width: int, height: int) -> bytes:
+    """Однотонный PNG: на диске — сотни байт, в памяти рендерера — width×height×4."""
+    import zlib
+    import struct
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    raw = (b"\x00" + b"\xc8\x60\x30" * width) * height
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b""))
+
+
+def _bench_chrome(pages: int = 30) -> int:
+    from loadtest import FakeAfisha, FakeServer, Response
+
+    # как у настоящей админки: стили, шрифт, баннеры, свой скрипт и чужой счётчик
+    assets = {
+        "/static/admin.css": (0.15, "text/css", b"@font-face{font-family:A;src:url(/static/a.woff2)}body{font-family:A}"),
+        "/static/a.woff2": (0.25, "font/woff2", os.urandom(64 * 1024)),
+        "/static/admin.js": (0.05, "application/javascript", b"window.admin=1;"),
+        "/static/banner.png": (0.1, "image/png", _png(1600, 900)),
+    }
+
+    class Tracker(FakeServer):
+        def handle(self, req):
+            time.sleep(1.0)
+            return Response(b"window.counter=1;", ctype="application/javascript")
+
+    tracker = Tracker(jitter=0)
+    head = (b'<html><head><link rel="stylesheet" href="/static/admin.css">'
+            b'<script src="/static/admin.js"></script></head><body>')
+    tail = ("".join(f'<img src="/static/banner.png?n={i}">' for i in range(8))
+            + f'<script src="http://localhost:{tracker.server.server_port}/tag.js"></script>'
+            + '</body></html>').encode()
+
+    class Recorded(FakeAfisha):
+        def handle(self, req):
+            path = req.path.split("?", 1)[0]
+            if path in assets:
+                delay, ctype, body = assets[path]
+                time.sleep(delay)
+                return Response(body, ctype=ctype)
+            rsp = super().handle(req)
+            if rsp.ctype.startswith("text/html"):
+                rsp.body = head + rsp.body.replace(b"<html><body>", b"").replace(b"</body></html>", b"") + tail
+            return rsp
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    fake = Recorded(shows_per_month=10, latency=0.05, jitter=0)
+    month = datetime.now().strftime("%m.%Y")
+    paths = [f"/admin/events/info/{c}" for c in fake.codes()] + [f"/admin/events/menu_date?date={month}"]
+    rows = {}
+    try:
+        for lean in (False, True):
+            scraper = AfishaScraper(
+                fake.url, "load", "load", engine="selenium", page_marker="pull-right", pool_size=1,
+                cookies_path=os.path.join(tempfile.mkdtemp(prefix="lean-bench-"), "cookies.json"),
+                lean=lean, lean_block=(f"*localhost:{tracker.server.server_port}*",),
+            )
+            try:
+                scraper.warm()
+                lat = []
+                for i in range(pages):
+                    t0 = time.perf_counter()
+                    html = scraper.load(paths[i % len(paths)])
+                    lat.append(time.perf_counter() - t0)
+                    if "pull-right text-primary" not in html:
+                        raise ScrapeFailed(f"страница без шапки: {paths[i % len(paths)]}")
+                with scraper.drivers.session() as drv:
+                    rss = tree_rss(drv.service.process.pid)
+            finally:
+                scraper.close()
+            lat.sort()
+            rows[lean] = (lat[len(lat) // 2], lat[int(len(lat) * 0.95)], rss)
+    finally:
+        fake.close()
+        tracker.close()
+
+    for lean, (p50, p95, rss) in rows.items():
+        print(f"{'lean   ' if lean else 'обычный'}  готова: p50 {p50 * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс; "
+              f"Chrome {rss / (1 << 20):.0f} МБ")
+    (b50, _, brss), (l50, _, lrss) = rows[False], rows[True]
+    print(f"lean: быстрее в {b50 / l50:.1f} раза, памяти {lrss / brss:.0%} от обычного" if brss else "")
+    return 0 if l50 < b50 else 1
+
+
+def _try(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return e
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--worker"]:
+        _worker_main(int(sys.argv[2]), int(sys.argv[3]))
+    elif sys.argv[1:2] == ["--bench-chrome"]:
+        sys.exit(_bench_chrome(*map(int, sys.argv[2:3])))
+    else:
+        _asserts()
+        sys.exit(_selfcheck())
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+"""
+Сессия админки: куки на диске и повторный вход без толпы.
+
+Админка время от времени разлогинивает (истёк срок, сменили пароль,
+перезапустили их сервер). Раньше это лечилось только перезапуском бота.
+Теперь:
+
+    cookies = CookieFile(os.path.join(DATA_DIR, "afisha_cookies.json"))
+    guard = LoginGuard(backoff=5, max_backoff=300)
+
+    gen = guard.generation
+    ...запрос упёрся в форму входа...
+    guard.ensure(gen, do_login)     # войдёт ровно один поток, остальные
+                                    # подождут и возьмут его куки
+
+После удачного входа куки пишутся в CookieFile — перезапущенный бот и
+новые браузеры из пула берут их оттуда и форму входа не видят вовсе.
+Неудачный вход не повторяется сразу: следующая попытка — не раньше чем
+через backoff, и пауза удваивается до max_backoff (чтобы не словить бан
+за перебор паролей, когда логин и правда сломан).
+
+С LoginGuard(cookies=...) вход single-flight и между процессами (воркеры
+парсинга): логин идёт под файловым замком, и если, пока ждали замок,
+файл кук обновил соседний процесс, — сами не логинимся, берём его куки.
+
+Проверка: сначала LoginGuard на подставных часах (assert — single-flight,
+пауза после неудач, вход соседнего процесса), потом HTTP-клиент против
+подделки админки, которая сбрасывает сессии по команде; код выхода 1 —
+что-то не так:
+
+    python afisha_session.py
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Optional
+
+log = logging.getLogger("neuroseagull.session")
+
+# Поля куки, которые понимают и requests, и Selenium (add_cookie)
+_COOKIE_FIELDS = ("name", "value", "domain", "path", "secure", "expiry")
+
+
+class LoginBackoff(Exception):
+    """Прошлый вход не удался, новая попытка пока отложена."""
+
+
+class CookieFile:
+    """Куки админки в JSON-файле: список словарей в формате Selenium."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> list[dict]:
+        """Сохранённые и ещё не истёкшие куки; [] — если файла нет или он битый."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                cookies = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError):
+            log.warning("Не читаются сохранённые куки %s, войду заново", self.path)
+            return []
+        now = time.time()
+        return [c for c in cookies if not c.get("expiry") or c["expiry"] > now]
+
+    def save(self, cookies: list[dict]) -> None:
+        data = [{k: c[k] for k in _COOKIE_FIELDS if c.get(k) is not None} for c in cookies]
+        tmp = self.path + ".tmp"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.chmod(tmp, 0o600)       # это фактически пароль от кабинета
+            os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def version(self) -> int:
+        """Меняется при каждой записи; 0 — файла нет."""
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def locked(self):
+        """Межпроцессный замок на время входа (flock на соседнем .lock-файле)."""
+        import fcntl
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def cookies_from_jar(jar) -> list[dict]:
+    """requests.cookies.RequestsCookieJar → список словарей как у Selenium."""
+    return [
+        {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+         "secure": c.secure, "expiry": c.expires}
+        for c in jar
+    ]
+
+
+def cookies_to_jar(jar, cookies: list[dict]) -> None:
+    for c in cookies:
+        jar.set(c["name"], c["value"], domain=c.get("domain", ""), path=c.get("path", "/"),
+                secure=c.get("secure", False), expires=c.get("expiry"))
+
+
+class LoginGuard:
+    """
+    Single-flight повторного входа с нарастающей паузой после неудач.
+
+    generation растёт при каждом удачном входе (с cookies= — и когда файл
+    кук переписал соседний процесс). Вызывающий запоминает её
+    до запроса и передаёт в ensure(): если за это время кто-то уже вошёл,
+    логин не повторяется — достаточно взять свежие куки.
+
+    Сам вход идёт под _login_lock, состояние — под коротким _lock: пока
+    логин висит, generation и stats() (а с ними /metrics) отвечают сразу.
+    """
+
+    def __init__(self, backoff: float = 5.0, max_backoff: float = 300.0,
+                 cookies: Optional[CookieFile] = None, clock: Callable[[], float] = time.monotonic):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._cookies = cookies
+        self._cookies_version = cookies.version() if cookies else 0
+        self._clock = clock
+        self._lock = threading.Lock()          # состояние: короткие чтения/записи
+        self._login_lock = threading.Lock()    # single-flight: сам вход
+        self._logging_in = False
+        self._generation = 0
+        self._failures = 0
+        self._retry_at = 0.0
+        self.logins = 0
+        self.last_error = ""
+
+    @property
+    def generation(self) -> int:
+        # куки на диске новее наших — вошёл соседний процесс: это тоже новое поколение
+        # (пока входим сами, файл пишет наш же login() — это поколение засчитает ensure)
+        if self._cookies is not None and self._cookies.version() != self._cookies_version:
+            with self._lock:
+                version = self._cookies.version()
+                if version != self._cookies_version and not self._logging_in:
+                    self._cookies_version = version
+                    self._generation += 1
+        return self._generation
+
+    def ensure(self, seen_generation: int, login: Callable[[], None]) -> int:
+        """Войти, если с seen_generation никто не входил; вернуть текущее поколение."""
+        with self._login_lock, self._cookies.locked() if self._cookies else nullcontext():
+            with self._lock:
+                if self._cookies and self._cookies.version() != self._cookies_version:
+                    # соседний процесс уже вошёл, пока ждали замок
+                    self._cookies_version = self._cookies.version()
+                    self._generation += 1
+                if self._generation != seen_generation:
+                    return self._generation
+                wait = self._retry_at - self._clock()
+                if wait > 0:
+                    raise LoginBackoff(f"вход не удался ({self.last_error}), повтор через {wait:.0f} с")
+                self._logging_in = True
+            try:
+                login()
+            except Exception as e:
+                with self._lock:
+                    self._logging_in = False
+                    self._failures += 1
+                    pause = min(self.backoff * 2 ** (self._failures - 1), self.max_backoff)
+                    self._retry_at = self._clock() + pause
+                    self.last_error = str(e) or type(e).__name__
+                log.warning("Вход в админку не удался (%s), следующая попытка через %.0f с", self.last_error, pause)
+                raise
+            with self._lock:
+                self._logging_in = False
+                if self._cookies:
+                    self._cookies_version = self._cookies.version()
+                self._failures = 0
+                self._retry_at = 0.0
+                self.last_error = ""
+                self.logins += 1
+                self._generation += 1
+                return self._generation
+
+    def reset(self) -> None:
+        """Забыть паузу после неудач (ручная перезагрузка: пароль могли исправить)."""
+        with self._lock:
+            self._failures = 0
+            self._retry_at = 0.0
+            self._cookies_version = self._cookies.version() if self._cookies else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "generation": self._generation,
+                "logins": self.logins,
+                "failures": self._failures,
+                "retry_in": max(0.0, round(self._retry_at - self._clock(), 1)),
+            }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Самопроверка: подделка админки из loadtest.py, сессии сбрасываются по команде
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _asserts() -> None:
+    """Детерминированная часть: LoginGuard на подставных часах, без сети."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    now = [0.0]
+    guard = LoginGuard(backoff=5, max_backoff=12, clock=lambda: now[0])
+    logins = []
+
+    def login() -> None:
+        logins.append(now[0])
+        time.sleep(0.05)            # пока входим, остальные упираются в лок
+
+    def broken() -> None:
+        raise RuntimeError("снова форма входа")
+
+    # single-flight: десять потоков с одним поколением — один вход
+    gen = guard.generation
+    with ThreadPoolExecutor(10) as pool:
+        gens = list(pool.map(lambda _: guard.ensure(gen, login), range(10)))
+    assert len(logins) == 1 and gens == [1] * 10, (logins, gens)
+    # старое поколение: кто-то уже вошёл — не входим
+    assert guard.ensure(0, login) == 1 and len(logins) == 1
+
+    # вход завис — состояние всё равно читается сразу
+    release = threading.Event()
+    hung = threading.Thread(target=guard.ensure, args=(1, release.wait))
+    hung.start()
+    while not guard._logging_in:
+        time.sleep(0.001)
+    got = []
+    reader = threading.Thread(target=lambda: got.append((guard.generation, guard.stats()["logins"])), daemon=True)
+    reader.start()
+    reader.join(1)
+    assert got == [(1, 1)], got
+    release.set()
+    hung.join()
+    assert guard.generation == 2 and guard.logins == 2
+
+    # неудачи: пауза 5, 10, потолок 12; пока она идёт — ни одной попытки
+    gen = guard.generation
+    pauses = []
+    for _ in range(4):
+        assert isinstance(_try(guard.ensure, gen, broken), RuntimeError)
+        pauses.append(guard.stats()["retry_in"])
+        assert isinstance(_try(guard.ensure, gen, broken), LoginBackoff)
+        now[0] += pauses[-1]
+    assert pauses == [5, 10, 12, 12], pauses
+    assert guard.ensure(gen, login) == gen + 1 and guard.stats()["failures"] == 0
+
+    # reset() (кнопка перезагрузки) снимает паузу сразу
+    gen = guard.generation
+    assert isinstance(_try(guard.ensure, gen, broken), RuntimeError)
+    guard.reset()
+    assert guard.ensure(gen, login) == gen + 1
+
+    # два процесса на одном файле кук: второй берёт куки первого, а не входит сам
+    cookies = CookieFile(os.path.join(tempfile.mkdtemp(prefix="afisha-session-"), "cookies.json"))
+    first, second = LoginGuard(cookies=cookies), LoginGuard(cookies=cookies)
+    seen = second.generation
+    first.ensure(first.generation, lambda: cookies.save([{"name": "sid", "value": "1"}]))
+    assert second.ensure(seen, broken) == seen + 1 and second.logins == 0
+    print("ok   LoginGuard: single-flight, stats() во время входа, пауза 5 → 10 → 12 с, "
+          "вход соседнего процесса (assert)")
+
+
+def _selfcheck() -> int:
+    from concurrent.futures import ThreadPoolExecutor
+    from afisha_http import AfishaHttpClient, AfishaAuthError
+    from loadtest import FakeAfisha
+    # классы — из модуля, а не из __main__, иначе исключения не совпадут с afisha_http
+    from afisha_session import CookieFile, LoginGuard
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    fake = FakeAfisha(shows_per_month=3, latency=0.05, jitter=0)
+    code = fake.codes()[0]
+    path = f"/admin/events/info/{code}"
+    cookies = CookieFile(os.path.join(tempfile.mkdtemp(prefix="afisha-session-"), "cookies.json"))
+    problems = []
+
+    def fetch_all(client: AfishaHttpClient, n: int = 20) -> list:
+        with ThreadPoolExecutor(n) as pool:
+            return list(pool.map(lambda _: _try(client.get_page, path, "pull-right"), range(n)))
+
+    def expect(what: str, got, want) -> None:
+        ok = got == want
+        print(f"{'ok ' if ok else 'ОШИБКА'}  {what}: {got}" + ("" if ok else f" (ждали {want})"))
+        if not ok:
+            problems.append(what)
+
+    try:
+        guard = LoginGuard(backoff=0.5, max_backoff=2)
+        client = AfishaHttpClient(fake.url, "load", "load", guard=guard, cookies=cookies, pool_size=20)
+        res = fetch_all(client)
+        expect("холодный старт, 20 запросов разом: входов", fake.logins, 1)
+        expect("все получили страницу", sum(isinstance(r, str) for r in res), 20)
+
+        fake.expire()
+        fetch_all(client)
+        expect("сессия сброшена, 20 запросов: новых входов", fake.logins, 2)
+        client.close()
+
+        # «перезапуск процесса»: новый клиент, куки с диска
+        restarted = AfishaHttpClient(fake.url, "load", "load", guard=LoginGuard(), cookies=cookies, pool_size=20)
+        res = fetch_all(restarted)
+        expect("после перезапуска по сохранённым кукам: входов", fake.logins, 2)
+        expect("все получили страницу", sum(isinstance(r, str) for r in res), 20)
+
+        # пароль сменили: вход ломается, толпа не должна долбить форму
+        fake.password = "changed"
+        fake.expire()
+        before = fake.logins_failed
+        res = fetch_all(restarted)
+        res += fetch_all(restarted)
+        expect("неверный пароль, 40 запросов: попыток входа", fake.logins_failed - before, 1)
+        expect("все получили отказ", sum(isinstance(r, AfishaAuthError) for r in res), 40)
+
+        # пароль исправили, «🔄 Перезагрузить» сбрасывает паузу и куки — вход сразу
+        fake.password = "load"
+        restarted.reset()
+        res = fetch_all(restarted)
+        expect("после перезагрузки входов", fake.logins, 3)
+        expect("все получили страницу", sum(isinstance(r, str) for r in res), 20)
+        restarted.close()
+    finally:
+        fake.close()
+
+    print("OK" if not problems else f"ПРОБЛЕМЫ: {', '.join(problems)}")
+    return 1 if problems else 0
+
+
+def _try(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return e
+
+
+if __name__ == "__main__":
+    log.setLevel(logging.ERROR)         # неудачные входы в _asserts() ожидаемы
+    _asserts()
+    log.setLevel(logging.NOTSET)
+    sys.exit(_selfcheck())
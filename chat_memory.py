@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+Память диалогов с GPT: ограниченная по токенам и по общему объёму.
+
+• у каждого пользователя — свежие реплики в пределах history_tokens;
+  всё, что старше, сворачивается в краткое содержание (summarize) в
+  фоне, так что промпт не растёт, а контекст не пропадает;
+• в памяти процесса держится не больше max_total_tokens на всех;
+  дольше всех молчавшие выгружаются (LRU), как и те, кто молчит дольше
+  idle_ttl. Выгруженный разговор остаётся в хранилище (load/save) и
+  поднимается, когда пользователь снова напишет.
+
+Токены считает tiktoken, если он установлен, иначе — оценка по длине
+текста (для русского ~2.5 символа на токен). Словарь tiktoken грузится
+при первом подсчёте, а не при импорте.
+"""
+
+import time
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+log = logging.getLogger("neuroseagull.memory")
+
+# Служебные токены на каждое сообщение в chat-формате
+_MSG_OVERHEAD = 4
+
+Turn = tuple[str, str]      # (role, content)
+
+
+@functools.cache
+def _encoder():
+    try:
+        import tiktoken
+    except ImportError:     # не обязателен: есть оценка по длине
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:       # нет кэша словаря и сети — живём на оценке
+        log.warning("tiktoken недоступен, токены считаются по длине текста")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoder()
+    if enc is not None:
+        return len(enc.encode(text)) + _MSG_OVERHEAD
+    return int(len(text) / 2.5) + 1 + _MSG_OVERHEAD
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    """Хвост текста не длиннее limit токенов (для запасного «содержания»)."""
+    if count_tokens(text) <= limit:
+        return text
+    enc = _encoder()
+    if enc is not None:
+        return enc.decode(enc.encode(text)[-(limit - _MSG_OVERHEAD):])
+    return text[-int((limit - _MSG_OVERHEAD - 1) * 2.5):]
+
+
+@dataclass
+class Conversation:
+    summary: str = ""
+    turns: list[Turn] = field(default_factory=list)
+    tokens: int = 0                 # реплики + содержание
+    last_used: float = 0.0
+    compacting: bool = False
+
+    def to_dict(self) -> dict:
+        return {"summary": self.summary, "turns": [list(t) for t in self.turns]}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Conversation":
+        conv = cls(summary=d.get("summary", ""), turns=[tuple(t) for t in d.get("turns", [])])
+        conv.tokens = (count_tokens(conv.summary) if conv.summary else 0) + \
+            sum(count_tokens(c) for _, c in conv.turns)
+        return conv
+
+
+class ChatMemory:
+    def __init__(
+            self,
+            summarize: Callable[[str, list[Turn]], str],
+            load: Callable[[int], Optional[dict]] = lambda uid: None,
+            save: Callable[[int, dict], None] = lambda uid, d: None,
+            unload: Callable[[int], None] = lambda uid: None,
+            history_tokens: int = 1500,
+            summary_tokens: int = 300,
+            max_total_tokens: int = 500_000,
+            idle_ttl: float = 86400.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_total_tokens = max_total_tokens
+        self.idle_ttl = idle_ttl
+        self._summarize = summarize
+        self._load = load
+        self._save = save
+        self._unload = unload
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._convs: OrderedDict[int, Conversation] = OrderedDict()   # от давних к свежим
+        self._total = 0
+        self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-compact")
+        self._evicted = 0
+
+    def messages(self, uid: int, system: str, text: str) -> list[dict]:
+        """Промпт: персона, содержание прошлого, свежие реплики, новый вопрос."""
+        with self._lock:
+            conv = self._get(uid)
+            summary, turns = conv.summary, list(conv.turns)
+        # свежие реплики, сколько влезает в бюджет (пока идёт сжатие, их бывает больше)
+        recent: list[Turn] = []
+        budget = self.history_tokens
+        for role, content in reversed(turns):
+            budget -= count_tokens(content)
+            if budget < 0:
+                break
+            recent.append((role, content))
+        msgs = [{"role": "system", "content": system}]
+        if summary:
+            msgs.append({"role": "system", "content": f"Коротко о чём говорили раньше: {summary}"})
+        msgs += [{"role": r, "content": c} for r, c in reversed(recent)]
+        msgs.append({"role": "user", "content": text})
+        return msgs
+
+    def add_turn(self, uid: int, text: str, reply: str) -> None:
+        with self._lock:
+            conv = self._get(uid)
+            for role, content in (("user", text), ("assistant", reply)):
+                if content:
+                    conv.turns.append((role, content))
+                    self._grow(conv, count_tokens(content))
+            old = self._trim(conv)
+            if old and not conv.compacting:
+                conv.compacting = True
+                self._compactor.submit(self._compact, uid, conv, conv.summary, old)
+            elif old:
+                # содержание уже пересчитывается — доложим эти реплики следующим заходом
+                conv.turns[:0] = old
+                self._grow(conv, sum(count_tokens(c) for _, c in old))
+            data = conv.to_dict()
+            self._evict()
+        self._save(uid, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._convs), "tokens": self._total, "evicted": self._evicted}
+
+    # ── внутреннее (под self._lock) ──────────────────────────────────────────
+
+    def _get(self, uid: int) -> Conversation:
+        conv = self._convs.get(uid)
+        if conv is None:
+            data = self._load(uid)
+            conv = Conversation.from_dict(data) if data else Conversation()
+            self._convs[uid] = conv
+            self._total += conv.tokens
+        self._convs.move_to_end(uid)
+        conv.last_used = self._clock()
+        return conv
+
+    def _grow(self, conv: Conversation, delta: int) -> None:
+        conv.tokens += delta
+        self._total += delta
+
+    def _trim(self, conv: Conversation) -> list[Turn]:
+        """Снять с начала реплики сверх бюджета (с запасом, чтобы не сжимать каждый ход)."""
+        history = conv.tokens - (count_tokens(conv.summary) if conv.summary else 0)
+        if history <= self.history_tokens:
+            return []
+        old: list[Turn] = []
+        target = self.history_tokens * 3 // 4
+        while conv.turns and history > target:
+            role, content = conv.turns.pop(0)
+            n = count_tokens(content)
+            history -= n
+            self._grow(conv, -n)
+            old.append((role, content))
+        return old
+
+    def _evict(self) -> None:
+        idle_before = self._clock() - self.idle_ttl
+        while self._convs:
+            uid, conv = next(iter(self._convs.items()))
+            if self._total <= self.max_total_tokens and conv.last_used >= idle_before:
+                break
+            if len(self._convs) == 1 and conv.last_used >= idle_before:
+                break       # единственный активный разговор не выкидываем
+            del self._convs[uid]
+            self._total -= conv.tokens
+            self._evicted += 1
+            self._unload(uid)
+
+    # ── фоновое сжатие ───────────────────────────────────────────────────────
+
+    def _compact(self, uid: int, conv: Conversation, summary: str, old: list[Turn]) -> None:
+        try:
+            new = self._summarize(summary, old).strip()
+        except Exception:
+            log.exception("Память диалога: не удалось сжать историю %s", uid)
+            new = " ".join(filter(None, [summary] + [c for _, c in old]))
+        new = truncate_tokens(new, self.summary_tokens)
+        with self._lock:
+            conv.compacting = False
+            current = self._convs.get(uid)
+            if current is None:
+                # разговор выгрузили, пока считали — содержание всё равно сохраняем
+                conv.summary = new
+                data = conv.to_dict()
+            else:
+                # могли выгрузить и поднять заново — правим актуальный объект
+                self._grow(current, (count_tokens(new) if new else 0) -
+                           (count_tokens(current.summary) if current.summary else 0))
+                current.summary = new
+                data = current.to_dict()
+        self._save(uid, data)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+Полосы исполнения для хэндлеров.
+
+Каждая полоса — свой набор рабочих потоков и своя ограниченная очередь,
+поэтому минутная генерация видео не занимает потоки, нужные для проверки
+билетов. Внутри полосы задачи одного чата выполняются строго по порядку
+(следующая стартует только после предыдущей), а разные чаты — параллельно.
+Если очередь полосы полна, submit() сразу возвращает False — вызывающий
+отвечает пользователю «занято» вместо бесконечного ожидания.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable
+
+log = logging.getLogger("neuroseagull.lanes")
+
+
+@dataclass(slots=True)
+class _Task:
+    fn: Callable
+    args: tuple
+    kwargs: dict
+    enqueued: float
+
+
+@dataclass
+class _LaneStats:
+    submitted: int = 0
+    rejected: int = 0
+    completed: int = 0
+    failed: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    recent_waits: deque = field(default_factory=lambda: deque(maxlen=512))
+
+
+class Lane:
+    def __init__(self, name: str, workers: int, queue_limit: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._clock = clock
+        self._cond = threading.Condition()
+        # ключ (чат) → его ещё не начатые задачи; ключ есть, пока чат в ready или выполняется
+        self._pending: dict[Hashable, deque[_Task]] = {}
+        self._ready: deque[Hashable] = deque()
+        self._queued = 0
+        self._active = 0
+        self._threads: list[threading.Thread] = []
+        self._stats = _LaneStats()
+
+    def submit(self, key: Hashable, fn: Callable, *args: Any, **kwargs: Any) -> bool:
+        task = _Task(fn, args, kwargs, self._clock())
+        with self._cond:
+            if self._queued >= self.queue_limit:
+                self._stats.rejected += 1
+                return False
+            q = self._pending.get(key)
+            if q is None:
+                self._pending[key] = deque([task])
+                self._ready.append(key)
+            else:
+                q.append(task)
+            self._queued += 1
+            self._stats.submitted += 1
+            self._ensure_workers()
+            self._cond.notify()
+        return True
+
+    def _ensure_workers(self) -> None:
+        # потоки поднимаем при первой задаче: полоса без нагрузки ничего не стоит
+        while len(self._threads) < self.workers:
+            t = threading.Thread(
+                target=self._work, name=f"lane-{self.name}-{len(self._threads)}", daemon=True,
+            )
+            self._threads.append(t)
+            t.start()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                task = self._pending[key].popleft()
+                self._queued -= 1
+                self._active += 1
+                waited = self._clock() - task.enqueued
+                st = self._stats
+                st.wait_total += waited
+                st.wait_max = max(st.wait_max, waited)
+                st.recent_waits.append(waited)
+
+            ok = True
+            try:
+                task.fn(*task.args, **task.kwargs)
+            except Exception:
+                ok = False
+                log.exception("lane %s: ошибка в задаче %s", self.name, getattr(task.fn, "__name__", task.fn))
+
+            with self._cond:
+                self._active -= 1
+                self._stats.completed += 1
+                self._stats.failed += int(not ok)
+                if self._pending[key]:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._pending[key]
+
+    def stats(self) -> dict:
+        with self._cond:
+            st = self._stats
+            waits = sorted(st.recent_waits)
+            started = st.completed + self._active
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "queued": self._queued,
+                "active": self._active,
+                "submitted": st.submitted,
+                "rejected": st.rejected,
+                "completed": st.completed,
+                "failed": st.failed,
+                "wait_avg": st.wait_total / started if started else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": st.wait_max,
+            }
+
+
+class Dispatcher:
+    """Набор именованных полос и единая точка отправки задач."""
+
+    def __init__(self, lanes: dict[str, tuple[int, int]]):
+        self.lanes = {name: Lane(name, w, q) for name, (w, q) in lanes.items()}
+
+    def submit(self, lane: str, key: Hashable, fn: Callable, *args: Any, **kwargs: Any) -> bool:
+        return self.lanes[lane].submit(key, fn, *args, **kwargs)
+
+    def stats(self) -> dict[str, dict]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
@@ -0,0 +1,864 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Нагрузочный прогон бота без сети и без настоящих ключей.
+
+Поднимаются локальные подделки Bot API Telegram, OpenAI (чат, распознавание
+и синтез речи, картинки), Replicate и админки афиши — с настраиваемыми
+задержками. Бот запускается отдельным процессом и смотрит на них через
+TELEGRAM_API_URL / OPENAI_BASE_URL / REPLICATE_API_URL / AFISHA_BASE_URL.
+Дальше N «пользователей» параллельно жмут «🔍 Проверить билеты», спрашивают
+продажи по коду (и следом /trend по нему), ищут показы inline-запросом,
+болтают, шлют голосовые и просят картинки и видео. Время
+считается от момента, когда апдейт отдан боту, до нужного ответа в чате.
+
+    python loadtest.py --actors 20 --duration 60
+    python loadtest.py --runtime async --save baseline.json
+    python loadtest.py --baseline baseline.json --tolerance 0.25   # перед выкладкой
+
+Первым шагом меряется запуск: /start лежит в очереди ещё до старта
+процесса, и время до ответа на него — это «первый ответ после рестарта»
+(шаг startup, предел --max-startup). С --expire-every подделка админки
+посреди прогона сбрасывает сессии — бот должен сам войти заново, по разу
+на каждый сброс, без ошибок у пользователей. С --openai-faults подделка
+OpenAI отвечает 500/429 и зависает — ответы должны доходить за счёт
+повторов и подстраховки, а не висеть до --timeout.
+
+Код выхода: 0 — всё в пределах порогов, 1 — регрессия или ошибки
+(ответ не пришёл за --timeout), 2 — бот не поднялся.
+"""
+
+import os
+import sys
+import json
+import time
+import email
+import random
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:loadtest"
+
+# Чем заканчивается каждый ответ подделки GPT: по нему видно, что ответ дошёл целиком
+MARKER = "🐚"
+REPLY = (
+    "Театр начинается с вешалки, а заканчивается аплодисментами. "
+    "Чайка летит туда, куда ей надо, и не спрашивает разрешения. "
+    "Всё остальное — декорации, которые меняют между актами " + MARKER
+)
+VOICE_QUESTION = "Что скажешь про сегодняшнюю Чайку?"
+
+# Кнопки, как в seagullbot.py (сам бот тут не импортируется: он бы поднял
+# клиентов и базы в процессе прогона)
+BTN_BY_CODE = "🔢 Билеты по коду спектакля"
+BTN_SEAGULL = "🔍 Проверить билеты \"Чайки\""
+BTN_ADD_SEAGULL = "📥 Найти и добавить даты \"Чайки\""
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Общий HTTP-сервер для подделок
+# ──────────────────────────────────────────────────────────────────────────────
+
+class Request:
+    def __init__(self, method: str, path: str, headers, body: bytes):
+        url = urlsplit(path)
+        self.method = method
+        self.path = url.path
+        self.headers = headers
+        self.body = body
+        self.params: dict[str, str] = dict(parse_qsl(url.query))
+        self.files: dict[str, bytes] = {}
+        ctype = headers.get("Content-Type", "")
+        if ctype.startswith("multipart/form-data"):
+            msg = email.message_from_bytes(f"Content-Type: {ctype}\r\n\r\n".encode() + body)
+            for part in msg.get_payload():
+                name = part.get_param("name", header="content-disposition")
+                data = part.get_payload(decode=True) or b""
+                if part.get_filename():
+                    self.files[name] = data
+                else:
+                    self.params[name] = data.decode("utf-8", "replace")
+        elif ctype.startswith("application/x-www-form-urlencoded"):
+            self.params.update(parse_qsl(body.decode("utf-8", "replace")))
+
+    def json(self) -> dict:
+        return json.loads(self.body or b"{}")
+
+
+class Response:
+    def __init__(self, body=b"", status: int = 200, ctype: str = "application/json",
+                 headers: Optional[dict] = None, stream=None):
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body, ensure_ascii=False)
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.status = status
+        self.ctype = ctype
+        self.headers = headers or {}
+        self.stream = stream        # итератор кусков: ответ пишется по мере готовности
+
+
+class FakeServer:
+    """ThreadingHTTPServer, который отдаёт запросы в self.handle()."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.3):
+        self.latency = latency
+        self.jitter = jitter
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _serve(self):
+                size = int(self.headers.get("Content-Length") or 0)
+                req = Request(self.command, self.path, self.headers, self.rfile.read(size) if size else b"")
+                try:
+                    rsp = fake.handle(req)
+                except Exception as e:
+                    rsp = Response({"error": repr(e)}, status=500)
+                self.send_response(rsp.status)
+                self.send_header("Content-Type", rsp.ctype)
+                for k, v in rsp.headers.items():
+                    self.send_header(k, v)
+                if rsp.stream is None:
+                    self.send_header("Content-Length", str(len(rsp.body)))
+                    self.end_headers()
+                    self.wfile.write(rsp.body)
+                    return
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for part in rsp.stream:
+                    self.wfile.write(part)
+                    self.wfile.flush()
+
+            do_GET = do_POST = _serve
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # клиент ушёл, не дочитав (убитый воркер, таймаут) — это не ошибка подделки
+                if not isinstance(sys.exc_info()[1], ConnectionError):
+                    super().handle_error(request, client_address)
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True).start()
+
+    def delay(self, base: Optional[float] = None) -> None:
+        base = self.latency if base is None else base
+        if base > 0:
+            time.sleep(base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def handle(self, req: Request) -> Response:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Telegram Bot API
+# ──────────────────────────────────────────────────────────────────────────────
+
+class Event:
+    __slots__ = ("t", "method", "text", "markup", "blob")
+
+    def __init__(self, method: str, text: str, markup: str, blob: bytes):
+        self.t = time.perf_counter()
+        self.method = method
+        self.text = text
+        self.markup = markup
+        self.blob = blob
+
+
+class FakeTelegram(FakeServer):
+    """Отдаёт боту апдейты от «пользователей» и записывает всё, что бот прислал в чаты."""
+
+    _MEDIA = {"sendPhoto": "photo", "sendVideo": "video", "sendVoice": "voice", "sendDocument": "document"}
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self._cond = threading.Condition()
+        self._updates: list[dict] = []
+        self._next_update = 1
+        self._next_message = 1
+        self._events: dict[int, list[Event]] = {}
+        self.polled = threading.Event()
+        self.calls: dict[str, int] = {}
+
+    # ── со стороны пользователей ─────────────────────────────────────────────
+
+    def push(self, chat_id: int, **payload) -> tuple[int, float]:
+        """Положить апдейт в очередь; вернуть (сколько событий в чате уже было, время)."""
+        with self._cond:
+            update = {"update_id": self._next_update, **payload}
+            self._next_update += 1
+            self._updates.append(update)
+            since = len(self._events.setdefault(chat_id, []))
+            self._cond.notify_all()
+            return since, time.perf_counter()
+
+    def wait(self, chat_id: int, since: int, pred: Callable[[Event], bool], timeout: float) -> Optional[Event]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = self._events.get(chat_id, [])
+                for ev in events[since:]:
+                    if pred(ev):
+                        return ev
+                since = len(events)
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                self._cond.wait(left)
+
+    def message(self, chat_id: int, user_id: int, **content) -> dict:
+        with self._cond:
+            mid = self._next_message
+            self._next_message += 1
+        return {
+            "message_id": mid,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Actor{user_id}"},
+            **content,
+        }
+
+    # ── со стороны бота ──────────────────────────────────────────────────────
+
+    def handle(self, req: Request) -> Response:
+        if req.path.startswith("/file/"):
+            return Response(b"OggS" + os.urandom(2048), ctype="audio/ogg")
+        method = req.path.rsplit("/", 1)[-1]
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return Response({"ok": True, "result": self._get_updates(req.params)})
+        self.delay()
+        p = req.params
+        if method == "getMe":
+            return Response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Seagull", "username": "seagull_bot"}})
+        if method == "getFile":
+            return Response({"ok": True, "result": {
+                "file_id": p.get("file_id", ""), "file_unique_id": "u", "file_size": 2052, "file_path": "voice/1.ogg",
+            }})
+        if method == "answerInlineQuery":
+            # id запроса — "iq<чат>-<номер>": ответ ложится в чат того, кто спрашивал
+            chat_id = int(p.get("inline_query_id", "iq0")[2:].split("-")[0])
+            with self._cond:
+                self._events.setdefault(chat_id, []).append(Event(method, p.get("results", ""), "", b""))
+                self._cond.notify_all()
+            return Response({"ok": True, "result": True})
+        if not method.startswith(("send", "edit")) or "chat_id" not in p:
+            return Response({"ok": True, "result": True})
+
+        chat_id = int(p["chat_id"])
+        text = p.get("text") or p.get("caption") or ""
+        blob = b"".join(req.files.values())
+        with self._cond:
+            self._events.setdefault(chat_id, []).append(Event(method, text, p.get("reply_markup", ""), blob))
+            mid = int(p.get("message_id") or 0) or self._next_message
+            if method.startswith("send"):
+                self._next_message += 1
+            self._cond.notify_all()
+        result = {"message_id": mid, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                  "from": {"id": 1, "is_bot": True, "first_name": "Seagull"}, "text": text}
+        kind = self._MEDIA.get(method)
+        if kind == "photo":
+            result["photo"] = [{"file_id": f"ph{mid}", "file_unique_id": f"ph{mid}", "width": 1, "height": 1}]
+        elif kind:
+            result[kind] = {"file_id": f"{kind}{mid}", "file_unique_id": f"{kind}{mid}",
+                            "width": 1, "height": 1, "duration": 1}
+        return Response({"ok": True, "result": result})
+
+    def _get_updates(self, p: dict) -> list[dict]:
+        offset = int(p.get("offset") or 0)
+        deadline = time.monotonic() + min(float(p.get("timeout") or 0), 25)
+        self.polled.set()
+        with self._cond:
+            while True:
+                self._updates = [u for u in self._updates if u["update_id"] >= offset]
+                left = deadline - time.monotonic()
+                if self._updates or left <= 0:
+                    return list(self._updates[:100])
+                self._cond.wait(left)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# OpenAI
+# ──────────────────────────────────────────────────────────────────────────────
+
+class FakeOpenAI(FakeServer):
+    """
+    faults — доля запросов к API, которые сбоят: поровну 500, 429 с
+    Retry-After и зависание на stall секунд (потом 504, клиент уже не ждёт).
+    """
+
+    def __init__(self, token_delay: float = 0.02, stt_latency: float = 0.5, tts_latency: float = 0.4,
+                 image_latency: float = 3.0, faults: float = 0.0, stall: float = 30.0, **kw):
+        super().__init__(**kw)
+        self.token_delay = token_delay
+        self.stt_latency = stt_latency
+        self.tts_latency = tts_latency
+        self.image_latency = image_latency
+        self.faults = faults
+        self.stall = stall
+        self.injected: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _fault(self) -> Optional[Response]:
+        if not self.faults or random.random() >= self.faults:
+            return None
+        kind = random.choice(("500", "429", "stall"))
+        with self._lock:
+            self.injected[kind] = self.injected.get(kind, 0) + 1
+        if kind == "429":
+            return Response({"error": {"message": "rate limited"}}, status=429, headers={"Retry-After": "0.2"})
+        if kind == "stall":
+            time.sleep(self.stall)
+            return Response({"error": {"message": "upstream timeout"}}, status=504)
+        return Response({"error": {"message": "internal error"}}, status=500)
+
+    def handle(self, req: Request) -> Response:
+        fault = None if req.path.startswith("/files/") else self._fault()
+        if fault is not None:
+            return fault
+        if req.path.endswith("/chat/completions"):
+            body = req.json()
+            if body.get("stream"):
+                return Response(ctype="text/event-stream", stream=self._stream(body.get("model", "")))
+            self.delay()
+            return Response({
+                "id": "chatcmpl-load", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", ""),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": REPLY}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+            })
+        if req.path.endswith("/audio/transcriptions"):
+            self.delay(self.stt_latency)
+            return Response({"text": VOICE_QUESTION})
+        if req.path.endswith("/audio/speech"):
+            self.delay(self.tts_latency)
+            # в «звуке» — сам текст: по нему видно, какая фраза озвучена
+            return Response(b"OggS" + req.json().get("input", "").encode("utf-8"), ctype="audio/ogg")
+        if req.path.endswith("/images/generations"):
+            self.delay(self.image_latency)
+            return Response({"created": int(time.time()), "data": [{"url": f"{self.url}/files/pic.png"}]})
+        if req.path.startswith("/files/"):
+            return Response(b"\x89PNG" + os.urandom(1024), ctype="image/png")
+        return Response({"error": {"message": f"нет такого метода: {req.path}"}}, status=404)
+
+    def _stream(self, model: str):
+        self.delay()        # до первого токена
+        words = REPLY.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-load", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+            time.sleep(self.token_delay)
+        yield b"data: [DONE]\n\n"
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Replicate
+# ──────────────────────────────────────────────────────────────────────────────
+
+class FakeReplicate(FakeServer):
+    def __init__(self, render_seconds: float = 8.0, **kw):
+        super().__init__(**kw)
+        self.render_seconds = render_seconds
+        self._lock = threading.Lock()
+        self._preds: dict[str, dict] = {}
+
+    def handle(self, req: Request) -> Response:
+        if req.path.startswith("/files/"):
+            return Response(b"\x00\x00\x00\x18ftypmp42" + os.urandom(64 * 1024), ctype="video/mp4")
+        self.delay()
+        if req.method == "POST" and req.path.endswith("/predictions"):
+            with self._lock:
+                pid = f"p{len(self._preds) + 1}"
+                self._preds[pid] = {"started": time.monotonic(), "canceled": False}
+            return Response(self._view(pid), status=201)
+        parts = req.path.strip("/").split("/")        # v1/predictions/<id>[/cancel]
+        pid = parts[2] if len(parts) > 2 else ""
+        if pid not in self._preds:
+            return Response({"detail": "not found"}, status=404)
+        if parts[-1] == "cancel":
+            self._preds[pid]["canceled"] = True
+        return Response(self._view(pid))
+
+    def _view(self, pid: str) -> dict:
+        p = self._preds[pid]
+        done = min((time.monotonic() - p["started"]) / self.render_seconds, 1.0)
+        if p["canceled"]:
+            return {"id": pid, "status": "canceled", "output": None, "logs": ""}
+        if done >= 1.0:
+            return {"id": pid, "status": "succeeded", "output": f"{self.url}/files/{pid}.mp4", "logs": "100%|"}
+        return {"id": pid, "status": "processing", "output": None, "logs": f" {int(done * 100)}%|"}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Админка афиши
+# ──────────────────────────────────────────────────────────────────────────────
+
+class FakeAfisha(FakeServer):
+    """
+    Форма входа, меню месяцев и карточки показов в той же разметке, что у настоящей админки.
+
+    expire() (или GET /_expire) сбрасывает все сессии — как настоящая админка,
+    когда разлогинивает. password — если задан, вход с другим паролем не проходит.
+    """
+
+    def __init__(self, shows_per_month: int = 30, password: Optional[str] = None, **kw):
+        super().__init__(**kw)
+        self.password = password
+        self._lock = threading.Lock()
+        self.sid = "load-1"
+        self.logins = 0
+        self.logins_failed = 0
+        self.expired = 0
+        self.shows: dict[str, tuple[datetime, str]] = {}     # код → (начало, название)
+        first = datetime.now().replace(day=1, hour=19, minute=0, second=0, microsecond=0)
+        for m in range(3):
+            month = (first + timedelta(days=32 * m)).replace(day=1)
+            for i in range(shows_per_month):
+                day = month + timedelta(days=i % 28)
+                title = "ЧАЙКА" if i % 3 == 0 else random.choice(("ДЯДЯ ВАНЯ", "ВИШНЁВЫЙ САД", "ТРИ СЕСТРЫ"))
+                self.shows[f"{month:%m%y}{i:03d}"] = (day, title)
+
+    def codes(self) -> list[str]:
+        return list(self.shows)
+
+    def expire(self) -> None:
+        with self._lock:
+            self.expired += 1
+            self.sid = f"load-{self.expired + 1}"
+
+    def handle(self, req: Request) -> Response:
+        if req.path == "/_expire":
+            self.expire()
+            return Response({"expired": self.expired})
+        if req.path == "/admin/login":
+            return Response(_LOGIN_PAGE, ctype="text/html; charset=utf-8")
+        if req.path == "/admin/login_check":
+            self.delay()
+            with self._lock:
+                if self.password is not None and req.params.get("password") != self.password:
+                    self.logins_failed += 1
+                    return Response(status=302, headers={"Location": "/admin/login"})
+                self.logins += 1
+                sid = self.sid
+            return Response(status=302, headers={"Location": "/admin", "Set-Cookie": f"sid={sid}; Path=/"})
+        if f"sid={self.sid}" not in req.headers.get("Cookie", ""):
+            return Response(status=302, headers={"Location": "/admin/login"})
+        self.delay()
+        if req.path == "/admin/events/menu_date":
+            return Response(self._menu(req.params.get("date", "")), ctype="text/html; charset=utf-8")
+        if req.path.startswith("/admin/events/info/"):
+            code = req.path.rsplit("/", 1)[-1]
+            if code not in self.shows:
+                return Response("нет такого показа", status=404, ctype="text/plain; charset=utf-8")
+            return Response(self._show(code), ctype="text/html; charset=utf-8")
+        return Response(f'<div class="pull-right text-primary">Кабинет</div>', ctype="text/html; charset=utf-8")
+
+    def _menu(self, month: str) -> str:
+        links = "".join(
+            f'<li><a href="/admin/events/info/{code}">{start:%d.%m %H:%M} {title}</a></li>'
+            for code, (start, title) in self.shows.items() if f"{start:%m.%Y}" == month
+        )
+        return (f'<html><body><div class="pull-right text-primary">{month}</div>'
+                f'<ul class="extend-menu">{links}</ul></body></html>')
+
+    def _show(self, code: str) -> str:
+        start, title = self.shows[code]
+        rnd = random.Random(code + str(int(time.time() // 60)))
+        sold = rnd.randint(10, 300)
+        return (
+            f'<html><body><a href="/admin/shows?name={title}">{title}</a>'
+            f'<div class="pull-right text-primary">Показ (№ {code}){start:%d.%m.%Y %H:%M} (пт)</div>'
+            f'<p style="margin-bottom: 4px">Продано <b>{sold}</b> шт. на <b>{sold * 1500}</b> р.</p>'
+            f'<p style="margin-bottom: 4px">Продано фактически <b>{sold - 5}</b> шт. на <b>{(sold - 5) * 1500}</b> р.</p>'
+            f'<p style="margin-bottom: 4px">Забронировано <b>{rnd.randint(0, 20)}</b> шт. на <b>0</b> р.</p>'
+            f'</body></html>'
+        )
+
+
+_LOGIN_PAGE = (
+    '<html><body><form action="/admin/login_check" method="post">'
+    '<input type="hidden" name="_csrf" value="load">'
+    '<input id="email" name="email"><input id="password" name="password" type="password">'
+    '<button>Войти</button></form></body></html>'
+)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Сценарии пользователей
+# ──────────────────────────────────────────────────────────────────────────────
+
+Result = tuple[str, Optional[float]]      # (шаг, секунды; None — ответа не дождались)
+
+
+class Actor:
+    def __init__(self, n: int, tg: FakeTelegram, codes: list[str], timeout: float, rnd: random.Random):
+        self.chat_id = self.user_id = 10_000 + n
+        self.tg = tg
+        self.codes = codes
+        self.timeout = timeout
+        self.rnd = rnd
+        self.seq = 0
+
+    def _send(self, **content) -> tuple[int, float]:
+        msg = self.tg.message(self.chat_id, self.user_id, **content)
+        return self.tg.push(self.chat_id, message=msg)
+
+    def _wait(self, since: int, pred: Callable[[Event], bool]) -> Optional[Event]:
+        return self.tg.wait(self.chat_id, since, pred, self.timeout)
+
+    @staticmethod
+    def _took(t0: float, ev: Optional[Event]) -> Optional[float]:
+        return None if ev is None else ev.t - t0
+
+    def text(self, text: str) -> tuple[int, float]:
+        return self._send(text=text)
+
+    # ── сценарии ─────────────────────────────────────────────────────────────
+
+    def seagull(self) -> list[Result]:
+        since, t0 = self.text(BTN_SEAGULL)
+        ev = self._wait(since, lambda e: "show:" in e.markup)
+        out = [("seagull.menu", self._took(t0, ev))]
+        if ev is None:
+            return out
+        buttons = [b["callback_data"] for row in json.loads(ev.markup)["inline_keyboard"] for b in row]
+        msg = self.tg.message(self.chat_id, 1, text="Выбери дату:")
+        since, t0 = self.tg.push(self.chat_id, callback_query={
+            "id": f"cb{self.chat_id}-{self.seq}", "from": msg["from"] | {"id": self.user_id},
+            "chat_instance": str(self.chat_id), "data": self.rnd.choice(buttons), "message": msg,
+        })
+        out.append(("seagull.show", self._took(t0, self._wait(since, lambda e: e.text.startswith("Спектакль")))))
+        return out
+
+    def code(self) -> list[Result]:
+        since, t0 = self.text(BTN_BY_CODE)
+        if self._wait(since, lambda e: e.text.startswith("Введи код")) is None:
+            return [("code.show", None)]
+        code = self.rnd.choice(self.codes)
+        since, t0 = self.text(code)
+        out = [("code.show", self._took(t0, self._wait(since, lambda e: e.text.startswith("Спектакль"))))]
+        if out[0][1] is not None:
+            # тренд того же показа — из истории продаж, без админки
+            since, t0 = self.text(f"/trend {code}")
+            out.append(("code.trend", self._took(t0, self._wait(since, lambda e: e.text.startswith("Спектакль")))))
+        return out
+
+    def chat(self) -> list[Result]:
+        self.seq += 1
+        since, t0 = self.text(f"Как тебе сегодняшний спектакль? ({self.seq})")
+        first = self._wait(since, lambda e: e.method in ("sendMessage", "editMessageText"))
+        done = self._wait(since, lambda e: e.text.endswith(MARKER))
+        return [("chat.first", self._took(t0, first)), ("chat", self._took(t0, done))]
+
+    def voice(self) -> list[Result]:
+        self.seq += 1
+        since, t0 = self._send(voice={"file_id": f"v{self.chat_id}-{self.seq}", "file_unique_id": "v", "duration": 3})
+        first = self._wait(since, lambda e: e.method == "sendVoice")
+        done = self._wait(since, lambda e: e.method == "sendVoice" and MARKER.encode() in e.blob)
+        return [("voice.first", self._took(t0, first)), ("voice", self._took(t0, done))]
+
+    def image(self) -> list[Result]:
+        self.seq += 1
+        # «заново» — мимо кэша file_id, чтобы мерить генерацию, а не пересылку
+        since, t0 = self.text(f"Нарисуй заново: чайка над сценой №{self.chat_id}-{self.seq}")
+        return [("image", self._took(t0, self._wait(since, lambda e: e.method == "sendPhoto")))]
+
+    def video(self) -> list[Result]:
+        self.seq += 1
+        since, t0 = self.text(f"Сними заново: занавес открывается №{self.chat_id}-{self.seq}")
+        done = self._wait(since, lambda e: e.method == "sendVideo" or (e.method == "editMessageText" and "❌" in e.text))
+        return [("video", None if done is None or done.method != "sendVideo" else done.t - t0)]
+
+    def inline(self) -> list[Result]:
+        self.seq += 1
+        query = self.rnd.choice(("чай", "вишн", "дядя ваня", "сестр", self.rnd.choice(self.codes)[:4]))
+        since, t0 = self.tg.push(self.chat_id, inline_query={
+            "id": f"iq{self.chat_id}-{self.seq}", "query": query, "offset": "",
+            "from": {"id": self.user_id, "is_bot": False, "first_name": f"Actor{self.user_id}"},
+        })
+        return [("inline", self._took(t0, self._wait(since, lambda e: e.method == "answerInlineQuery")))]
+
+
+SCENARIOS = ("seagull", "code", "chat", "voice", "image", "video", "inline")
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"нет сценария {name!r}; есть: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_limits(spec: str) -> dict[str, float]:
+    """"chat=3,seagull.show=1.5" → {шаг: предел p95 в секундах}."""
+    out = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, sec = part.partition("=")
+        out[name] = float(sec)
+    return out
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Прогон
+# ──────────────────────────────────────────────────────────────────────────────
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(q * len(s) + 0.5)) - 1))]
+
+
+def summarize(results: list[Result], wall: float) -> dict[str, dict]:
+    steps: dict[str, list[Optional[float]]] = {}
+    for step, took in results:
+        steps.setdefault(step, []).append(took)
+    out = {}
+    for step, values in sorted(steps.items()):
+        ok = [v for v in values if v is not None]
+        out[step] = {
+            "count": len(ok),
+            "errors": len(values) - len(ok),
+            "rps": round(len(ok) / wall, 3) if wall else 0.0,
+            "p50": round(percentile(ok, 0.50), 4),
+            "p95": round(percentile(ok, 0.95), 4),
+            "p99": round(percentile(ok, 0.99), 4),
+            "max": round(max(ok, default=0.0), 4),
+        }
+    return out
+
+
+def print_table(steps: dict[str, dict]) -> None:
+    print(f"{'шаг':15s} {'готово':>7s} {'ошибок':>7s} {'в сек':>7s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'макс':>8s}")
+    for step, st in steps.items():
+        print(f"{step:15s} {st['count']:7d} {st['errors']:7d} {st['rps']:7.2f} "
+              f"{st['p50']:8.3f} {st['p95']:8.3f} {st['p99']:8.3f} {st['max']:8.3f}")
+
+
+def check(steps: dict[str, dict], args) -> list[str]:
+    """Что не прошло пороги (пустой список — всё хорошо)."""
+    problems = []
+    errors = sum(st["errors"] for st in steps.values())
+    if errors > args.max_errors:
+        problems.append(f"без ответа за {args.timeout:g} с: {errors} (допустимо {args.max_errors})")
+    startup = steps.get("startup")
+    if args.max_startup and startup and startup["count"] and startup["max"] > args.max_startup:
+        problems.append(f"первый ответ после запуска через {startup['max']:.3f} с > {args.max_startup:g} с")
+    for step, limit in parse_limits(args.max_p95).items():
+        if step in steps and steps[step]["p95"] > limit:
+            problems.append(f"{step}: p95 {steps[step]['p95']:.3f} с > {limit:g} с")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)["steps"]
+        for step, st in steps.items():
+            old = base.get(step)
+            if not old or not old["count"] or not st["count"]:
+                continue
+            # абсолютный запас — чтобы шум в пару десятков мс не валил быстрые шаги
+            limit = old["p95"] * (1 + args.tolerance) + args.slack
+            if st["p95"] > limit:
+                problems.append(f"{step}: p95 {st['p95']:.3f} с, было {old['p95']:.3f} с (предел {limit:.3f} с)")
+    return problems
+
+
+def start_bot(args, tg: FakeTelegram, oai: FakeOpenAI, rep: FakeReplicate, afisha: FakeAfisha, workdir: str):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": tg.url,
+        "OPENAI_API_KEY": "sk-load",
+        "OPENAI_BASE_URL": oai.url + "/v1",
+        "REPLICATE_API_TOKEN": "r8_load",
+        "REPLICATE_API_URL": rep.url,
+        "REPLICATE_POLL_INTERVAL": "0.5",
+        "AFISHA_BASE_URL": afisha.url,
+        "SCRAPE_ENGINE": "http",
+        "PREFETCH_ENABLED": "0",
+        "DATA_DIR": os.path.join(workdir, "data"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.metrics_port:
+        env["METRICS_PORT"] = str(args.metrics_port)
+    env.update(kv.split("=", 1) for kv in args.env)
+    script = "seagullbot_async.py" if args.runtime == "async" else "seagullbot.py"
+    log = open(os.path.join(workdir, "bot.log"), "wb")
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, script)], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    return proc, log
+
+
+def stop_bot(proc: subprocess.Popen) -> None:
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def print_bot_metrics(port: int) -> None:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics.json", timeout=5) as r:
+            stages = json.load(r)["histograms"].get("stage_seconds", {})
+    except OSError as e:
+        print(f"метрики бота недоступны: {e}")
+        return
+    print("\nэтапы внутри бота (p95, с):")
+    for key, st in sorted(stages.items(), key=lambda kv: -kv[1]["p95"]):
+        print(f"  {key.split('=', 1)[-1]:28s} {st['count']:6d}  {st['p95']:.3f}")
+
+
+def run(args) -> int:
+    random.seed(args.seed)
+    kw = {"jitter": args.jitter}
+    tg = FakeTelegram(latency=args.tg_latency, **kw)
+    oai = FakeOpenAI(latency=args.openai_latency, token_delay=args.openai_token_delay,
+                     image_latency=args.image_latency, faults=args.openai_faults, stall=args.openai_stall, **kw)
+    rep = FakeReplicate(latency=args.tg_latency, render_seconds=args.render_seconds, **kw)
+    afisha = FakeAfisha(latency=args.afisha_latency, **kw)
+
+    workdir = tempfile.mkdtemp(prefix="seagull-load-")
+    setup = Actor(0, tg, afisha.codes(), args.timeout, random.Random(args.seed))
+    # /start ждёт в очереди до запуска: время до ответа на него — «первый ответ после рестарта»
+    since, _ = setup.text("/start")
+    spawned = time.perf_counter()
+    proc, log = start_bot(args, tg, oai, rep, afisha, workdir)
+    results: list[Result] = []
+    try:
+        if not tg.polled.wait(args.startup_timeout):
+            print(f"бот не начал опрашивать Telegram за {args.startup_timeout:g} с, лог: {log.name}")
+            return 2
+        first = setup._wait(since, lambda e: e.text.startswith("Привет"))
+        results.append(("startup", None if first is None else first.t - spawned))
+
+        # даты «Чайки» — один раз перед прогоном, как сделал бы администратор
+        since, _ = setup.text(BTN_ADD_SEAGULL)
+        if setup._wait(since, lambda e: e.text.startswith("Даты добавлены")) is None:
+            print(f"бот не нашёл даты «Чайки» в подделке админки, лог: {log.name}")
+            return 2
+
+        mix = parse_mix(args.mix)
+        names, weights = list(mix), list(mix.values())
+        lock = threading.Lock()
+        stop_at = time.monotonic() + args.duration
+
+        def actor_loop(n: int) -> None:
+            rnd = random.Random(args.seed * 1000 + n)
+            actor = Actor(n, tg, afisha.codes(), args.timeout, rnd)
+            time.sleep(rnd.uniform(0, args.think))        # не все приходят в одну миллисекунду
+            while time.monotonic() < stop_at:
+                got = getattr(actor, rnd.choices(names, weights)[0])()
+                with lock:
+                    results.extend(got)
+                if args.think:
+                    time.sleep(rnd.expovariate(1 / args.think))
+
+        def expire_loop() -> None:
+            # админка разлогинивает посреди нагрузки: бот должен войти заново сам, один раз
+            while time.monotonic() + args.expire_every < stop_at:
+                time.sleep(args.expire_every)
+                afisha.expire()
+
+        print(f"{args.actors} пользователей, {args.duration:g} с, бот: {args.runtime}, смесь: {args.mix}")
+        t0 = time.monotonic()
+        threads = [threading.Thread(target=actor_loop, args=(n,), daemon=True) for n in range(1, args.actors + 1)]
+        if args.expire_every:
+            threading.Thread(target=expire_loop, daemon=True).start()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.monotonic() - t0
+
+        if proc.poll() is not None:
+            print(f"бот упал во время прогона (код {proc.returncode}), лог: {log.name}")
+            return 2
+        steps = summarize(results, wall)
+        print_table(steps)
+        if args.metrics_port:
+            print_bot_metrics(args.metrics_port)
+        print(f"\nвызовы Bot API: {', '.join(f'{k} {v}' for k, v in sorted(tg.calls.items()))}")
+        print(f"входов в админку: {afisha.logins}, сброшено сессий: {afisha.expired}")
+        if oai.injected:
+            print(f"сбоев OpenAI подстроено: {', '.join(f'{k} {v}' for k, v in sorted(oai.injected.items()))}")
+        print(f"лог бота: {log.name}")
+
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump({"config": vars(args), "wall": round(wall, 2), "steps": steps}, f, ensure_ascii=False, indent=1)
+        problems = check(steps, args)
+        for p in problems:
+            print(f"РЕГРЕССИЯ  {p}")
+        return 1 if problems else 0
+    finally:
+        stop_bot(proc)
+        log.close()
+        for fake in (tg, oai, rep, afisha):
+            fake.close()
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--runtime", choices=("sync", "async"), default="sync", help="seagullbot.py или seagullbot_async.py")
+    ap.add_argument("--actors", type=int, default=10, help="сколько пользователей одновременно")
+    ap.add_argument("--duration", type=float, default=30, help="секунд нагрузки")
+    ap.add_argument("--think", type=float, default=1.0, help="средняя пауза пользователя между действиями, с")
+    ap.add_argument("--mix", default="seagull:4,code:2,chat:3,voice:2,image:1,video:1,inline:2", help="веса сценариев")
+    ap.add_argument("--timeout", type=float, default=60, help="сколько ждать ответа, прежде чем считать ошибкой")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--tg-latency", type=float, default=0.05, help="задержка Bot API и Replicate, с")
+    ap.add_argument("--openai-latency", type=float, default=0.6, help="до первого токена / ответа OpenAI, с")
+    ap.add_argument("--openai-token-delay", type=float, default=0.03, help="между токенами потока, с")
+    ap.add_argument("--openai-faults", type=float, default=0, help="доля сбоящих запросов к OpenAI: 500/429/зависание")
+    ap.add_argument("--openai-stall", type=float, default=30, help="сколько висит «зависший» запрос OpenAI, с")
+    ap.add_argument("--image-latency", type=float, default=3.0, help="генерация картинки, с")
+    ap.add_argument("--render-seconds", type=float, default=8.0, help="рендер ролика в Replicate, с")
+    ap.add_argument("--afisha-latency", type=float, default=0.4, help="страница админки, с")
+    ap.add_argument("--jitter", type=float, default=0.3, help="разброс задержек: ±доля")
+    ap.add_argument("--expire-every", type=float, default=0, help="сбрасывать сессии админки каждые N с")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="переменная окружения для бота")
+    ap.add_argument("--metrics-port", type=int, default=0, help="включить METRICS_PORT у бота и показать его этапы")
+    ap.add_argument("--startup-timeout", type=float, default=60)
+    ap.add_argument("--save", help="записать результат в JSON (будущий --baseline)")
+    ap.add_argument("--baseline", help="JSON прошлого прогона: сравнить p95 по шагам")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="насколько p95 может вырасти к базовому")
+    ap.add_argument("--slack", type=float, default=0.05, help="абсолютный запас к порогу, с")
+    ap.add_argument("--max-p95", default="", metavar="STEP=SEC,...", help="жёсткие пределы p95, например chat=4")
+    ap.add_argument("--max-errors", type=int, default=0, help="сколько ответов можно не дождаться")
+    ap.add_argument("--max-startup", type=float, default=1.0,
+                    help="предел от запуска процесса бота до ответа на /start, с (0 — не проверять)")
+    return run(ap.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Кэш сгенерированных картинок и роликов по file_id Telegram.
+
+После первой отправки Telegram возвращает file_id — по нему тот же файл
+можно переслать мгновенно, без генерации в OpenAI/Replicate и без
+повторной загрузки. Ключ — нормализованный промпт плюс модель и
+параметры генерации, так что «Нарисуй: Кот в шляпе» и «нарисуй:  кот в
+шляпе!» дают один и тот же ответ, а смена модели или разрешения — нет.
+
+Записи живут max_age секунд; сверх max_entries выкидываются те, что
+дольше всех не запрашивались. Попадание в кэш — только чтение: last_used
+и счётчик попаданий копятся в памяти и пишутся пачкой раз в flush_every
+секунд, при put() и flush().
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Optional
+
+_WS_RE = re.compile(r"\s+")
+_TRAILING_RE = re.compile(r"[\s.!?…,;:]+$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_cache (
+    key       TEXT PRIMARY KEY,
+    kind      TEXT NOT NULL,
+    file_id   TEXT NOT NULL,
+    prompt    TEXT NOT NULL,
+    created   REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits      INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS media_cache_last_used ON media_cache(last_used);
+"""
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Регистр, лишние пробелы и финальная пунктуация на ответ не влияют."""
+    return _TRAILING_RE.sub("", _WS_RE.sub(" ", prompt).strip().casefold())
+
+
+def media_key(kind: str, model: str, prompt: str, **params: Any) -> str:
+    raw = json.dumps([kind, model, normalize_prompt(prompt), params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class MediaCache:
+    def __init__(
+            self,
+            path: str,
+            max_entries: int = 2000,
+            max_age: float = 30 * 86400,
+            flush_every: float = 60.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.flush_every = flush_every
+        self._clock = clock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._hits = self._misses = 0
+        self._touched: dict[str, tuple[float, int]] = {}     # ключ → (last_used, попаданий) ещё не в базе
+        self._flushed = clock()
+        with self._lock, self._db:
+            # пачки last_used — без fsync на каждую
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[str]:
+        now = self._clock()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id FROM media_cache WHERE key = ? AND created > ?", (key, now - self.max_age),
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._touched[key] = (now, self._touched.get(key, (now, 0))[1] + 1)
+            if now - self._flushed >= self.flush_every:
+                with self._db:
+                    self._flush(now)
+            return row[0]
+
+    def put(self, key: str, kind: str, file_id: str, prompt: str) -> None:
+        now = self._clock()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO media_cache (key, kind, file_id, prompt, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, file_id, prompt, now, now),
+            )
+            self._touched.pop(key, None)
+            # до вытеснения: оно смотрит на last_used
+            self._flush(now)
+            self._evict(now)
+
+    def flush(self) -> None:
+        """Записать накопленные last_used и попадания (при остановке бота)."""
+        with self._lock, self._db:
+            self._flush(self._clock())
+
+    def forget(self, key: str) -> None:
+        """file_id перестал работать (Telegram его не узнаёт) — убрать запись."""
+        with self._lock, self._db:
+            self._touched.pop(key, None)
+            self._db.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+
+    def _flush(self, now: float) -> None:
+        if self._touched:
+            self._db.executemany(
+                "UPDATE media_cache SET last_used = MAX(last_used, ?), hits = hits + ? WHERE key = ?",
+                [(used, n, key) for key, (used, n) in self._touched.items()],
+            )
+            self._touched.clear()
+        self._flushed = now
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM media_cache WHERE created <= ?", (now - self.max_age,))
+        self._db.execute(
+            "DELETE FROM media_cache WHERE key IN ("
+            " SELECT key FROM media_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM media_cache").fetchone()[0]
+        return {"size": size, "hit": self._hits, "miss": self._misses}
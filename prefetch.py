@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+Фоновый прогрев продаж ближайших показов.
+
+Планировщик периодически спрашивает discover(), какие показы впереди
+(код + время начала), и раскладывает их по куче «когда обновить».
+Чем ближе спектакль, тем чаще обновление (см. tiers), к каждому
+интервалу добавляется случайный разброс, а одновременных запросов
+к админке не больше max_concurrency.
+
+Время берётся из clock(), а работа запускается через tick(), поэтому
+планировщик можно гонять на фейковых часах и заглушке вместо fetch:
+
+    python prefetch.py      # ступени, разброс, лимит запросов, прошедшие показы (assert)
+"""
+
+import re
+import time
+import heapq
+import random
+import logging
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+log = logging.getLogger("neuroseagull.prefetch")
+
+# (за сколько секунд до начала, как часто обновлять); None — «всё остальное»
+Tier = tuple[Optional[float], float]
+
+DEFAULT_TIERS: list[Tier] = [
+    (3 * 3600, 3 * 60),
+    (24 * 3600, 10 * 60),
+    (7 * 24 * 3600, 3600),
+    (None, 6 * 3600),
+]
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text: str) -> float:
+    """'90' → 90, '10m' → 600, '2h' → 7200, '7d' → 604800."""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", text)
+    if not m:
+        raise ValueError(f"не понимаю длительность: {text!r}")
+    return float(m.group(1)) * _UNITS.get(m.group(2) or "s")
+
+
+def parse_tiers(text: str) -> list[Tier]:
+    """'3h:3m,24h:10m,*:6h' → [(10800, 180), (86400, 600), (None, 21600)]."""
+    tiers: list[Tier] = []
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        horizon, _, every = part.partition(":")
+        tiers.append((None if horizon.strip() == "*" else parse_duration(horizon), parse_duration(every)))
+    tiers.sort(key=lambda t: float("inf") if t[0] is None else t[0])
+    return tiers
+
+
+class PrefetchScheduler:
+    def __init__(
+            self,
+            discover: Callable[[], Iterable[tuple[str, Optional[float]]]],
+            fetch: Callable[[str], object],
+            tiers: Optional[list[Tier]] = None,
+            discover_every: float = 3600.0,
+            jitter: float = 0.2,
+            max_concurrency: int = 2,
+            grace: float = 3 * 3600.0,
+            clock: Callable[[], float] = time.time,
+            rng: Optional[random.Random] = None,
+            executor: Optional[Executor] = None,
+    ):
+        self._discover_fn = discover
+        self._fetch = fetch
+        self._tiers = tiers or DEFAULT_TIERS
+        self._discover_every = discover_every
+        self._jitter = jitter
+        self._grace = grace                 # сколько держать показ после начала
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._sem = threading.BoundedSemaphore(max_concurrency)
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="prefetch",
+        )
+
+        self._lock = threading.Lock()
+        self._starts: dict[str, Optional[float]] = {}   # код → начало (epoch)
+        self._due: dict[str, float] = {}                # код → когда обновить
+        self._heap: list[tuple[float, str]] = []
+        self._running: set[str] = set()
+        self._next_discover = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ── расписание ───────────────────────────────────────────────────────────
+
+    def interval_for(self, starts_at: Optional[float], now: float) -> float:
+        left = None if starts_at is None else starts_at - now
+        for horizon, every in self._tiers:
+            if horizon is None or (left is not None and left <= horizon):
+                return every
+        return self._tiers[-1][1]
+
+    def _jittered(self, every: float) -> float:
+        return every * (1 + self._rng.uniform(-self._jitter, self._jitter))
+
+    def _schedule(self, code: str, at: float) -> None:
+        """Под локом. Старые записи кучи для кода просто игнорируются при выборке."""
+        self._due[code] = at
+        heapq.heappush(self._heap, (at, code))
+
+    def _discover(self, now: float) -> None:
+        try:
+            found = {code: starts for code, starts in self._discover_fn()}
+        except Exception:
+            log.exception("prefetch: не удалось получить список показов")
+            self._next_discover = now + min(self._discover_every, 300)
+            return
+
+        with self._lock:
+            for code in list(self._starts):
+                if code not in found:
+                    self._starts.pop(code)
+                    self._due.pop(code, None)
+            for code, starts in found.items():
+                if starts is not None and starts + self._grace < now:
+                    continue
+                fresh = code not in self._starts
+                self._starts[code] = starts
+                if fresh:
+                    # новые показы прогреваем сразу, но вразнобой
+                    self._schedule(code, now + self._rng.uniform(0, self._jitter * 60))
+        self._next_discover = now + self._jittered(self._discover_every)
+        log.info("prefetch: отслеживаю %d показов", len(found))
+
+    # ── выполнение ───────────────────────────────────────────────────────────
+
+    def tick(self) -> list[str]:
+        """Запустить всё, что пора обновить. Возвращает отправленные коды."""
+        now = self._clock()
+        if now >= self._next_discover:
+            self._discover(now)
+
+        started = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                at, code = heapq.heappop(self._heap)
+                if self._due.get(code) != at or code in self._running:
+                    continue
+                starts = self._starts.get(code)
+                if starts is not None and starts + self._grace < now:
+                    self._starts.pop(code, None)
+                    self._due.pop(code, None)
+                    continue
+                self._running.add(code)
+                started.append(code)
+        for code in started:
+            self._executor.submit(self._run_one, code)
+        return started
+
+    def _run_one(self, code: str) -> None:
+        try:
+            with self._sem:
+                self._fetch(code)
+        except Exception as e:
+            log.warning("prefetch: код %s не обновился: %s", code, e)
+        finally:
+            now = self._clock()
+            with self._lock:
+                self._running.discard(code)
+                if code in self._starts:
+                    every = self.interval_for(self._starts[code], now)
+                    self._schedule(code, now + self._jittered(every))
+
+    def next_wakeup(self) -> float:
+        with self._lock:
+            nearest = self._heap[0][0] if self._heap else self._next_discover
+        return min(nearest, self._next_discover)
+
+    def tracked(self) -> dict[str, float]:
+        """Код → время следующего обновления."""
+        with self._lock:
+            return dict(self._due)
+
+    # ── фоновый поток ────────────────────────────────────────────────────────
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                log.exception("prefetch: сбой тика")
+            delay = self.next_wakeup() - self._clock()
+            self._stop.wait(min(max(delay, 1.0), 60.0))
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Самопроверка: фейковые часы и заглушка вместо админки
+# ──────────────────────────────────────────────────────────────────────────────
+
+class _Inline(Executor):
+    """fetch прямо в tick(): на фейковых часах всё детерминированно."""
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        fut: Future = Future()
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+
+def _asserts() -> None:
+    h, m, d = 3600, 60, 86400
+    assert parse_tiers("3h:3m, *:6h, 24h:10m") == [(3 * h, 3 * m), (24 * h, 10 * m), (None, 6 * h)]
+
+    now = [0.0]
+    shows: dict[str, Optional[float]] = {
+        "near": 30 * m, "day": 12 * h, "week": 3 * d, "far": 30 * d, "undated": None,
+        "past": -4 * h,         # начался раньше, чем держим после начала
+    }
+    fetched: dict[str, list[float]] = {code: [] for code in shows}
+    p = PrefetchScheduler(
+        discover=lambda: list(shows.items()), fetch=lambda code: fetched[code].append(now[0]),
+        discover_every=10 * m, clock=lambda: now[0], rng=random.Random(1), executor=_Inline(),
+    )
+    assert [p.interval_for(now[0] + left, now[0]) for left in (30 * m, 12 * h, 3 * d, 30 * d)] \
+        == [3 * m, 10 * m, h, 6 * h] and p.interval_for(None, 0) == 6 * h
+    while now[0] < 5 * h:
+        if now[0] == 2 * h:
+            del shows["day"]    # пропал из меню — после ближайшего обхода не трогаем
+        p.tick()
+        now[0] += 1
+
+    def gaps(code: str) -> list[float]:
+        return [b - a for a, b in zip(fetched[code], fetched[code][1:])]
+
+    # ближе начало — чаще; разброс в пределах ±jitter (+1 с шага тика)
+    assert len(fetched["near"]) > len(fetched["day"]) > len(fetched["week"]) > len(fetched["far"]) == 1
+    for code, every in (("near", 3 * m), ("day", 10 * m), ("week", h)):
+        assert all(every * 0.8 <= g <= every * 1.2 + 1 for g in gaps(code)), (code, gaps(code))
+    assert min(gaps("near")) < 3 * m < max(gaps("near"))      # разброс действительно есть
+    assert len(fetched["undated"]) == 1 and all(t <= 12 for t in (fetched["far"][0], fetched["undated"][0]))
+    # прошедшее не грузим; начавшийся держим grace и забываем
+    assert not fetched["past"] and "past" not in p.tracked()
+    assert "near" not in p.tracked() and fetched["near"][-1] <= 30 * m + 3 * h
+    assert "day" not in p.tracked() and fetched["day"][-1] <= 2 * h + 12 * m
+
+    # лимит одновременных запросов — даже когда потоков у исполнителя больше
+    busy, peak, done = 0, 0, threading.Semaphore(0)
+    lock = threading.Lock()
+
+    def slow_fetch(code: str) -> None:
+        nonlocal busy, peak
+        with lock:
+            busy += 1
+            peak = max(peak, busy)
+        time.sleep(0.05)
+        with lock:
+            busy -= 1
+        done.release()
+
+    now[0] = 0.0
+    pool = ThreadPoolExecutor(max_workers=8)
+    p = PrefetchScheduler(
+        discover=lambda: [(f"c{i}", 3 * h) for i in range(10)], fetch=slow_fetch, max_concurrency=2,
+        clock=lambda: now[0], rng=random.Random(2), executor=pool,
+    )
+    p.tick()
+    now[0] = 60.0
+    assert len(p.tick()) == 10 and not p.tick()     # пока грузится — повторно не отправляем
+    for _ in range(10):
+        assert done.acquire(timeout=5)
+    pool.shutdown()
+    assert peak == 2, peak
+    print("ok   ступени, разброс, лимит запросов, прошедшие показы (assert)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    _asserts()
@@ -0,0 +1,744 @@
+# -*- coding: utf-8 -*-
+
+"""
+Вызовы внешних API (OpenAI, Replicate): пределы времени, повторы,
+подстраховочный второй запрос и предохранитель.
+
+    openai_up = Upstream("openai", parse_policies("chat:20/60,stt:20/40"), hedge=("chat",))
+    resp = openai_up.call("chat", lambda timeout: client.chat.completions.create(..., timeout=timeout))
+    resp = await openai_up.acall("chat", lambda timeout: aclient.chat.completions.create(..., timeout=timeout))
+
+• у операции два предела: на одну попытку и на всю операцию с повторами;
+  вызываемое получает, сколько у попытки есть времени, и отдаёт это
+  клиенту как timeout — зависший upstream больше не держит поток вечно;
+• повторяются только временные сбои (408/409/429/5xx, обрывы, таймауты) —
+  с экспоненциальной паузой и полным джиттером, Retry-After соблюдается;
+  ошибки самого запроса (400 и т. п.) уходят вызывающему сразу;
+• подстраховка: если ответа нет дольше p95 последних удачных вызовов,
+  уходит второй такой же запрос и берётся первый ответ. Не больше одного
+  на попытку, не больше 10% вызовов и только при замкнутом предохранителе;
+• предохранитель на весь upstream: после failures временных сбоев подряд
+  вызовы сразу получают CircuitOpen, через reset_after секунд пропускается
+  одна проба — удалась, и всё снова работает.
+
+Проверка: сначала политики, классификация ошибок, предохранитель, окно
+подстраховки и повторы на подставных часах (assert), потом то же против
+локального сервера, который отвечает 429/500, зависает и тормозит в
+хвосте; код выхода 1 — что-то не так:
+
+    python resilience.py
+"""
+
+import sys
+import time
+import random
+import asyncio
+import inspect
+import logging
+import importlib
+import functools
+import threading
+import contextvars
+from collections import deque
+from dataclasses import dataclass, replace
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from metrics import metrics
+from prefetch import parse_duration
+
+log = logging.getLogger("neuroseagull.upstream")
+
+# Сверх timeout попытки — на случай клиента, который свой timeout не соблюдает
+_GRACE = 1.0
+# Подстраховка: с какого числа замеров доверять p95 и какая доля вызовов может её получить
+_HEDGE_MIN_SAMPLES = 20
+_HEDGE_BUDGET = 0.1
+_WINDOW = 100
+
+
+class CircuitOpen(Exception):
+    """Upstream сейчас считается лежащим: вызов отклонён, не начавшись."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Ответа нет, а время операции вышло."""
+
+
+@dataclass(frozen=True)
+class Policy:
+    timeout: float              # на одну попытку, с
+    deadline: float             # на всю операцию с повторами, с
+    attempts: int = 3
+    backoff: float = 0.5        # пауза перед первым повтором (до джиттера), дальше вдвое
+    max_backoff: float = 8.0
+    hedge: bool = False
+    idempotent: bool = True     # False — повтор только на 429: запрос точно не принят
+
+
+def parse_policies(text: str, **defaults) -> dict[str, Policy]:
+    """'chat:20/60,stt:20' → {"chat": Policy(20, 60), "stt": Policy(20, 20)}; defaults — прочие поля."""
+    policies = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        op, _, spec = part.partition(":")
+        timeout, _, deadline = spec.partition("/")
+        timeout = parse_duration(timeout)
+        policies[op.strip()] = Policy(timeout, parse_duration(deadline) if deadline else timeout, **defaults)
+    return policies
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Какие ошибки временные
+# ──────────────────────────────────────────────────────────────────────────────
+
+@functools.cache
+def _transport_errors() -> tuple[type, ...]:
+    errors: list[type] = [OSError, TimeoutError]        # requests, socket, asyncio.wait_for
+    for module, name in (("httpx", "TransportError"), ("openai", "APIConnectionError")):
+        try:
+            errors.append(getattr(importlib.import_module(module), name))
+        except (ImportError, AttributeError):
+            pass
+    return tuple(errors)
+
+
+def status_of(e: BaseException) -> Optional[int]:
+    """HTTP-статус из ошибки openai/httpx/requests/ReplicateError, если он там есть."""
+    for obj in (e, getattr(e, "response", None)):
+        status = getattr(obj, "status_code", None) or getattr(obj, "status", None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def transient(e: BaseException) -> bool:
+    """Стоит ли повторять: перегрузка, сбой сервера, обрыв или таймаут."""
+    status = status_of(e)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(e, _transport_errors()):
+        return True
+    return e.__cause__ is not None and transient(e.__cause__)
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Предохранитель и окно задержек
+# ──────────────────────────────────────────────────────────────────────────────
+
+class Breaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, name: str, failures: int = 5, reset_after: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._streak = 0
+        self._opened = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> None:
+        """Пропустить вызов или сразу бросить CircuitOpen."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN and self._clock() - self._opened >= self.reset_after:
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True        # одна проба, остальные ждут её итога
+                return
+            left = max(self._opened + self.reset_after - self._clock(), 0)
+        raise CircuitOpen(f"{self.name} недоступен, следующая проба через {left:.0f} с")
+
+    def success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                log.info("%s: снова отвечает, предохранитель замкнут", self.name)
+            self._state, self._streak, self._probing = self.CLOSED, 0, False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._streak += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._streak >= self.failures):
+                log.warning("%s: %d сбоев подряд, предохранитель разомкнут на %.0f с",
+                            self.name, self._streak, self.reset_after)
+                self._state, self._opened = self.OPEN, self._clock()
+            self._probing = False
+
+
+class _Window:
+    """
+    Время удачных основных запросов и какие попытки подстраховывались.
+    Подстраховка сюда не пишется: её время — p95 плюс быстрый ответ, и
+    порог полз бы вверх от каждой удачной подстраховки.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds: deque[float] = deque(maxlen=_WINDOW)
+        self._hedged: deque[bool] = deque(maxlen=_WINDOW)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._seconds.append(seconds)
+
+    def attempt(self, hedged: bool) -> None:
+        with self._lock:
+            self._hedged.append(hedged)
+
+    def hedge_after(self) -> Optional[float]:
+        with self._lock:
+            if len(self._seconds) < _HEDGE_MIN_SAMPLES or sum(self._hedged) >= _HEDGE_BUDGET * _WINDOW:
+                return None
+            ordered = sorted(self._seconds)
+        return ordered[int(len(ordered) * 0.95)]
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Upstream
+# ──────────────────────────────────────────────────────────────────────────────
+
+class Upstream:
+    """Политики операций одного внешнего API и его общий предохранитель."""
+
+    def __init__(
+            self,
+            name: str,
+            policies: dict[str, Policy],
+            hedge: Iterable[str] = (),
+            non_idempotent: Iterable[str] = (),
+            failures: int = 5,
+            reset_after: float = 30.0,
+            retryable: Callable[[BaseException], bool] = transient,
+            hedge_workers: int = 16,
+            clock: Callable[[], float] = time.monotonic,
+            rng: Optional[random.Random] = None,
+    ):
+        self.name = name
+        hedge, non_idempotent = set(hedge), set(non_idempotent)
+        self.policies = {
+            op: replace(p, hedge=p.hedge or op in hedge, idempotent=p.idempotent and op not in non_idempotent)
+            for op, p in policies.items()
+        }
+        self.breaker = Breaker(name, failures, reset_after, clock)
+        self.retryable = retryable
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._windows = {op: _Window() for op in self.policies}
+        self._hedge_workers = hedge_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._background: set[asyncio.Future] = set()       # основные, проигравшие подстраховке
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(("calls", "failures", "retries", "hedged", "hedge_won", "rejected"), 0)
+
+    def policy(self, op: str) -> Policy:
+        return self.policies[op]
+
+    # ── синхронно ────────────────────────────────────────────────────────────
+
+    def call(self, op: str, fn: Callable[[float], Any], discard: Optional[Callable[[Any], Any]] = None) -> Any:
+        """
+        fn(timeout) — одна попытка. discard(result) получит ответ, который
+        проиграл подстраховке (например, чтобы закрыть лишний поток).
+        """
+        policy = self.policies[op]
+        deadline = self._clock() + policy.deadline
+        attempt = 0
+        while True:
+            timeout = self._admit(op, policy, deadline)
+            after = self._windows[op].hedge_after() if policy.hedge else None
+            try:
+                if after is not None and after < timeout:
+                    result = self._hedged(op, fn, timeout, after, discard)
+                else:
+                    t0 = self._clock()
+                    result = fn(timeout)
+                    self._measured(op, policy, t0)
+            except Exception as e:
+                delay = self._failed(op, policy, attempt, e, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.success()
+            return result
+
+    def _hedged(self, op, fn, timeout, after, discard) -> Any:
+        t0 = self._clock()
+        end = t0 + timeout
+        primary = self._executor().submit(contextvars.copy_context().run, fn, timeout)
+        # время основного — в окно, даже если ответ уже не нужен
+        primary.add_done_callback(functools.partial(self._primary_done, op, t0))
+        racers = [primary]
+        done, _ = wait(racers, timeout=after)
+        hedge = not done and self.breaker.state == Breaker.CLOSED
+        self._windows[op].attempt(hedge)
+        if hedge:
+            self._count(op, "hedged")
+            racers.append(self._executor().submit(contextvars.copy_context().run, fn, max(end - self._clock(), 0.01)))
+        pending, error = set(racers), None
+        while pending:
+            done, pending = wait(pending, timeout=max(end - self._clock(), 0) + _GRACE, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for fut in done:
+                if fut.exception() is None:
+                    for other in racers:
+                        if other is not fut:
+                            other.add_done_callback(functools.partial(_drop, discard))
+                    if fut is not primary:
+                        self._count(op, "hedge_won")
+                    return fut.result()
+                error = fut.exception()
+        for fut in pending:
+            fut.add_done_callback(functools.partial(_drop, discard))
+        raise error or DeadlineExceeded(f"{self.name}.{op}: нет ответа за {timeout:.1f} с")
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self._hedge_workers, thread_name_prefix=f"{self.name}-hedge")
+            return self._pool
+
+    # ── асинхронно ───────────────────────────────────────────────────────────
+
+    async def acall(self, op: str, fn: Callable[[float], Awaitable[Any]],
+                    discard: Optional[Callable[[Any], Any]] = None) -> Any:
+        """
+        То же для корутин. Проигравшая подстраховка отменяется, а основной
+        запрос дорабатывает в фоне: его время нужно окну p95.
+        """
+        policy = self.policies[op]
+        deadline = self._clock() + policy.deadline
+        attempt = 0
+        while True:
+            timeout = self._admit(op, policy, deadline)
+            after = self._windows[op].hedge_after() if policy.hedge else None
+            try:
+                if after is not None and after < timeout:
+                    result = await self._ahedged(op, fn, timeout, after, discard)
+                else:
+                    t0 = self._clock()
+                    result = await asyncio.wait_for(fn(timeout), timeout + _GRACE)
+                    self._measured(op, policy, t0)
+            except Exception as e:
+                delay = self._failed(op, policy, attempt, e, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.success()
+            return result
+
+    async def _ahedged(self, op, fn, timeout, after, discard) -> Any:
+        t0 = self._clock()
+        end = t0 + timeout
+        primary = asyncio.ensure_future(fn(timeout))
+        primary.add_done_callback(functools.partial(self._primary_done, op, t0))
+        racers = [primary]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(racers, timeout=after)
+            hedge = not done and self.breaker.state == Breaker.CLOSED
+            self._windows[op].attempt(hedge)
+            if hedge:
+                self._count(op, "hedged")
+                racers.append(asyncio.ensure_future(fn(max(end - self._clock(), 0.01))))
+            pending, error = set(racers), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(end - self._clock(), 0) + _GRACE, return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is not primary:
+                            self._count(op, "hedge_won")
+                        return task.result()
+                    error = task.exception()
+            raise error or DeadlineExceeded(f"{self.name}.{op}: нет ответа за {timeout:.1f} с")
+        finally:
+            for task in racers:
+                if task is winner:
+                    continue
+                if task.done():
+                    _drop(discard, task)
+                elif task is primary and winner is not None:
+                    self._background.add(task)
+                    task.add_done_callback(self._background.discard)
+                    task.add_done_callback(functools.partial(_drop, discard))
+                else:
+                    task.cancel()
+
+    # ── общее ────────────────────────────────────────────────────────────────
+
+    def _admit(self, op: str, policy: Policy, deadline: float) -> float:
+        """Время на очередную попытку; CircuitOpen/DeadlineExceeded — попытки не будет."""
+        try:
+            self.breaker.allow()
+        except CircuitOpen:
+            self._count(op, "rejected")
+            raise
+        left = deadline - self._clock()
+        if left <= 0:
+            raise DeadlineExceeded(f"{self.name}.{op}: вышли {policy.deadline:.0f} с на операцию")
+        self._count(op, "calls")
+        return min(policy.timeout, left)
+
+    def _measured(self, op: str, policy: Policy, t0: float) -> None:
+        if policy.hedge:
+            self._windows[op].add(self._clock() - t0)
+            self._windows[op].attempt(False)
+
+    def _primary_done(self, op: str, t0: float, fut: Future) -> None:
+        if not fut.cancelled() and fut.exception() is None:
+            self._windows[op].add(self._clock() - t0)
+
+    def _failed(self, op: str, policy: Policy, attempt: int, e: Exception, deadline: float) -> Optional[float]:
+        """Пауза перед повтором или None — сдаёмся, ошибка уходит вызывающему."""
+        if not self.retryable(e):
+            self.breaker.success()      # upstream ответил, ошибка в самом запросе
+            return None
+        self.breaker.failure()
+        self._count(op, "failures")
+        if attempt + 1 >= policy.attempts or (not policy.idempotent and status_of(e) != 429):
+            return None
+        delay = self._rng.uniform(0, min(policy.max_backoff, policy.backoff * 2 ** attempt))
+        delay = max(delay, retry_after(e) or 0)
+        if self._clock() + delay >= deadline:
+            return None
+        self._count(op, "retries")
+        log.warning("%s.%s: %s — повтор %d через %.2f с", self.name, op, _brief(e), attempt + 1, delay)
+        return delay
+
+    def _count(self, op: str, what: str) -> None:
+        with self._lock:
+            self._counts[what] += 1
+        metrics.inc(f"upstream_{what}", upstream=self.name, op=op)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {"state": self.breaker.state, **counts}
+
+
+def _drop(discard: Optional[Callable[[Any], Any]], fut: Future) -> None:
+    """Ответ, проигравший подстраховке: отдать discard (закрыть поток и т. п.)."""
+    if discard is None or fut.cancelled() or fut.exception() is not None:
+        return
+    try:
+        closing = discard(fut.result())
+        if inspect.isawaitable(closing):
+            asyncio.ensure_future(closing)
+    except Exception:
+        log.debug("discard упал", exc_info=True)
+
+
+def _brief(e: BaseException) -> str:
+    status = status_of(e)
+    return f"HTTP {status}" if status else type(e).__name__
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Проверка: локальный сервер со сбоями
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _fault_server():
+    """
+    /fail/<ключ>?n=2&status=429 — первые n запросов по ключу с ошибкой, потом 200;
+    /hang?s=3 — молчит s секунд; /tail?p=0.02&slow=0.5 — доля p запросов тормозит;
+    /down — 503, пока server.down.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qsl, urlsplit
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            q = dict(parse_qsl(url.query))
+            srv = self.server
+            with srv.lock:
+                srv.hits[url.path] = srv.hits.get(url.path, 0) + 1
+                n = srv.hits[url.path]
+            status, headers = 200, {}
+            if url.path.startswith("/fail/") and n <= int(q.get("n", 1)):
+                status = int(q.get("status", 500))
+                if status == 429:
+                    headers["Retry-After"] = q.get("retry_after", "0.05")
+            elif url.path == "/hang":
+                time.sleep(float(q.get("s", 3)))
+            elif url.path == "/tail":
+                with srv.lock:
+                    slow = srv.rnd.random() < float(q.get("p", 0.05))
+                time.sleep(float(q.get("slow", 0.5)) if slow else 0.01)
+            elif url.path == "/down" and srv.down:
+                status = 503
+            try:
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+            except ConnectionError:
+                pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    srv.lock, srv.hits, srv.down, srv.rnd = threading.Lock(), {}, True, random.Random(7)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}"
+
+
+def _asserts() -> None:
+    """Детерминированная часть: подставные часы, без сети и без пауз."""
+    policies = parse_policies("chat:20/60, stt:20, image:1m/3m", attempts=2)
+    assert policies == {"chat": Policy(20, 60, 2), "stt": Policy(20, 20, 2), "image": Policy(60, 180, 2)}
+
+    class HttpError(Exception):
+        def __init__(self, status: int, headers: Optional[dict] = None):
+            super().__init__(f"HTTP {status}")
+            self.status_code = status
+            self.response = type("Response", (), {"headers": headers or {}})()
+
+    assert all(transient(HttpError(s)) for s in (408, 409, 429, 500, 503))
+    assert not any(transient(e) for e in (HttpError(400), HttpError(404), ValueError()))
+    wrapped = RuntimeError("обёртка клиента")
+    wrapped.__cause__ = ConnectionResetError()
+    assert transient(TimeoutError()) and transient(wrapped)
+    assert retry_after(HttpError(429, {"retry-after": "2.5"})) == 2.5 and retry_after(HttpError(500)) is None
+
+    now = [0.0]
+    clock = lambda: now[0]
+
+    # предохранитель: серия сбоев → разомкнут → одна проба → замкнут
+    b = Breaker("t", failures=3, reset_after=30, clock=clock)
+    b.failure(), b.failure(), b.success(), b.failure(), b.failure()
+    assert b.state == Breaker.CLOSED            # удача посередине обнуляет серию
+    b.failure()
+    assert b.state == Breaker.OPEN and isinstance(_try(b.allow), CircuitOpen)
+    now[0] += 30
+    b.allow()
+    assert b.state == Breaker.HALF_OPEN and isinstance(_try(b.allow), CircuitOpen)    # проба одна
+    b.failure()
+    now[0] += 29
+    assert b.state == Breaker.OPEN and isinstance(_try(b.allow), CircuitOpen)
+    now[0] += 1
+    b.allow()
+    b.success()
+    assert b.state == Breaker.CLOSED and b.allow() is None
+
+    # окно: p95 основных запросов, не раньше 20 замеров и не больше 10% подстраховок
+    w = _Window()
+    for ms in range(1, 20):
+        w.add(ms / 100)
+    assert w.hedge_after() is None
+    for ms in range(20, 101):
+        w.add(ms / 100)
+    assert w.hedge_after() == 0.96
+    for i in range(_WINDOW):
+        w.attempt(i % 10 == 0)
+    assert w.hedge_after() is None              # бюджет выбран
+    w.attempt(False)                            # старейшая подстраховка ушла из окна
+    assert w.hedge_after() == 0.96
+
+    # повторы: что повторяется, сколько раз и с каким временем на попытку
+    timeouts: list[float] = []
+
+    def flaky(*errors: Exception):
+        left = list(errors)
+
+        def attempt(timeout: float) -> str:
+            timeouts.append(timeout)
+            if left:
+                raise left.pop(0)
+            return "ok"
+        return attempt
+
+    def hangs(timeout: float):
+        timeouts.append(timeout)
+        now[0] += timeout
+        raise TimeoutError()
+
+    policy = Policy(5, 12, attempts=3, backoff=0)
+    u = Upstream("t", {"op": policy, "create": policy}, non_idempotent=("create",), failures=100, clock=clock)
+    cases = [
+        ("op", flaky(HttpError(500), HttpError(429)), "ok", 3),        # временные — повтор
+        ("op", flaky(*[HttpError(503)] * 3), HttpError, 3),            # не больше attempts
+        ("op", flaky(HttpError(400)), HttpError, 1),                   # ошибка запроса — сразу наверх
+        ("create", flaky(HttpError(500)), HttpError, 1),               # не идемпотентный: 500 не повторяем
+        ("create", flaky(HttpError(429)), "ok", 2),                    # …а 429 — да, запрос не принят
+        ("op", hangs, TimeoutError, 3),
+    ]
+    for op, fn, want, tries in cases:
+        timeouts.clear()
+        got = _try(u.call, op, fn)
+        assert (got == want if isinstance(want, str) else isinstance(got, want)) and len(timeouts) == tries, \
+            (op, got, timeouts)
+    assert timeouts == [5, 5, 2]                # третьей попытке осталось 2 с из 12
+    # Retry-After: ждём сколько сказано — или сдаёмся, если срок операции не позволяет
+    busy = HttpError(429, {"retry-after": "3"})
+    assert u._failed("op", policy, 0, busy, deadline=now[0] + 10) == 3
+    assert u._failed("op", policy, 0, busy, deadline=now[0] + 2) is None
+
+    # разомкнутый предохранитель: вызов отклонён, не начавшись
+    u = Upstream("t", {"op": Policy(5, 5, attempts=1)}, failures=2, clock=clock)
+    for _ in range(2):
+        _try(u.call, "op", flaky(HttpError(500)))
+    timeouts.clear()
+    assert isinstance(_try(u.call, "op", flaky()), CircuitOpen) and not timeouts
+    assert u.stats()["rejected"] == 1
+    print("ok   политики, ошибки, предохранитель, окно подстраховки, повторы (assert)")
+
+
+def _try(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return e
+
+
+def _p99(values: list[float]) -> float:
+    return sorted(values)[int(len(values) * 0.99)]
+
+
+def _selfcheck() -> int:
+    import httpx
+
+    srv, base = _fault_server()
+    http = httpx.Client(base_url=base)
+    checks: dict[str, bool] = {}
+
+    def get(path: str):
+        return lambda timeout: http.get(path, timeout=timeout).raise_for_status()
+
+    def up(**kw) -> Upstream:
+        policies = {"op": Policy(kw.pop("timeout", 1.0), kw.pop("deadline", 3.0), backoff=0.05, max_backoff=0.2)}
+        return Upstream("fake", policies, **kw)
+
+    # повторы
+    u = up()
+    u.call("op", get("/fail/a?n=2&status=429"))
+    checks["429 дважды → ответ с третьей попытки"] = srv.hits["/fail/a"] == 3 and u.stats()["retries"] == 2
+    try:
+        u.call("op", get("/fail/b?n=5&status=400"))
+        checks["400 не повторяется"] = False
+    except httpx.HTTPStatusError:
+        checks["400 не повторяется"] = srv.hits["/fail/b"] == 1
+
+    # зависание: попытка 0.3 с, вся операция 1 с
+    u = up(timeout=0.3, deadline=1.0)
+    t0 = time.monotonic()
+    try:
+        u.call("op", get("/hang?s=3"))
+    except Exception:
+        pass
+    hang = time.monotonic() - t0
+    checks[f"зависший upstream отпускает за {hang:.2f} с, а не за 3"] = hang < 1.2
+
+    # предохранитель
+    u = up(failures=3, reset_after=0.5)
+    rejected = 0
+    for _ in range(6):
+        try:
+            u.call("op", get("/down"))
+        except CircuitOpen:
+            rejected += 1
+        except httpx.HTTPStatusError:
+            pass
+    hits = srv.hits["/down"]
+    t0 = time.perf_counter()
+    try:
+        u.call("op", get("/down"))
+    except CircuitOpen:
+        fast = time.perf_counter() - t0
+    checks[f"разомкнут: отказ за {fast * 1e6:.0f} мкс, без запроса"] = rejected > 0 and srv.hits["/down"] == hits
+    time.sleep(0.55)
+    srv.down = False
+    u.call("op", get("/down"))
+    checks["после паузы проба проходит, замкнут"] = u.breaker.state == Breaker.CLOSED
+
+    # хвост: 2% запросов по 0.5 с — дальше p95, его и срезает подстраховка
+    def tail(u: Upstream) -> list[float]:
+        def one(_):
+            t0 = time.perf_counter()
+            u.call("op", get("/tail?p=0.02&slow=0.5"))
+            return time.perf_counter() - t0
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(one, range(100)))         # набрать p95
+            return list(pool.map(one, range(300)))
+
+    plain = _p99(tail(up()))
+    hedged_up = up(hedge=("op",))
+    hedged = _p99(tail(hedged_up))
+    st = hedged_up.stats()
+    checks[f"подстраховка: p99 {plain * 1000:.0f} → {hedged * 1000:.0f} мс, "
+           f"вторых запросов {st['hedged']}/{st['calls']}"] = hedged < plain / 2 and st["hedged"] <= 0.12 * st["calls"]
+
+    # то же в asyncio
+    async def async_checks():
+        async with httpx.AsyncClient(base_url=base) as ahttp:
+            def aget(path: str):
+                async def attempt(timeout):
+                    return (await ahttp.get(path, timeout=timeout)).raise_for_status()
+                return attempt
+
+            u = up()
+            await u.acall("op", aget("/fail/c?n=2&status=503"))
+            checks["async: 503 дважды → ответ"] = srv.hits["/fail/c"] == 3
+
+            u = up(timeout=0.3, deadline=1.0)
+            t0 = time.monotonic()
+            try:
+                await u.acall("op", aget("/hang?s=3"))
+            except Exception:
+                pass
+            checks["async: зависание отпускает по сроку"] = time.monotonic() - t0 < 1.2
+
+            async def one(u):
+                t0 = time.perf_counter()
+                await u.acall("op", aget("/tail?p=0.02&slow=0.5"))
+                return time.perf_counter() - t0
+            u = up(hedge=("op",))
+            sem = asyncio.Semaphore(8)
+
+            async def limited(u):
+                async with sem:
+                    return await one(u)
+            await asyncio.gather(*(limited(u) for _ in range(100)))       # набрать p95
+            lat = await asyncio.gather(*(limited(u) for _ in range(300)))
+            checks[f"async: подстраховка, p99 {_p99(lat) * 1000:.0f} мс"] = _p99(lat) < plain / 2
+
+    asyncio.run(async_checks())
+    srv.shutdown()
+    for what, ok in checks.items():
+        print(f"{'ok ' if ok else 'ОШИБКА'}  {what}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    _asserts()
+    sys.exit(_selfcheck())
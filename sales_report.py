@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Сводка продаж по всем показам месяца.
+
+Карточки показов запрашиваются параллельно через общий ограниченный
+пул (fan-out не больше его размера, сколько бы отчётов ни строилось
+одновременно), результаты отдаются по мере готовности — бот печатает
+строки сразу, а не ждёт самый медленный показ. В конце — итоги и CSV
+в порядке меню.
+"""
+
+import csv
+from io import StringIO
+from concurrent.futures import Executor, as_completed
+from typing import Callable, Iterator, Optional
+
+from afisha_parser import MenuItem, ShowInfo, fmt_number
+
+# Колонки CSV — поля ShowInfo с продажами
+_SALES = ("sold_cnt", "sold_sum", "fact_cnt", "fact_sum", "booked_cnt", "booked_sum")
+
+
+def fetch_all(
+        items: list[MenuItem],
+        fetch: Callable[[str], ShowInfo],
+        executor: Executor,
+) -> Iterator[tuple[MenuItem, Optional[ShowInfo], Optional[Exception]]]:
+    """(показ, продажи, ошибка) в порядке готовности; одна ошибка не рушит отчёт."""
+    futures = {executor.submit(fetch, it.code): it for it in items}
+    for fut in as_completed(futures):
+        try:
+            yield futures[fut], fut.result(), None
+        except Exception as e:
+            yield futures[fut], None, e
+
+
+def report_row(item: MenuItem, info: Optional[ShowInfo]) -> str:
+    if info is None:
+        return f"{item.date} {item.title} — не удалось получить"
+    row = f"{item.date} {item.title} — {fmt_number(info.sold_cnt)} шт. на {fmt_number(info.sold_sum)} ₽"
+    if info.booked_cnt:
+        row += f", бронь {fmt_number(info.booked_cnt)}"
+    return row
+
+
+def totals(infos: list[ShowInfo]) -> dict[str, float]:
+    return {f: sum(getattr(i, f) or 0 for i in infos) for f in _SALES}
+
+
+def totals_text(infos: list[ShowInfo], failed: int) -> str:
+    t = totals(infos)
+    text = (
+        f"Итого по {len(infos)} показам: {fmt_number(t['sold_cnt'])} шт. на {fmt_number(t['sold_sum'])} ₽\n"
+        f"Фактически: {fmt_number(t['fact_cnt'])} шт. на {fmt_number(t['fact_sum'])} ₽\n"
+        f"Забронировано: {fmt_number(t['booked_cnt'])} шт. на {fmt_number(t['booked_sum'])} ₽"
+    )
+    if failed:
+        text += f"\nНе удалось получить: {failed}"
+    return text
+
+
+def to_csv(items: list[MenuItem], infos: dict[str, ShowInfo]) -> bytes:
+    """CSV в порядке меню; utf-8 с BOM, чтобы Excel не ломал кириллицу."""
+    buf = StringIO()
+    w = csv.writer(buf, delimiter=";")
+    w.writerow(("code", "date", "title") + _SALES)
+    for it in items:
+        info = infos.get(it.code)
+        w.writerow((it.code, it.date, it.title) + tuple(
+            "" if info is None or getattr(info, f) is None else getattr(info, f) for f in _SALES
+        ))
+    return buf.getvalue().encode("utf-8-sig")
@@ -14,27 +14,48 @@ import sys
 import re
 import atexit
 import signal
-import random
+import time
 import logging
-import tempfile
 import traceback
+import functools
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from collections import defaultdict, deque
+from typing import TYPE_CHECKING, Callable
+
+# Отсчёт для «первого ответа после запуска» — до тяжёлых импортов
+STARTED_AT = time.monotonic()
 
 import telebot
 from telebot import types
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as ec
-from bs4 import BeautifulSoup
-
-import openai
-from openai import OpenAI
-import replicate
-from replicate.exceptions import ModelError
+
+from session_pool import PoolTimeout
+from afisha_http import AfishaAuthError
+from afisha_scraper import AfishaScraper, ScrapeFailed, ScrapeWorkers
+from swr_cache import SWRCache
+from resilience import CircuitOpen, Upstream, parse_policies, transient
+from prefetch import PrefetchScheduler, parse_duration, parse_tiers
+from lanes import Dispatcher
+from metrics import metrics
+from warmup import Lazy, Warmup
+from tg_stream import StreamPager
+from tg_outbox import Outbox, pack
+from voice_pipeline import run_voice_pipeline
+from media_cache import MediaCache, media_key
+from state_store import SavedShow, StateStore
+from chat_memory import ChatMemory, Turn, count_tokens
+from sales_report import fetch_all, report_row, to_csv, totals_text
+from sales_history import SalesHistory, format_trend, format_trend_line
+from show_index import ShowIndex
+from video_jobs import (
+    CANCELED, DELIVERING, DONE, QUEUED, RUNNING,
+    Job, JobStore, ReplicateApi, VideoJobs, VideoQueueFull,
+)
+from afisha_parser import PAGE_MARKER, MenuItem, ShowInfo, fmt_number, format_show, parse_month, parse_show
+
+if TYPE_CHECKING:
+    # selenium и openai импортируются при первом использовании: запуск бота их не ждёт
+    from openai import OpenAI
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Конфигурация (через переменные окружения)
@@ -52,6 +73,123 @@ IMG_MODEL = os.getenv("IMG_MODEL", "dall-e-3")
 VOICE_TTS_MODEL = os.getenv("VOICE_TTS_MODEL", "gpt-4o-mini-tts")
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4")
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Память диалога: свежие реплики на пользователя (токенов), краткое содержание
+# более старых, общий предел в памяти процесса и через сколько молчания выгружать
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+CHAT_MEMORY_MAX_TOKENS = int(os.getenv("CHAT_MEMORY_MAX_TOKENS", "500000"))
+CHAT_MEMORY_IDLE = os.getenv("CHAT_MEMORY_IDLE", "24h")
+
+# Очередь генерации видео: сколько роликов рендерится сразу (всего / на
+# пользователя), сколько задач можно держать в очереди одному пользователю
+VIDEO_MAX_RUNNING = int(os.getenv("VIDEO_MAX_RUNNING", "2"))
+VIDEO_MAX_PER_USER = int(os.getenv("VIDEO_MAX_PER_USER", "1"))
+VIDEO_MAX_QUEUED_PER_USER = int(os.getenv("VIDEO_MAX_QUEUED_PER_USER", "3"))
+VIDEO_JOB_TIMEOUT = float(os.getenv("VIDEO_JOB_TIMEOUT", "900"))
+REPLICATE_POLL_INTERVAL = float(os.getenv("REPLICATE_POLL_INTERVAL", "2"))
+# Адрес API Replicate (локальный фейк — для тестов)
+REPLICATE_API_URL = os.getenv("REPLICATE_API_URL", "https://api.replicate.com").rstrip("/")
+
+# Вызовы OpenAI и Replicate: "операция:попытка/вся операция с повторами", секунд;
+# сколько попыток на 429/5xx/обрыв; второй запрос чата, если первый дольше p95;
+# после скольких сбоев подряд API считается лежащим и когда пробовать снова
+OPENAI_TIMEOUTS = os.getenv("OPENAI_TIMEOUTS", "chat:30/60,stream:15/30,summary:20/40,stt:20/40,tts:15/30,image:90/150")
+REPLICATE_TIMEOUTS = os.getenv("REPLICATE_TIMEOUTS", "create:20/40,get:15/30,cancel:15/30")
+UPSTREAM_ATTEMPTS = int(os.getenv("UPSTREAM_ATTEMPTS", "3"))
+CHAT_HEDGE = os.getenv("CHAT_HEDGE", "1") == "1"
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET = os.getenv("BREAKER_RESET", "30s")
+
+# Каталог для баз бота (очередь видео, сохранённые даты, память диалогов)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+# Раз в сколько секунд изменения состояния пачкой пишутся на диск
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "1"))
+
+# Готовые картинки/ролики по file_id Telegram: повтор промпта — без новой генерации
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv("MEDIA_CACHE_MAX_ENTRIES", "2000"))
+MEDIA_CACHE_MAX_AGE = os.getenv("MEDIA_CACHE_MAX_AGE", "30d")
+
+# История продаж для /trend: подробный журнал скрейпов и показы целиком
+# (после начала) храним столько; мест в зале — для прогноза «когда раскупят»
+SALES_HISTORY_RAW_KEEP = os.getenv("SALES_HISTORY_RAW_KEEP", "14d")
+SALES_HISTORY_KEEP = os.getenv("SALES_HISTORY_KEEP", "180d")
+HALL_CAPACITY = int(os.getenv("HALL_CAPACITY", "0"))
+
+# Inline-режим (@бот <название, дата или код>): сколько секунд Telegram
+# может отдавать наш ответ на тот же запрос из своего кэша
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "10"))
+
+# Ответ GPT печатается по мере генерации правками одного сообщения
+CHAT_STREAM = os.getenv("CHAT_STREAM", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+
+# Голосовой ответ озвучивается по фразам параллельно с генерацией текста
+VOICE_TTS_WORKERS = int(os.getenv("VOICE_TTS_WORKERS", "8"))
+
+# Адрес Bot API; пусто — настоящий api.telegram.org (локальный сервер — для тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+# Лимиты исходящих списков: сообщений в секунду на бота и на один чат (+ запас на всплеск)
+TG_SEND_RATE = float(os.getenv("TG_SEND_RATE", "25"))
+TG_CHAT_SEND_RATE = float(os.getenv("TG_CHAT_SEND_RATE", "1"))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+
+# Админка билетов и способ её читать: "http" (без браузера, Chrome только как
+# запасной вариант) или "selenium" (всегда через Chrome)
+AFISHA_BASE_URL = os.getenv("AFISHA_BASE_URL", "https://tickets.afisha.ru").rstrip("/")
+SCRAPE_ENGINE = os.getenv("SCRAPE_ENGINE", "http")
+# Пауза перед повторным входом после неудачного (удваивается до максимума), секунд
+ADMIN_LOGIN_BACKOFF = float(os.getenv("ADMIN_LOGIN_BACKOFF", "5"))
+ADMIN_LOGIN_MAX_BACKOFF = float(os.getenv("ADMIN_LOGIN_MAX_BACKOFF", "300"))
+
+# Пул браузеров для парсинга админки
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "2"))
+DRIVER_WAIT_TIMEOUT = float(os.getenv("DRIVER_WAIT_TIMEOUT", "60"))
+# «Худой» Chrome: без картинок, шрифтов, стилей и счётчиков, ждём только нужную
+# разметку; LEAN_CHROME_BLOCK — ещё шаблоны URL для блокировки, через запятую
+LEAN_CHROME = os.getenv("LEAN_CHROME", "1") == "1"
+LEAN_CHROME_BLOCK = tuple(p.strip() for p in os.getenv("LEAN_CHROME_BLOCK", "").split(",") if p.strip())
+
+# Парсинг в отдельных процессах (0 — в процессе бота, как раньше): DRIVER_POOL_SIZE
+# делится между ними; ответа нет за SCRAPE_TIMEOUT секунд — воркер перезапускается,
+# занял вместе со своим Chrome больше SCRAPE_WORKER_MAX_RSS_MB — заменяется свежим
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "2"))
+SCRAPE_TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT", "90"))
+SCRAPE_WORKER_MAX_RSS_MB = float(os.getenv("SCRAPE_WORKER_MAX_RSS_MB", "1024"))
+
+# Кэш продаж и меню (секунды): ttl — отдаём как свежее, stale — отдаём
+# устаревшее сразу, обновляя в фоне
+SHOW_CACHE_TTL = float(os.getenv("SHOW_CACHE_TTL", "120"))
+SHOW_CACHE_STALE = float(os.getenv("SHOW_CACHE_STALE", "900"))
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "3600"))
+MENU_CACHE_STALE = float(os.getenv("MENU_CACHE_STALE", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+
+# Фоновый прогрев продаж ближайших "Чаек": "за сколько до начала:как часто"
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_TIERS = os.getenv("PREFETCH_TIERS", "3h:3m,24h:10m,7d:1h,*:6h")
+PREFETCH_DISCOVER_EVERY = os.getenv("PREFETCH_DISCOVER_EVERY", "1h")
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+PREFETCH_JITTER = float(os.getenv("PREFETCH_JITTER", "0.2"))
+
+# Сводка продаж за месяц: сколько карточек показов запрашивать параллельно
+BULK_REPORT_CONCURRENCY = int(os.getenv("BULK_REPORT_CONCURRENCY", "6"))
+
+# Полосы исполнения хэндлеров: "потоков:предел очереди"
+LANE_TICKETS = os.getenv("LANE_TICKETS", "8:100")
+LANE_CHAT = os.getenv("LANE_CHAT", "4:50")
+LANE_MEDIA = os.getenv("LANE_MEDIA", "2:10")
+
+# Метрики по этапам: порт локального HTTP (/metrics, /metrics.json; 0 — выключено)
+# и порог, после которого запрос пишется в лог с разбивкой по этапам
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+
+# Через сколько секунд после старта опроса прогревать в фоне клиента OpenAI,
+# вход в админку и (в режиме selenium) первый Chrome
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "1"))
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Логирование
@@ -67,72 +205,159 @@ log = logging.getLogger("neuroseagull")
 # Инициализация клиентов
 # ──────────────────────────────────────────────────────────────────────────────
 
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
-openai.api_key = OPENAI_API_KEY
-client = OpenAI(api_key=OPENAI_API_KEY)
-rep = replicate.Client(api_token=REPLICATE_API_TOKEN)
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+    telebot.apihelper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
+
+def _timed_tg_request(method, url, **kwargs):
+    """Вызовы Bot API с замером времени (long polling не считаем — он ждёт намеренно)."""
+    name = url.rsplit("/", 1)[-1]
+    startup_mark(name)
+    if name == "getUpdates":
+        return telebot.apihelper._get_req_session().request(method, url, **kwargs)
+    with metrics.stage(f"tg.{name}"):
+        return telebot.apihelper._get_req_session().request(method, url, **kwargs)
+
+_startup_marks: set[str] = set()
+
+def startup_mark(api_method: str) -> None:
+    """Один раз: сколько прошло от запуска до первого опроса / первого ответа пользователю."""
+    if api_method == "getUpdates":
+        what = "polling"
+    elif api_method.startswith(("send", "edit")):
+        what = "first_response"
+    else:
+        return
+    if what in _startup_marks:
+        return
+    _startup_marks.add(what)
+    took = time.monotonic() - STARTED_AT
+    metrics.observe_stage(f"startup.{what}", took)
+    log.info("Запуск: %s через %.2f с", "первый опрос" if what == "polling" else "первый ответ", took)
+
+telebot.apihelper.CUSTOM_REQUEST_SENDER = _timed_tg_request
+metrics.slow_seconds = SLOW_REQUEST_SECONDS
+
+# Что создаётся лениво, прогревается в фоне после старта опроса
+warmup = Warmup(delay=WARMUP_DELAY)
+metrics.gauge("ready", lambda: {(("component", n),): int(st["state"] == "ready") for n, st in warmup.status().items()})
+
+def _openai_client() -> "OpenAI":
+    from openai import OpenAI
+    # повторы и таймауты — у openai_up, свои у клиента выключены
+    return OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# Потоков у telebot должно хватать на все браузеры пула, иначе пул простаивает
+bot = telebot.TeleBot(TELEGRAM_TOKEN, num_threads=max(4, DRIVER_POOL_SIZE * 2))
+# Длинные списки — через очередь с лимитами Telegram и повтором после 429
+outbox = Outbox(rate=TG_SEND_RATE, chat_rate=TG_CHAT_SEND_RATE, chat_burst=TG_CHAT_BURST)
+client = Lazy(_openai_client)
+warmup.add("openai", client)
+# Таймауты, повторы, подстраховка и предохранитель — общие для обоих режимов
+openai_up = Upstream(
+    "openai",
+    parse_policies(OPENAI_TIMEOUTS, attempts=UPSTREAM_ATTEMPTS),
+    hedge=("chat", "stream") if CHAT_HEDGE else (),
+    failures=BREAKER_FAILURES,
+    reset_after=parse_duration(BREAKER_RESET),
+)
+replicate_up = Upstream(
+    "replicate",
+    parse_policies(REPLICATE_TIMEOUTS, attempts=UPSTREAM_ATTEMPTS),
+    non_idempotent=("create",),
+    failures=BREAKER_FAILURES,
+    reset_after=parse_duration(BREAKER_RESET),
+)
+metrics.gauge("upstream_open", lambda: {
+    (("upstream", up.name),): int(up.breaker.state != "closed") for up in (openai_up, replicate_up)
+})
+replicate_api = ReplicateApi(REPLICATE_API_TOKEN, REPLICATE_API_URL, upstream=replicate_up)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Глобальные вспомогательные структуры
 # ──────────────────────────────────────────────────────────────────────────────
 
-# Небольшая «память» диалога на пользователя (не база, просто последние ответы)
-ASSIST_BY_USER: dict[int, deque[str]] = defaultdict(lambda: deque(maxlen=1))
+# Сохранённые даты "Чайки" и история диалогов с GPT — переживают
+# перезапуск, пишутся на диск в фоне
+state = StateStore(os.path.join(DATA_DIR, "state.sqlite3"), flush_interval=STATE_FLUSH_INTERVAL)
+atexit.register(state.close)
+
+# Продажи по коду показа и меню по месяцу "мм.гггг"
+show_cache = SWRCache(SHOW_CACHE_TTL, SHOW_CACHE_STALE, CACHE_MAX_ENTRIES, name="shows")
+menu_cache = SWRCache(MENU_CACHE_TTL, MENU_CACHE_STALE, CACHE_MAX_ENTRIES, name="menus")
+# Поиск показов для inline-режима: пополняется при каждом разборе меню месяца
+show_index = ShowIndex()
+
+# Сгенерированные картинки и видео: ключ промпта+параметров → file_id
+media_cache = MediaCache(
+    os.path.join(DATA_DIR, "media_cache.sqlite3"),
+    max_entries=MEDIA_CACHE_MAX_ENTRIES,
+    max_age=parse_duration(MEDIA_CACHE_MAX_AGE),
+)
+atexit.register(media_cache.flush)
+
+# Цифры каждого скрейпа показа: «сколько со вчера», темп, прогноз — без админки
+sales_history = SalesHistory(
+    os.path.join(DATA_DIR, "sales_history.sqlite3"),
+    raw_keep=parse_duration(SALES_HISTORY_RAW_KEEP),
+    keep=parse_duration(SALES_HISTORY_KEEP),
+)
+atexit.register(sales_history.close)
 
-seagull_dates: list[str] = []
-seagull_codes: list[str] = []
+def _lane_spec(spec: str) -> tuple[int, int]:
+    workers, _, limit = spec.partition(":")
+    return int(workers), int(limit or 0) or int(workers) * 10
 
-THIS_MONTH = datetime.now().month
-THIS_YEAR = datetime.now().year
+# Билеты, чат с GPT (текст/голос) и медиа не отнимают друг у друга потоки
+dispatcher = Dispatcher({
+    "tickets": _lane_spec(LANE_TICKETS),
+    "chat": _lane_spec(LANE_CHAT),
+    "media": _lane_spec(LANE_MEDIA),
+})
+metrics.gauge("lane_queued", lambda: {(("lane", n),): st["queued"] for n, st in dispatcher.stats().items()})
+metrics.gauge("lane_active", lambda: {(("lane", n),): st["active"] for n, st in dispatcher.stats().items()})
+
+# Карточки для сводки за месяц — общий пул на все отчёты, чтобы не завалить
+# админку; браузеров в режиме selenium параллельно всё равно не больше пула
+report_executor = ThreadPoolExecutor(
+    max_workers=min(BULK_REPORT_CONCURRENCY, DRIVER_POOL_SIZE) if SCRAPE_ENGINE == "selenium" else BULK_REPORT_CONCURRENCY,
+    thread_name_prefix="report",
+)
 
-# Отдельный профиль для headless-Chrome
-USER_DATA_DIR = tempfile.mkdtemp(prefix="chrome-profile-")
+# Синтез речи по фразам — общий на все голосовые, чтобы не плодить потоки
+tts_executor = ThreadPoolExecutor(max_workers=VOICE_TTS_WORKERS, thread_name_prefix="tts")
 
 # ──────────────────────────────────────────────────────────────────────────────
-# Селениум: логин и драйвер (создаём один на весь процесс)
+# Доступ к админке: HTTP-клиент, браузеры и вход — в воркерах или здесь же
 # ──────────────────────────────────────────────────────────────────────────────
 
-def create_driver_logged_in() -> webdriver.Chrome:
-    opts = Options()
-    opts.add_argument("--headless=new")
-    opts.add_argument("--disable-gpu")
-    opts.add_argument("--no-sandbox")
-    opts.add_argument("--disable-dev-shm-usage")
-    opts.add_argument("window-size=1920,1080")
-    opts.add_experimental_option("excludeSwitches", ["enable-automation"])
-    opts.add_experimental_option("useAutomationExtension", False)
-    opts.add_argument("--disable-blink-features=AutomationControlled")
-    # профиль — чтобы меньше светиться как автотест
-    opts.add_argument(f"--user-data-dir={USER_DATA_DIR}")
-    # случайный порт для remote-debug
-    opts.add_argument(f'--remote-debugging-port={random.randint(9200, 9400)}')
-
-    drv = webdriver.Chrome(options=opts)
-    drv.get("https://tickets.afisha.ru/admin/login")
-
-    # Логин
-    drv.find_element(By.ID, "email").send_keys(THEATER_EMAIL)
-    drv.find_element(By.ID, "password").send_keys(THEATER_PASSWORD)
-    drv.find_element(By.XPATH, "//button[contains(., 'Войти')]").click()
-
-    # Подождём видимость главного блока кабинета
-    WebDriverWait(drv, 20).until(
-        ec.any_of(
-            ec.url_contains("/admin"),
-            ec.presence_of_element_located((By.TAG_NAME, "body"))
-        )
+scrape_config = dict(
+    base_url=AFISHA_BASE_URL,
+    email=THEATER_EMAIL,
+    password=THEATER_PASSWORD,
+    engine=SCRAPE_ENGINE,
+    page_marker=PAGE_MARKER,
+    # куки на диске общие для всех воркеров и переживают перезапуск бота
+    cookies_path=os.path.join(DATA_DIR, "afisha_cookies.json"),
+    login_backoff=ADMIN_LOGIN_BACKOFF,
+    login_max_backoff=ADMIN_LOGIN_MAX_BACKOFF,
+    pool_timeout=DRIVER_WAIT_TIMEOUT,
+    lean=LEAN_CHROME,
+    lean_block=LEAN_CHROME_BLOCK,
+)
+if SCRAPE_WORKERS > 0:
+    scraper = ScrapeWorkers(
+        SCRAPE_WORKERS,
+        dict(scrape_config, pool_size=-(-DRIVER_POOL_SIZE // SCRAPE_WORKERS)),
+        threads=max(4, BULK_REPORT_CONCURRENCY),
+        timeout=SCRAPE_TIMEOUT,
+        max_rss_mb=SCRAPE_WORKER_MAX_RSS_MB,
     )
-    return drv
+else:
+    scraper = AfishaScraper(pool_size=DRIVER_POOL_SIZE, **scrape_config)
+atexit.register(scraper.close)
+warmup.add("admin", scraper.warm)
 
-driver = create_driver_logged_in()
-
-def _shutdown_driver() -> None:
-    try:
-        driver.quit()
-    except Exception:
-        pass
-
-atexit.register(_shutdown_driver)
 
 def _graceful_exit(signum: int, frame) -> None:
     sys.exit(0)
@@ -170,30 +395,46 @@ MD_ESCAPE = str.maketrans({
 def md_escape(text: str) -> str:
     return text.translate(MD_ESCAPE)
 
-def get_user_assist(uid: int) -> str:
-    dq = ASSIST_BY_USER[uid]
-    return dq[-1] if dq else ""
+LANE_BUSY_TEXT = "Сейчас много запросов такого рода, попробуй через минутку."
+
+def run_in_lane(lane: str, chat_id: int, fn, *args) -> None:
+    """Отправить работу в полосу; если её очередь полна — сразу сказать «занято»."""
+    if not dispatcher.submit(lane, chat_id, metrics.track()(fn), *args):
+        log.warning("Полоса %s переполнена, отказ чату %s", lane, chat_id)
+        bot.send_message(chat_id, LANE_BUSY_TEXT)
 
-def set_user_assist(uid: int, msg: str) -> None:
-    ASSIST_BY_USER[uid].append(msg)
+def in_lane(lane: str):
+    """Хэндлер целиком выполняется в полосе, поток telebot сразу освобождается."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(update):
+            msg = getattr(update, "message", None) or update   # CallbackQuery → Message
+            run_in_lane(lane, msg.chat.id, fn, update)
+        return wrapper
+    return deco
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Голос ↔ текст
 # ──────────────────────────────────────────────────────────────────────────────
 
-def voice_to_text(path_ogg: str) -> str:
-    with open(path_ogg, "rb") as f:
-        tr = client.audio.transcriptions.create(model=WHISPER_MODEL, file=f)
+def voice_to_text(data: bytes) -> str:
+    # OGG прямо из памяти: без временного файла и без гонок между чатами
+    with metrics.stage("openai.stt"):
+        tr = openai_up.call("stt", lambda timeout: client().audio.transcriptions.create(
+            model=WHISPER_MODEL, file=("voice.ogg", data), timeout=timeout,
+        ))
     return tr.text
 
 def text_to_voice(text: str) -> BytesIO:
     # OpenAI TTS → opus/ogg
-    rsp = client.audio.speech.create(
-        input=text,
-        model=VOICE_TTS_MODEL,
-        voice="nova",
-        response_format="opus",
-    )
+    with metrics.stage("openai.tts"):
+        rsp = openai_up.call("tts", lambda timeout: client().audio.speech.create(
+            input=text,
+            model=VOICE_TTS_MODEL,
+            voice="nova",
+            response_format="opus",
+            timeout=timeout,
+        ))
     bio = BytesIO(rsp.content)
     bio.seek(0)
     return bio
@@ -207,231 +448,657 @@ SYSTEM_PROMPT_RU = (
     "Имя — Панда или Елена или Нейрочайка; 19 лет, философски-саркастичный тон, афористично."
 )
 
-def gpt_reply(uid: int, text: str) -> str:
-    try:
-        assist_prev = get_user_assist(uid)
-        resp = client.chat.completions.create(
-            model=CHAT_MODEL,
+CHAT_FAILED_TEXT = "Сегодня язык не поворачивается… Спроси меня попозже."
+CHAT_SLOW_TEXT = "GPT не ответил вовремя даже со второй попытки. Спроси ещё раз через минутку."
+CHAT_DOWN_TEXT = "GPT сейчас лежит, я его пару минут не трогаю. Спроси попозже."
+
+def upstream_failed(what: str, e: Exception) -> None:
+    """В лог: ожидаемые сбои API — строкой, всё прочее — с трассой."""
+    if isinstance(e, CircuitOpen) or transient(e):
+        log.warning("%s: %s: %s", what, type(e).__name__, e)
+    else:
+        log.error("%s", what, exc_info=e)
+
+def chat_failed(e: Exception, what: str = "OpenAI chat") -> str:
+    """Что ответить пользователю, когда GPT не ответил."""
+    upstream_failed(what, e)
+    if isinstance(e, CircuitOpen):
+        return CHAT_DOWN_TEXT
+    return CHAT_SLOW_TEXT if transient(e) else CHAT_FAILED_TEXT
+
+SUMMARY_PROMPT_RU = (
+    "Сожми диалог в краткое содержание по-русски: что известно о собеседнике, "
+    "о чём говорили, о чём договорились. Не больше 80 слов, без вступлений."
+)
+
+def summarize_turns(summary: str, turns: list[Turn]) -> str:
+    dialog = "\n".join(f"{'Собеседник' if role == 'user' else 'Ты'}: {text}" for role, text in turns)
+    with metrics.stage("openai.summary"):
+        resp = openai_up.call("summary", lambda timeout: client().chat.completions.create(
+            model=CHAT_SUMMARY_MODEL,
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT_RU},
-                {"role": "assistant", "content": assist_prev},
-                {"role": "user", "content": text},
+                {"role": "system", "content": SUMMARY_PROMPT_RU},
+                {"role": "user", "content": f"Прежнее содержание: {summary or '—'}\n\nНовые реплики:\n{dialog}"},
             ],
-            max_tokens=1200,
-            temperature=0.9,
-        )
+            max_tokens=CHAT_SUMMARY_TOKENS,
+            temperature=0.3,
+            timeout=timeout,
+        ))
+    return resp.choices[0].message.content or ""
+
+def _load_chat(uid: int) -> dict | None:
+    data = state.get("chat", uid)
+    if data is None:
+        # до появления истории хранился только последний ответ
+        assist = state.get("assist", uid)
+        state.drop("assist", uid)
+        if assist:
+            data = {"turns": [["assistant", assist]]}
+    return data
+
+chat_memory = ChatMemory(
+    summarize=summarize_turns,
+    load=_load_chat,
+    save=lambda uid, data: state.put("chat", uid, data),
+    unload=lambda uid: state.drop("chat", uid),
+    history_tokens=CHAT_HISTORY_TOKENS,
+    summary_tokens=CHAT_SUMMARY_TOKENS,
+    max_total_tokens=CHAT_MEMORY_MAX_TOKENS,
+    idle_ttl=parse_duration(CHAT_MEMORY_IDLE),
+)
+
+warmup.add("tokenizer", lambda: count_tokens("прогрев"))
+
+def chat_messages(uid: int, text: str) -> list[dict]:
+    return chat_memory.messages(uid, SYSTEM_PROMPT_RU, text)
+
+def remember_turn(uid: int, text: str, reply: str) -> None:
+    chat_memory.add_turn(uid, text, reply)
+
+def gpt_reply(uid: int, text: str) -> str:
+    try:
+        messages = chat_messages(uid, text)
+        with metrics.stage("openai.chat"):
+            resp = openai_up.call("chat", lambda timeout: client().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                max_tokens=1200,
+                temperature=0.9,
+                timeout=timeout,
+            ))
         msg = resp.choices[0].message.content
-        set_user_assist(uid, msg)
+        remember_turn(uid, text, msg)
         return msg
     except Exception as e:
-        log.exception("OpenAI chat error")
-        return "Сегодня язык не поворачивается… Спроси меня попозже."
+        return chat_failed(e)
+
+def gpt_stream(uid: int, text: str):
+    """Куски ответа по мере генерации (в память пользователя не пишет)."""
+    t0 = time.perf_counter()
+    messages = chat_messages(uid, text)
+    # timeout действует и между кусками потока: замолчавший поток оборвётся
+    stream = openai_up.call("stream", lambda timeout: client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=1200,
+        temperature=0.9,
+        stream=True,
+        timeout=timeout,
+    ), discard=lambda s: s.close())
+    first = True
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first:
+                # до первого токена — то, что пользователь ждёт молча
+                metrics.observe_stage("openai.chat.first_token", time.perf_counter() - t0)
+                first = False
+            yield chunk.choices[0].delta.content
+    metrics.observe_stage("openai.chat.stream", time.perf_counter() - t0)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Картинки и беззвучные видео
 # ──────────────────────────────────────────────────────────────────────────────
 
+IMG_SIZE = "1024x1024"
+
+def media_command(text: str, verb: str) -> tuple[str, bool] | None:
+    """«Нарисуй: …» → (промпт, False), «Нарисуй заново: …» → (промпт, True — мимо кэша)."""
+    for prefix, fresh in ((f"{verb} заново:", True), (f"{verb}:", False)):
+        if text.startswith(prefix):
+            return text[len(prefix):].strip(), fresh
+    return None
+
+def image_key(prompt: str) -> str:
+    return media_key("photo", IMG_MODEL, prompt, size=IMG_SIZE)
+
+def video_key(prompt: str, params: dict) -> str:
+    return media_key("video", T2V_MODEL, prompt, **params)
+
+def sent_file_id(msg: types.Message) -> str:
+    media = msg.video or msg.animation or msg.document
+    if media is not None:
+        return media.file_id
+    return msg.photo[-1].file_id if msg.photo else ""
+
+def send_cached(send, chat_id: int, key: str, **kwargs) -> bool:
+    """Переслать готовый файл по file_id из кэша; False — в кэше нет, надо генерировать."""
+    file_id = media_cache.get(key)
+    if not file_id:
+        return False
+    try:
+        send(chat_id, file_id, **kwargs)
+        return True
+    except telebot.apihelper.ApiTelegramException as e:
+        log.warning("file_id из кэша не принят (%s), генерируем заново", e.description)
+        media_cache.forget(key)
+        return False
+
 def generate_image_from_prompt(prompt: str) -> str:
+    import openai
     try:
-        rsp = client.images.generate(
-            model=IMG_MODEL,
-            prompt=prompt,
-            n=1,
-            size="1024x1024",
-        )
+        with metrics.stage("openai.image"):
+            rsp = openai_up.call("image", lambda timeout: client().images.generate(
+                model=IMG_MODEL,
+                prompt=prompt,
+                n=1,
+                size=IMG_SIZE,
+                timeout=timeout,
+            ))
         return rsp.data[0].url
     except openai.BadRequestError:
         return ""
-    except Exception:
-        log.exception("Image generation error")
+    except Exception as e:
+        upstream_failed("Image generation", e)
         return ""
 
-def t2v_generate(
+def t2v_input(
         prompt: str,
         aspect_ratio: str = "16:9",
         resolution: str = "480p",
         num_frames: int = 81,
         fps: int = 16,
         go_fast: bool = True,
-):
-    """
-    Возвращает:
-      • str (URL), если модель дала ссылку;
-      • BytesIO — если пришёл бинарный поток.
-    """
+) -> dict:
+    return {
+        "prompt": prompt,
+        "go_fast": go_fast,
+        "num_frames": num_frames,
+        "resolution": resolution,
+        "aspect_ratio": aspect_ratio,
+        "frames_per_second": fps,
+    }
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Очередь видео: статус одним сообщением, кнопка отмены
+# ──────────────────────────────────────────────────────────────────────────────
+
+VIDEO_CANCEL_PREFIX = "vjcancel:"
+VIDEO_BUSY_TEXT = "У тебя уже несколько роликов в очереди — дождись их, потом заказывай ещё."
+
+def video_status_text(job: Job, position: int) -> str:
+    head = f"🎬 «{job.prompt}»\n"
+    if job.state == QUEUED:
+        return head + f"Место в очереди: {position}."
+    if job.state == RUNNING:
+        pct = f" {int(job.progress * 100)}%" if job.progress is not None else ""
+        return head + f"Рендерится…{pct}"
+    if job.state == DELIVERING:
+        return head + "Готово, загружаю видео…"
+    if job.state == DONE:
+        return head + "Готово ✅"
+    if job.state == CANCELED:
+        return head + "Отменено."
+    return head + f"Не получилось: {job.error}"
+
+def video_cancel_kb(job_id: int) -> types.InlineKeyboardMarkup:
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton("Отменить", callback_data=f"{VIDEO_CANCEL_PREFIX}{job_id}"))
+    return kb
+
+def _video_notify(job: Job, position: int) -> None:
+    if not job.message_id:
+        return
+    kb = video_cancel_kb(job.id) if job.state in (QUEUED, RUNNING) else None
     try:
-        out = rep.run(
-            T2V_MODEL,
-            input={
-                "prompt": prompt,
-                "go_fast": go_fast,
-                "num_frames": num_frames,
-                "resolution": resolution,
-                "aspect_ratio": aspect_ratio,
-                "frames_per_second": fps,
-            },
-        )
-        if hasattr(out, "url") and out.url:
-            return out.url
-        if hasattr(out, "read"):
-            return BytesIO(out.read())
-        if isinstance(out, (list, tuple)) and out:
-            first = out[0]
-            if hasattr(first, "url") and first.url:
-                return first.url
-            if hasattr(first, "read"):
-                return BytesIO(first.read())
-            if isinstance(first, str) and first.strip():
-                return first.strip()
-        if isinstance(out, str) and out.strip():
-            return out.strip()
-        raise RuntimeError("Replicate: пустой вывод модели")
-    except ModelError as e:
-        logs = ""
-        try:
-            logs = getattr(getattr(e, "prediction", None), "logs", "") or ""
-        except Exception:
-            pass
-        raise RuntimeError(f"Replicate: ошибка модели. {logs or str(e)}")
-    except Exception as e:
-        raise RuntimeError(f"Replicate: непредвиденная ошибка: {e}")
+        bot.edit_message_text(video_status_text(job, position), job.chat_id, job.message_id, reply_markup=kb)
+    except telebot.apihelper.ApiTelegramException as e:
+        if "message is not modified" not in e.description:
+            log.warning("Статус видео %s: %s", job.id, e.description)
+
+def _video_deliver(job: Job, video) -> None:
+    if isinstance(video, bytes):
+        video = BytesIO(video)
+        video.name = "video.mp4"
+    sent = bot.send_video(job.chat_id, video, caption=f"“{job.prompt}”")
+    file_id = sent_file_id(sent)
+    if file_id:
+        media_cache.put(video_key(job.prompt, job.params), "video", file_id, job.prompt)
+
+video_jobs = VideoJobs(
+    replicate_api,
+    JobStore(os.path.join(DATA_DIR, "video_jobs.sqlite3")),
+    model=T2V_MODEL,
+    build_input=t2v_input,
+    notify=_video_notify,
+    deliver=_video_deliver,
+    max_running=VIDEO_MAX_RUNNING,
+    max_per_user=VIDEO_MAX_PER_USER,
+    max_queued_per_user=VIDEO_MAX_QUEUED_PER_USER,
+    poll_interval=REPLICATE_POLL_INTERVAL,
+    job_timeout=VIDEO_JOB_TIMEOUT,
+)
+metrics.gauge("video_jobs", lambda: {(("state", k),): v for k, v in video_jobs.stats().items()})
+
+def enqueue_video(chat_id: int, user_id: int, prompt: str, fresh: bool = False, **params) -> None:
+    """Поставить ролик в очередь; дальше статус правит сама очередь."""
+    if not fresh and send_cached(bot.send_video, chat_id, video_key(prompt, params), caption=f"“{prompt}”"):
+        return
+    msg = bot.send_message(chat_id, f"🎬 «{prompt}»\nСтавлю в очередь…")
+    try:
+        video_jobs.submit(user_id, chat_id, msg.message_id, prompt, **params)
+    except VideoQueueFull:
+        bot.edit_message_text(VIDEO_BUSY_TEXT, chat_id, msg.message_id)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Парсинг админки: продажа билетов
 # ──────────────────────────────────────────────────────────────────────────────
 
-def wait_ajax_complete(drv, timeout=20):
-    WebDriverWait(drv, timeout).until(lambda d: d.execute_script(
-        "return (document.readyState==='complete') && (window.jQuery ? jQuery.active==0 : true)"
-    ))
+BUSY_TEXT = "Все браузеры сейчас заняты, попробуй через минутку."
 
-def fetch_show_by_code(code: str) -> str:
-    url = f"https://tickets.afisha.ru/admin/events/info/{code}"
-    driver.get(url)
-    wait_ajax_complete(driver, timeout=25)
-    WebDriverWait(driver, 25).until(
-        ec.visibility_of_element_located((By.CSS_SELECTOR, "div.pull-right.text-primary"))
-    )
-    soup = BeautifulSoup(driver.page_source, "html.parser")
+def load_admin_page(path: str) -> str:
+    """HTML страницы админки (в режиме воркеров — из отдельного процесса)."""
+    return scraper.load(path)
 
-    name = soup.find("a", href=re.compile(r"/admin/shows\?name="))
-    element = soup.find("div", class_="pull-right text-primary")
-    if not element or not name:
-        return "Не получилось просканировать сайт. Попробуй ещё раз."
+RELOAD_TEXT = "Перезапускаю вход в админку и браузеры, бот при этом продолжает работать…"
 
-    date = element.get_text(strip=True).split(')')[1]
-    places = soup.find_all("p", {"style": "margin-bottom: 4px;"})
+def reload_scraping() -> str:
+    """
+    «🔄 Перезагрузить»: пересоздать только доступ к админке — забыть куки и
+    паузу после неудачных входов, заменить браузеры (или воркеры целиком)
+    и войти заново. Telegram-процесс, очереди и кэши не трогаются.
+    """
+    try:
+        closed = scraper.reload()
+    except Exception as e:
+        log.warning("Перезагрузка парсинга: вход не удался: %s", e)
+        return f"Браузеры сброшены, но войти в админку не получилось: {e}"
+    log.info("Парсинг перезагружен (закрыто браузеров или воркеров: %d)", closed)
+    return "Готово: вход в админку выполнен заново."
+
+SCRAPE_FAILED_TEXT = "Не получилось просканировать сайт. Попробуй ещё раз."
+LOGIN_FAILED_TEXT = "Не получается войти в админку театра. Попробуй позже или нажми «🔄 Перезагрузить бота»."
+
+class ScrapeError(Exception):
+    """Страница пришла, но нужных блоков на ней нет."""
+
+def scrape_show(code: str) -> ShowInfo:
+    html = load_admin_page(f"/admin/events/info/{code}")
+    with metrics.stage("parse.show"):
+        info = parse_show(html, code)
+    if info is None:
+        raise ScrapeError(f"нет названия/даты на странице показа {code}")
+    if info.missing():
+        log.warning("Показ %s: не распознаны поля %s — вёрстка поменялась?", code, info.missing())
+    sales_history.record(info)
+    return info
+
+def scrape_month(month_yyyy_mm: str) -> tuple[MenuItem, ...]:
+    html = load_admin_page(f"/admin/events/menu_date?date={month_yyyy_mm}")
+    with metrics.stage("parse.month"):
+        items = tuple(parse_month(html))
+    show_index.update(month_yyyy_mm, items, start=lambda it: show_start(it.date, month_yyyy_mm))
+    return items
+
+def get_show(code: str) -> ShowInfo:
+    """Продажи показа через кэш (может бросить PoolTimeout/ScrapeError)."""
+    return show_cache.get(code, lambda: scrape_show(code))
+
+def get_month(month_yyyy_mm: str) -> tuple[MenuItem, ...]:
+    return menu_cache.get(month_yyyy_mm, lambda: scrape_month(month_yyyy_mm))
 
-    def _between(txt: str, left: str, right: str) -> str:
-        try:
-            return txt.split(left)[1].split(right)[0]
-        except Exception:
-            return "—"
-
-    plains = str(places)
-    sold_cnt = _between(plains, "Продано <b>", "</")
-    sold_sum = _between(plains, "Продано <b>", "</b> р.").split("<b>")[-1].split(".")[0]
-    sold_fact_cnt = _between(plains, "Продано фактически <b>", "</")
-    sold_fact_sum = _between(plains, "Продано фактически <b>", "</b> р.").split("<b>")[-1]
-    booked_cnt = _between(plains, "Забронировано <b>", "</")
-    booked_sum = _between(plains, "Забронировано <b>", "</b> р.").split("<b>")[-1]
-
-    return (
-        f'Спектакль "{name.text}"\n'
-        f"{date}\n"
-        f"Продано билетов: {sold_cnt} на {sold_sum} рублей\n"
-        f"Продано фактически: {sold_fact_cnt} на {sold_fact_sum} рублей\n"
-        f"Забронировано: {booked_cnt} на {booked_sum} рублей"
-    )
+def fetch_show_by_code(code: str) -> str:
+    try:
+        return format_show(get_show(code))
+    except PoolTimeout:
+        log.warning("Нет свободного браузера для кода %s", code)
+        return BUSY_TEXT
+    except (ScrapeError, ScrapeFailed) as e:
+        log.warning("Парсинг показа: %s", e)
+        return SCRAPE_FAILED_TEXT
+    except AfishaAuthError as e:
+        log.warning("Вход в админку: %s", e)
+        return LOGIN_FAILED_TEXT
 
 def fetch_month_menu(month_yyyy_mm: str, only_seagull: bool = False) -> tuple[list[str], list[str]]:
     """
     Возвращает (список строк-описаний, список URL-кодов).
     Если only_seagull=True — фильтруем по "ЧАЙКА".
     """
-    url = f"https://tickets.afisha.ru/admin/events/menu_date?date={month_yyyy_mm}"
-    driver.get(url)
-    wait_ajax_complete(driver, timeout=25)
-    WebDriverWait(driver, 25).until(
-        ec.visibility_of_element_located((By.CSS_SELECTOR, "div.pull-right.text-primary"))
-    )
+    shows = [it for it in get_month(month_yyyy_mm) if it.is_seagull or not only_seagull]
+    return [it.text for it in shows], [it.code for it in shows]
+
+TREND_MAX_LINES = 30
+
+def trend_reply(arg: str) -> str:
+    """
+    /trend <код> — подробно по показу; /trend <название> или просто /trend —
+    строкой на каждый ближайший показ. Только из истории, в админку не ходит.
+    """
+    arg = arg.strip()
+    if arg.isdigit():
+        t = sales_history.trend(arg)
+        if t is None:
+            return f"По коду {arg} истории пока нет — сначала посмотри его продажи."
+        return format_trend(t, HALL_CAPACITY)
+    codes = sales_history.find(arg, since=time.time() - SEAGULL_KEEP_AFTER_START)
+    if not codes:
+        return "Истории продаж по ближайшим показам пока нет" + (f" («{arg}»)." if arg else ".")
+    lines = [format_trend_line(t) for t in map(sales_history.trend, codes[:TREND_MAX_LINES]) if t]
+    if len(codes) > TREND_MAX_LINES:
+        lines.append(f"…и ещё {len(codes) - TREND_MAX_LINES}: уточни название или код")
+    return "\n".join(lines)
+
+INLINE_MAX_RESULTS = 20
+# Сколько первых найденных показов без карточки подгрузить в фоне — к следующему нажатию
+INLINE_PREFETCH = 3
+INLINE_MONTHS = 3
+
+def inline_results(query: str) -> list[types.InlineQueryResultArticle]:
+    """
+    Ответ на «@бот <запрос>» только из памяти: индекс показов и кэш карточек.
+    Чего нет — заказывается в фоне и попадёт в ответ на следующий запрос,
+    сам ответ админку не ждёт никогда.
+    """
+    for mon in upcoming_months(INLINE_MONTHS):
+        menu_cache.warm(mon, lambda mon=mon: scrape_month(mon))
+    results = []
+    found = show_index.search(query, limit=INLINE_MAX_RESULTS, since=time.time() - SEAGULL_KEEP_AFTER_START)
+    for i, show in enumerate(found):
+        info = show_cache.peek(show.code)
+        if info is None and i < INLINE_PREFETCH:
+            show_cache.warm(show.code, lambda code=show.code: scrape_show(code))
+        if info is not None:
+            text = format_show(info)
+            about = f"Код {show.code} · продано {fmt_number(info.sold_cnt)} на {fmt_number(info.sold_sum)} ₽"
+        else:
+            text = f'Спектакль "{show.title}"\n{show.date}\nКод: {show.code}'
+            about = f"Код {show.code} · продажи ещё не загружены"
+        results.append(types.InlineQueryResultArticle(
+            id=show.code,
+            title=f"{show.date} {show.title}",
+            description=about,
+            input_message_content=types.InputTextMessageContent(text),
+        ))
+    return results
 
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    blocks = soup.find_all(class_="nav navbar-nav extend-menu")
-    if not blocks:
-        return [], []
+# ──────────────────────────────────────────────────────────────────────────────
+# Фоновый прогрев продаж ближайших "Чаек"
+# ──────────────────────────────────────────────────────────────────────────────
 
-    soup2 = BeautifulSoup("".join(str(p) for p in blocks), "html.parser")
-    links = soup2.find_all("a")
+_SHOW_START_RE = re.compile(r"(\d{1,2})\.(\d{2})(?:\.\d{4})?\s+(\d{1,2}):(\d{2})")
+
+def upcoming_months(count: int = 2) -> list[str]:
+    """Текущий и следующие месяцы в формате "мм.гггг"."""
+    now = datetime.now()
+    months = []
+    for i in range(count):
+        y, m = divmod(now.month - 1 + i, 12)
+        months.append(f"{m + 1:02d}.{now.year + y}")
+    return months
+
+def show_start(text: str, month_yyyy_mm: str) -> float | None:
+    """Время начала показа (epoch) по строке меню вида "Пт, 12.09 19:00 ЧАЙКА…"."""
+    m = _SHOW_START_RE.search(text)
+    if not m:
+        return None
+    day, month, hour, minute = map(int, m.groups())
+    year = int(month_yyyy_mm.split(".")[1])
+    try:
+        return datetime(year, month, day, hour, minute).timestamp()
+    except ValueError:
+        return None
+
+def _discover_seagull() -> list[tuple[str, float | None]]:
+    return [
+        (it.code, show_start(it.date, mon))
+        for mon in upcoming_months()
+        for it in get_month(mon) if it.is_seagull
+    ]
+
+prefetcher = PrefetchScheduler(
+    discover=_discover_seagull,
+    fetch=lambda code: show_cache.refresh(code, lambda: scrape_show(code)),
+    tiers=parse_tiers(PREFETCH_TIERS),
+    discover_every=parse_duration(PREFETCH_DISCOVER_EVERY),
+    jitter=PREFETCH_JITTER,
+    max_concurrency=PREFETCH_CONCURRENCY,
+)
 
-    items, codes = [], []
-    for link in links:
-        href = link.get("href", "")
-        if not href.startswith("https://tickets.afisha.ru/admin/events/info/"):
-            continue
-        text = " ".join(link.stripped_strings)
-        text = re.sub(r"\s+", " ", text)
-        if only_seagull and "ЧАЙКА" not in text:
-            continue
-        items.append(text)
-        codes.append(href.split("/info/")[1])
+# ──────────────────────────────────────────────────────────────────────────────
+# Экраны и тексты (общие для обычного и асинхронного режима)
+# ──────────────────────────────────────────────────────────────────────────────
 
-    return items, codes
+BTN_BY_CODE = "🔢 Билеты по коду спектакля"
+BTN_DATES = "📆 Узнать даты показа и коды"
+BTN_SEAGULL = "🔍 Проверить билеты \"Чайки\""
+BTN_MISC = "🗄️ Прочее"
+BTN_THIS_MONTH = "🕰️ Спектакли в текущем месяце"
+BTN_OTHER_MONTH = "🗂️ Спектакли в другом месяце"
+BTN_REPORT = "📊 Продажи за месяц"
+BTN_BACK = "⬅️ Назад в главное меню"
+BTN_ADD_SEAGULL = "📥 Найти и добавить даты \"Чайки\""
+BTN_RELOAD = "🔄 Перезагрузить бота"
+BTN_INFO = "📓 Информация"
+
+ASK_MONTH_TEXT = "Введи месяц и год в формате \"мм.гггг\". Например, 09.2025"
+NO_SEAGULL_DATES_TEXT = (
+    "У бота пока нет дат\\! Нажми на кнопку \n`📥 Найти и добавить даты \"Чайки\"`\nв дополнительном меню\\."
+)
+INFO_TEXT = (
+    "Краткая инструкция.\n\n"
+    "🔍 Проверить билеты \"Чайки\" — быстрая проверка продаж.\n"
+    "Если бот не знает даты показа, нажми: 📥 Найти и добавить даты \"Чайки\".\n\n"
+    "Можно смотреть продажи любого спектакля по коду.\n"
+    "Коды/даты ищутся через: 📆 Узнать даты показа и коды.\n"
+    "Код копируется нажатием. Потом — в главное меню → 🔢 Билеты по коду спектакля.\n\n"
+    "/trend <код> — как продаётся показ: сколько со вчера, по дням, темп и прогноз к началу. "
+    "/trend чайка — строкой по каждой ближайшей «Чайке». Отвечает сразу, из истории уже "
+    "просмотренных продаж.\n\n"
+    "В любом чате: @имя_бота чайка (или дата, или код) — выбери показ, и в чат уйдёт "
+    "его карточка продаж.\n\n"
+    "Повторный «Нарисуй:» или «Сними:» с тем же текстом присылает уже готовое мгновенно. "
+    "Нужен новый вариант — пиши «Нарисуй заново: …» или «Сними заново: …».\n\n"
+    "Обработка ошибок минимальная, вводите аккуратно.\n"
+    "Онлайн-табличка \"График\" — кнопка слева от ввода текста (редактировать может любой).\n"
+    "P.S. Прямая ссылка: https://disk.yandex.ru/i/RunXym0TQutCqA"
+)
+
+def _reply_kb(*buttons: str) -> types.ReplyKeyboardMarkup:
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for text in buttons:
+        kb.row(types.KeyboardButton(text))
+    return kb
+
+def main_menu_kb() -> types.ReplyKeyboardMarkup:
+    return _reply_kb(BTN_BY_CODE, BTN_DATES, BTN_SEAGULL, BTN_MISC)
+
+def dates_menu_kb() -> types.ReplyKeyboardMarkup:
+    return _reply_kb(BTN_THIS_MONTH, BTN_OTHER_MONTH, BTN_REPORT, BTN_BACK)
+
+def misc_menu_kb() -> types.ReplyKeyboardMarkup:
+    return _reply_kb(BTN_ADD_SEAGULL, BTN_RELOAD, BTN_INFO, BTN_BACK)
+
+SHOW_CALLBACK_PREFIX = "show:"
+# Сколько после начала показ ещё виден в списке (продажи по факту смотрят и после)
+SEAGULL_KEEP_AFTER_START = 12 * 3600
+
+def upcoming_seagull() -> list[SavedShow]:
+    return state.upcoming_shows(time.time() - SEAGULL_KEEP_AFTER_START)
+
+def seagull_dates_kb(shows: list[SavedShow]) -> types.InlineKeyboardMarkup:
+    keyboard = types.InlineKeyboardMarkup()
+    for show in shows:
+        keyboard.add(types.InlineKeyboardButton(text=show.date, callback_data=SHOW_CALLBACK_PREFIX + show.code))
+    return keyboard
+
+def seagull_code_for(callback_data: str) -> str | None:
+    if callback_data.startswith(SHOW_CALLBACK_PREFIX):
+        return callback_data[len(SHOW_CALLBACK_PREFIX):]
+    # кнопки, отправленные до перехода на show:<код>, несут только дату
+    return state.code_for_date(callback_data)
+
+def month_list_blocks(shows: tuple[MenuItem, ...]) -> list[str]:
+    """Список показов сообщениями до 4096 символов, экранированный для MarkdownV2."""
+    return pack(md_escape(f"{it.date}\n\"{it.title}\"\nКод: `{it.code}`\n\n") for it in shows)
+
+def find_seagull_shows() -> list[SavedShow]:
+    """Все "Чайки" текущего и следующего месяца (может бросить PoolTimeout)."""
+    return [
+        SavedShow(it.code, it.date, it.title, show_start(it.date, mon))
+        for mon in upcoming_months()
+        for it in get_month(mon) if it.is_seagull
+    ]
+
+def remember_seagull(shows: list[SavedShow]) -> int:
+    """Запомнить даты без повторов; вернуть, сколько новых."""
+    return state.add_shows(shows)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Хэндлеры Telegram
 # ──────────────────────────────────────────────────────────────────────────────
 
+# chat_id → что делать со следующим сообщением. Не register_next_step_handler:
+# telebot проверяет шаги, удаляя из пачки getUpdates прямо на ходу, и сообщение,
+# идущее сразу за «шаговым», проскакивало мимо (код показа уходил в GPT).
+# Обычный хэндлер, первый в списке, смотрит каждое сообщение.
+_next_step: dict[int, Callable[[telebot.types.Message], None]] = {}
+
+@bot.message_handler(func=lambda m: m.chat.id in _next_step, content_types=["text"])
+def on_next_step(message: telebot.types.Message):
+    # апдейты обрабатываются в пуле потоков: шаг мог забрать соседнее сообщение
+    step = _next_step.pop(message.chat.id, None)
+    if step is None:
+        return on_text(message)
+    step(message)
+
 @bot.message_handler(commands=["start"])
 def on_start(message: telebot.types.Message):
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row(types.KeyboardButton("🔢 Билеты по коду спектакля"))
-    kb.row(types.KeyboardButton("📆 Узнать даты показа и коды"))
-    kb.row(types.KeyboardButton("🔍 Проверить билеты \"Чайки\""))
-    kb.row(types.KeyboardButton("🗄️ Прочее"))
-    bot.send_message(message.chat.id, f"Привет, {message.from_user.first_name}!\nОриентируйся на меню ниже:", reply_markup=kb)
+    bot.send_message(
+        message.chat.id,
+        f"Привет, {message.from_user.first_name}!\nОриентируйся на меню ниже:",
+        reply_markup=main_menu_kb(),
+    )
 
-@bot.message_handler(func=lambda m: m.text and m.text.startswith("Сними: "))
+@bot.message_handler(commands=["trend"])
+@metrics.track()
+def on_trend(message: telebot.types.Message):
+    bot.send_message(message.chat.id, trend_reply((message.text or "").partition(" ")[2]))
+
+@bot.inline_handler(func=lambda query: True)
+@metrics.track()
+def on_inline(query: telebot.types.InlineQuery):
+    results = inline_results(query.query)
+    # пустой ответ не кэшируем: индекс, скорее всего, ещё наполняется
+    bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME if results else 1)
+
+@bot.message_handler(commands=["stats"])
+def on_stats(message: telebot.types.Message):
+    lines = []
+    for name, st in dispatcher.stats().items():
+        lines.append(
+            f"{name}: очередь {st['queued']}/{st['queue_limit']}, в работе {st['active']}/{st['workers']}, "
+            f"ожидание ср. {st['wait_avg']:.2f} с, p95 {st['wait_p95']:.2f} с, макс {st['wait_max']:.2f} с, "
+            f"отказов {st['rejected']}"
+        )
+    for cache in (show_cache, menu_cache):
+        st = cache.stats()
+        lines.append(f"кэш {cache.name}: {st['size']} записей, попаданий {st['hit']}+{st['stale']}, промахов {st['miss']}")
+    st = chat_memory.stats()
+    lines.append(f"память чата: {st['users']} собеседников, {st['tokens']} токенов, выгружено {st['evicted']}")
+    st = media_cache.stats()
+    lines.append(f"медиа: {st['size']} готовых файлов, повторов {st['hit']}, новых {st['miss']}")
+    st = video_jobs.stats()
+    lines.append(f"видео: в очереди {st['queued']}, рендерится {st['running']}, загружается {st['delivering']}")
+    st = outbox.stats()
+    lines.append(f"списки: сообщений {st['sent']}, повторов {st['retried']}, ожидание лимитов {st['waited']:.0f} с")
+    st = sales_history.stats()
+    lines.append(f"история продаж: {st['shows']} показов, {st['snapshots']} записей журнала, "
+                 f"{st['bytes'] // 1024} КБ")
+    st = show_index.stats()
+    lines.append(f"inline-поиск: {st['shows']} показов за {st['months']} мес., {st['keys']} ключей")
+    for up in (openai_up, replicate_up):
+        st = up.stats()
+        lines.append(f"{up.name}: {st['state']}, вызовов {st['calls']}, сбоев {st['failures']}, "
+                     f"повторов {st['retries']}, подстраховок {st['hedge_won']}/{st['hedged']}, "
+                     f"отказов {st['rejected']}")
+    st = scraper.stats()
+    lines.append(f"админка: входов {st['logins']}" + (
+        f", неудач подряд {st['failures']}, повтор через {st['retry_in']:.0f} с" if st["failures"] else ""))
+    if "workers" in st:
+        lines.append(f"парсинг: воркеров {st['workers']}/{SCRAPE_WORKERS}, в работе {st['inflight']}, "
+                     f"перезапусков {sum(st['restarts'].values())}")
+    ready = {"ready": "✓", "failed": "✗", "running": "…", "pending": "…"}
+    lines.append("прогрев: " + ", ".join(
+        f"{name} {ready[st['state']]}" + (f" {st['seconds']:.1f} с" if st["state"] == "ready" else "")
+        for name, st in warmup.status().items()
+    ))
+    bot.send_message(message.chat.id, "\n".join(lines))
+
+@bot.message_handler(func=lambda m: m.text and media_command(m.text, "Сними") is not None)
+@metrics.track()
 def on_t2v(message: telebot.types.Message):
-    prompt = message.text[len("Сними: "):].strip() or "A sports car driving on a beach at sunset"
-    bot.send_chat_action(message.chat.id, "upload_video")
-    try:
-        result = t2v_generate(prompt, aspect_ratio="16:9", resolution="480p", num_frames=81, fps=16)
-        if isinstance(result, str):
-            bot.send_video(message.chat.id, result, caption=f"“{prompt}”")
-        else:
-            result.name = "video.mp4"
-            bot.send_video(message.chat.id, result, caption=f"“{prompt}”")
-    except Exception as e:
-        bot.send_message(message.chat.id, f"Не получилось: {e}")
+    # Рендер идёт в очереди video_jobs, хэндлер только ставит задачу
+    prompt, fresh = media_command(message.text, "Сними")
+    enqueue_video(message.chat.id, message.from_user.id, prompt or "A sports car driving on a beach at sunset",
+                  fresh=fresh, aspect_ratio="16:9", resolution="480p", num_frames=81, fps=16)
 
-@bot.message_handler(func=lambda m: m.text and m.text.startswith("Нарисуй:"))
+@bot.message_handler(func=lambda m: m.text and media_command(m.text, "Нарисуй") is not None)
+@metrics.track()
 def on_image(message: telebot.types.Message):
-    prompt = message.text[len("Нарисуй:"):].strip()
+    prompt, fresh = media_command(message.text, "Нарисуй")
+    # Повтор промпта отдаём из кэша сразу, не занимая очередь генерации
+    if not fresh and send_cached(bot.send_photo, message.chat.id, image_key(prompt)):
+        return
+    run_in_lane("media", message.chat.id, _draw, message.chat.id, prompt)
+
+def _draw(chat_id: int, prompt: str):
     url = generate_image_from_prompt(prompt)
     if not url:
-        bot.send_message(message.chat.id, "Картинку сгенерировать не вышло.")
+        bot.send_message(chat_id, "Картинку сгенерировать не вышло.")
         return
-    bot.send_message(message.chat.id, "Вот картинка по твоему запросу:")
-    bot.send_photo(message.chat.id, url)
+    bot.send_message(chat_id, "Вот картинка по твоему запросу:")
+    sent = bot.send_photo(chat_id, url)
+    file_id = sent_file_id(sent)
+    if file_id:
+        media_cache.put(image_key(prompt), "photo", file_id, prompt)
 
 @bot.message_handler(content_types=["voice"])
+@in_lane("chat")
 def on_voice(message: telebot.types.Message):
     file_info = bot.get_file(message.voice.file_id)
     data = bot.download_file(file_info.file_path)
-    tmp_path = "voice_message.ogg"
-    with open(tmp_path, "wb") as f:
-        f.write(data)
-    try:
-        text = voice_to_text(tmp_path)
-        reply = gpt_reply(message.from_user.id, text)
-        voice = text_to_voice(reply)
-        bot.send_voice(message.chat.id, voice)
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+    uid, chat_id = message.from_user.id, message.chat.id
+    question = ""
+
+    def chat_stream(text: str):
+        nonlocal question
+        question = text
+        return gpt_stream(uid, text)
+
+    # сбой STT/чата/TTS — те же «лежит»/«не успел», что и в текстовом чате
+    reply = run_voice_pipeline(
+        data,
+        stt=voice_to_text,
+        chat_stream=chat_stream,
+        tts=text_to_voice,
+        send=lambda voice: bot.send_voice(chat_id, voice),
+        executor=tts_executor,
+        fallback=CHAT_FAILED_TEXT,
+        failed=lambda e, step: chat_failed(e, f"OpenAI {step} (voice)"),
+        send_text=lambda text: bot.send_message(chat_id, text),
+    )
+    if reply.strip():
+        remember_turn(uid, question, reply)
 
 @bot.message_handler(content_types=["text"])
 def on_text(message: telebot.types.Message):
@@ -440,93 +1107,128 @@ def on_text(message: telebot.types.Message):
 
     t = message.text.strip()
 
-    if t == "🔢 Билеты по коду спектакля":
+    if t == BTN_BY_CODE:
+        # шаг — до подсказки: быстрый ответ не должен проскочить мимо него
+        _next_step[message.chat.id] = _ask_code
         bot.send_message(message.chat.id, "Введи код:")
-        bot.register_next_step_handler(message, _ask_code)
         return
 
-    if t == "📆 Узнать даты показа и коды":
-        kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        kb.row(types.KeyboardButton("🕰️ Спектакли в текущем месяце"))
-        kb.row(types.KeyboardButton("🗂️ Спектакли в другом месяце"))
-        kb.row(types.KeyboardButton("⬅️ Назад в главное меню"))
-        bot.send_message(message.chat.id, "Выберите пункт:", reply_markup=kb)
+    if t == BTN_DATES:
+        bot.send_message(message.chat.id, "Выберите пункт:", reply_markup=dates_menu_kb())
+        return
+
+    if t == BTN_THIS_MONTH:
+        run_in_lane("tickets", message.chat.id, _send_month_list, message.chat.id, upcoming_months(1)[0])
         return
 
-    if t == "🕰️ Спектакли в текущем месяце":
-        month = f"{THIS_MONTH:02d}.{THIS_YEAR}"
-        _send_month_list(message.chat.id, month)
+    if t == BTN_OTHER_MONTH:
+        _next_step[message.chat.id] = _ask_month
+        bot.send_message(message.chat.id, ASK_MONTH_TEXT)
         return
 
-    if t == "🗂️ Спектакли в другом месяце":
-        bot.send_message(message.chat.id, "Введи месяц и год в формате \"мм.гггг\". Например, 09.2025")
-        bot.register_next_step_handler(message, _ask_month)
+    if t == BTN_REPORT:
+        _next_step[message.chat.id] = _ask_report_month
+        bot.send_message(message.chat.id, ASK_MONTH_TEXT)
         return
 
-    if t == "🔍 Проверить билеты \"Чайки\"":
-        if not seagull_dates:
-            bot.send_message(
-                message.chat.id,
-                "У бота пока нет дат\\! Нажми на кнопку \n`📥 Найти и добавить даты \"Чайки\"`\nв дополнительном меню\\.",
-                parse_mode="MarkdownV2",
-            )
+    if t == BTN_SEAGULL:
+        shows = upcoming_seagull()
+        if not shows:
+            bot.send_message(message.chat.id, NO_SEAGULL_DATES_TEXT, parse_mode="MarkdownV2")
         else:
-            keyboard = types.InlineKeyboardMarkup()
-            for date in seagull_dates:
-                keyboard.add(types.InlineKeyboardButton(text=date, callback_data=date))
-            bot.send_message(message.chat.id, "Выбери дату:", reply_markup=keyboard)
+            bot.send_message(message.chat.id, "Выбери дату:", reply_markup=seagull_dates_kb(shows))
         return
 
-    if t == "🗄️ Прочее":
-        kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        kb.row(types.KeyboardButton("📥 Найти и добавить даты \"Чайки\""))
-        kb.row(types.KeyboardButton("🔄 Перезагрузить бота"))
-        kb.row(types.KeyboardButton("📓 Информация"))
-        kb.row(types.KeyboardButton("⬅️ Назад в главное меню"))
-        bot.send_message(message.chat.id, "Выберите пункт:", reply_markup=kb)
+    if t == BTN_MISC:
+        bot.send_message(message.chat.id, "Выберите пункт:", reply_markup=misc_menu_kb())
         return
 
-    if t == "⬅️ Назад в главное меню":
+    if t == BTN_BACK:
         return on_start(message)
 
-    if t == "📥 Найти и добавить даты \"Чайки\"":
-        _quick_add_seagull(message.chat.id)
+    if t == BTN_ADD_SEAGULL:
+        run_in_lane("tickets", message.chat.id, _quick_add_seagull, message.chat.id)
         return
 
-    if t == "🔄 Перезагрузить бота":
-        bot.send_message(message.chat.id, "Бот перезагружается, подожди пару секунд и пользуйся снова")
-        os.kill(os.getpid(), signal.SIGTERM)
+    if t == BTN_RELOAD:
+        bot.send_message(message.chat.id, RELOAD_TEXT)
+        run_in_lane("tickets", message.chat.id, _reload_scraping, message.chat.id)
         return
 
-    if t == "📓 Информация":
-        info = (
-            "Краткая инструкция.\n\n"
-            "🔍 Проверить билеты \"Чайки\" — быстрая проверка продаж.\n"
-            "Если бот не знает даты показа, нажми: 📥 Найти и добавить даты \"Чайки\".\n\n"
-            "Можно смотреть продажи любого спектакля по коду.\n"
-            "Коды/даты ищутся через: 📆 Узнать даты показа и коды.\n"
-            "Код копируется нажатием. Потом — в главное меню → 🔢 Билеты по коду спектакля.\n\n"
-            "Обработка ошибок минимальная, вводите аккуратно.\n"
-            "Онлайн-табличка \"График\" — кнопка слева от ввода текста (редактировать может любой).\n"
-            "P.S. Прямая ссылка: https://disk.yandex.ru/i/RunXym0TQutCqA"
-        )
-        bot.send_message(message.chat.id, info)
+    if t == BTN_INFO:
+        bot.send_message(message.chat.id, INFO_TEXT)
         return
 
     # Иначе — простой диалог с GPT
-    reply = gpt_reply(message.from_user.id, t)
-    bot.send_message(message.chat.id, reply)
+    run_in_lane("chat", message.chat.id, _chat_reply, message.chat.id, message.from_user.id, t)
+
+def _reload_scraping(chat_id: int):
+    bot.send_message(chat_id, reload_scraping())
+
+def _chat_reply(chat_id: int, uid: int, text: str):
+    if not CHAT_STREAM:
+        bot.send_message(chat_id, gpt_reply(uid, text))
+        return
+
+    pager = StreamPager(STREAM_EDIT_INTERVAL)
+    msg_ids: dict[int, int] = {}
+    failed = CHAT_FAILED_TEXT
+    try:
+        for delta in gpt_stream(uid, text):
+            _apply_stream_ops(chat_id, pager, pager.feed(delta), msg_ids)
+    except Exception as e:
+        failed = chat_failed(e, "OpenAI chat stream")
+
+    if not pager.text.strip():
+        bot.send_message(chat_id, failed)
+        return
+    # Финальная правка (без курсора) должна дойти, даже если упёрлись в лимит
+    for _ in range(3):
+        if _apply_stream_ops(chat_id, pager, pager.finish(), msg_ids, wait=True):
+            break
+    remember_turn(uid, text, pager.text)
+
+def _apply_stream_ops(chat_id: int, pager: StreamPager, ops, msg_ids: dict[int, int], wait: bool = False) -> bool:
+    """
+    Выполнить send/edit от StreamPager. False — что-то не прошло и будет повторено.
+    wait=True — при 429 дождаться retry_after (для финальной правки).
+    """
+    ok = True
+    for op, page, text in ops:
+        try:
+            if op == "send":
+                msg_ids[page] = bot.send_message(chat_id, text).message_id
+            else:
+                bot.edit_message_text(text, chat_id, msg_ids[page])
+        except telebot.apihelper.ApiTelegramException as e:
+            if "message is not modified" in str(e.description):
+                continue
+            retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 0)
+            log.warning("Правка потокового ответа не прошла: %s", e.description)
+            pager.failed(op, page, retry_after)
+            if wait and retry_after:
+                time.sleep(retry_after)
+            ok = False
+    return ok
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(VIDEO_CANCEL_PREFIX))
+def on_video_cancel(call: telebot.types.CallbackQuery):
+    job_id = int(call.data[len(VIDEO_CANCEL_PREFIX):])
+    ok = video_jobs.cancel(job_id, call.from_user.id)
+    bot.answer_callback_query(call.id, "Отменено." if ok else "Отменить уже нельзя.")
 
 @bot.callback_query_handler(func=lambda call: True)
 def on_choice(call: telebot.types.CallbackQuery):
     # Клик по дате из списка "Чайки"
-    for date, code in zip(seagull_dates, seagull_codes):
-        if call.data == date:
-            bot.answer_callback_query(call.id)
-            txt = fetch_show_by_code(code)
-            bot.send_message(call.message.chat.id, txt)
-            return
+    code = seagull_code_for(call.data)
+    if code:
+        bot.answer_callback_query(call.id)
+        run_in_lane("tickets", call.message.chat.id, _send_show, call.message.chat.id, code)
+
+def _send_show(chat_id: int, code: str):
+    bot.send_message(chat_id, fetch_show_by_code(code))
 
+@in_lane("tickets")
 def _ask_code(message: telebot.types.Message):
     code = (message.text or "").strip()
     if not code.isdigit():
@@ -536,6 +1238,7 @@ def _ask_code(message: telebot.types.Message):
     txt = fetch_show_by_code(code)
     bot.send_message(message.chat.id, txt)
 
+@in_lane("tickets")
 def _ask_month(message: telebot.types.Message):
     month = (message.text or "").strip()
     if not re.fullmatch(r"\d{2}\.\d{4}", month):
@@ -543,60 +1246,106 @@ def _ask_month(message: telebot.types.Message):
         return
     _send_month_list(message.chat.id, month)
 
+@in_lane("tickets")
+def _ask_report_month(message: telebot.types.Message):
+    month = (message.text or "").strip()
+    if not re.fullmatch(r"\d{2}\.\d{4}", month):
+        bot.send_message(message.chat.id, "Формат: мм.гггг (например, 09.2025)")
+        return
+    _send_month_report(message.chat.id, month)
+
+def _send_month_report(chat_id: int, month: str):
+    try:
+        items = list(get_month(month))
+    except PoolTimeout:
+        bot.send_message(chat_id, BUSY_TEXT)
+        return
+    except AfishaAuthError:
+        bot.send_message(chat_id, LOGIN_FAILED_TEXT)
+        return
+    except ScrapeFailed as e:
+        log.warning("Парсинг: %s", e)
+        bot.send_message(chat_id, SCRAPE_FAILED_TEXT)
+        return
+    if not items:
+        bot.send_message(chat_id, "Спектаклей не найдено.")
+        return
+    bot.send_message(chat_id, f"Собираю продажи {len(items)} показов за {month}…")
+
+    # Строки печатаются по мере готовности правками одного сообщения
+    pager = StreamPager(STREAM_EDIT_INTERVAL, cursor="\n…")
+    msg_ids: dict[int, int] = {}
+    infos: dict[str, ShowInfo] = {}
+    failed = 0
+    for item, info, err in fetch_all(items, get_show, report_executor):
+        if err is not None:
+            log.warning("Сводка %s: показ %s: %s", month, item.code, err)
+            failed += 1
+        else:
+            infos[item.code] = info
+        _apply_stream_ops(chat_id, pager, pager.feed(report_row(item, info) + "\n"), msg_ids)
+
+    pager.feed("\n" + totals_text(list(infos.values()), failed))
+    for _ in range(3):
+        if _apply_stream_ops(chat_id, pager, pager.finish(), msg_ids, wait=True):
+            break
+    doc = BytesIO(to_csv(items, infos))
+    doc.name = f"sales_{month}.csv"
+    bot.send_document(chat_id, doc, caption=f"Продажи за {month}")
+
 def _send_month_list(chat_id: int, month: str):
     bot.send_message(chat_id, "Ищу все спектакли выбранного месяца…")
-    items, codes = fetch_month_menu(month, only_seagull=False)
-    if not items:
+    try:
+        shows = get_month(month)
+    except PoolTimeout:
+        bot.send_message(chat_id, BUSY_TEXT)
+        return
+    except AfishaAuthError:
+        bot.send_message(chat_id, LOGIN_FAILED_TEXT)
+        return
+    except ScrapeFailed as e:
+        log.warning("Парсинг: %s", e)
+        bot.send_message(chat_id, SCRAPE_FAILED_TEXT)
+        return
+    if not shows:
         bot.send_message(chat_id, "Спектаклей не найдено.")
         return
 
-    # Порциями, экранируя для MarkdownV2
-    chunk = 20
-    for i in range(0, len(items), chunk):
-        block = ""
-        for text, code in zip(items[i:i+chunk], codes[i:i+chunk]):
-            # Пример исходной строки: " 12.09.2025 «ЧАЙКА». ... "
-            date = text[4:15]
-            title = text[16:]
-            line = f"{date}\n\"{title}\"\nКод: `{code}`\n\n"
-            block += md_escape(line)
-        bot.send_message(chat_id, block, parse_mode="MarkdownV2")
+    outbox.send(chat_id, month_list_blocks(shows),
+                lambda block: bot.send_message(chat_id, block, parse_mode="MarkdownV2"))
 
 def _quick_add_seagull(chat_id: int):
-    global seagull_dates, seagull_codes
     bot.send_message(chat_id, "Ищу все даты «Чайки» и добавляю в быстрый доступ…")
+    try:
+        shows = find_seagull_shows()
+    except PoolTimeout:
+        bot.send_message(chat_id, BUSY_TEXT)
+        return
+    except AfishaAuthError:
+        bot.send_message(chat_id, LOGIN_FAILED_TEXT)
+        return
+    except ScrapeFailed as e:
+        log.warning("Парсинг: %s", e)
+        bot.send_message(chat_id, SCRAPE_FAILED_TEXT)
+        return
 
-    m = THIS_MONTH
-    y = THIS_YEAR
-
-    def mm_yyyy(mm: int, yy: int) -> str:
-        return f"{mm:02d}.{yy}"
-
-    months = [mm_yyyy(m, y)]
-    if m == 12:
-        months.append(mm_yyyy(1, y + 1))
-    else:
-        months.append(mm_yyyy(m + 1, y))
-
-    found_dates, found_codes = [], []
-    for mon in months:
-        items, codes = fetch_month_menu(mon, only_seagull=True)
-        for t, c in zip(items, codes):
-            found_dates.append(t[4:15])
-            found_codes.append(c)
-
-    if not found_dates:
+    if not shows:
         bot.send_message(chat_id, "Дат на ближайшие пару месяцев не обнаружено…")
         return
 
-    seagull_dates += found_dates
-    seagull_codes += found_codes
-    bot.send_message(chat_id, "Даты добавлены. Можно смотреть продажи!")
+    added = remember_seagull(shows)
+    bot.send_message(chat_id, f"Даты добавлены (новых: {added}). Можно смотреть продажи!")
 
 # ──────────────────────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
     # Не пропускать апдейты (важно для supervisor-рестартов)
     telebot.TeleBot._TeleBot__skip_updates = lambda self: None  # type: ignore
+    if PREFETCH_ENABLED:
+        prefetcher.start()
+    video_jobs.start()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT, METRICS_HOST)
+    warmup.start()
     log.info("NeuroSeagull started.")
     bot.polling(none_stop=True, timeout=60, long_polling_timeout=50)
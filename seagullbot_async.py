@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный режим Нейрочайки: AsyncTeleBot + AsyncOpenAI.
+
+Те же хэндлеры, что в seagullbot.py, но ожидание Telegram и OpenAI не
+держит поток: сотни одновременных чатов обслуживает один процесс.
+Блокирующий парсинг админки уходит в ограниченный пул потоков,
+генерация видео — в общую очередь video_jobs.
+
+Запуск:
+    python seagullbot_async.py
+
+По умолчанию — long polling. Если задан WEBHOOK_URL, поднимается
+aiohttp-сервер на WEBHOOK_LISTEN и бот регистрирует вебхук
+WEBHOOK_URL + /telegram.
+"""
+
+import os
+import re
+import time
+import asyncio
+import contextvars
+import logging
+import functools
+from io import BytesIO
+from typing import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import ClientConnectorError, web
+from telebot import asyncio_helper, types
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.async_telebot import AsyncTeleBot
+
+import seagullbot as core
+from metrics import metrics
+from warmup import Lazy
+from session_pool import PoolTimeout
+from afisha_http import AfishaAuthError
+from afisha_scraper import ScrapeFailed
+from tg_stream import StreamPager
+from tg_outbox import Outbox
+from voice_pipeline import SentenceChunker
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Конфигурация
+# ──────────────────────────────────────────────────────────────────────────────
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0:8080")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_PATH = "/telegram"
+
+# Потоки под блокирующие вызовы (парсинг админки)
+ASYNC_BLOCKING_WORKERS = int(os.getenv("ASYNC_BLOCKING_WORKERS", "8"))
+
+log = logging.getLogger("neuroseagull.async")
+
+if core.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = core.TELEGRAM_API_URL + "/bot{0}/{1}"
+    asyncio_helper.FILE_URL = core.TELEGRAM_API_URL + "/file/bot{0}/{1}"
+
+_process_request = asyncio_helper._process_request
+
+async def _timed_tg_request(token, url, *args, **kwargs):
+    # как в seagullbot._timed_tg_request: время вызовов Bot API, кроме long polling
+    core.startup_mark(url)
+    if url == "getUpdates":
+        return await _process_request(token, url, *args, **kwargs)
+    with metrics.stage(f"tg.{url}"):
+        return await _process_request(token, url, *args, **kwargs)
+
+asyncio_helper._process_request = _timed_tg_request
+
+abot = AsyncTeleBot(core.TELEGRAM_TOKEN)
+# Свои вёдра лимитов: обрыв до соединения у aiohttp — другое исключение
+outbox = Outbox(rate=core.TG_SEND_RATE, chat_rate=core.TG_CHAT_SEND_RATE,
+                chat_burst=core.TG_CHAT_BURST, not_sent=(ClientConnectorError,))
+def _async_openai_client():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=core.OPENAI_API_KEY, max_retries=0)
+
+aclient = Lazy(_async_openai_client)
+core.warmup.add("openai_async", aclient)
+blocking = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="async-blocking")
+
+# chat_id → что делать со следующим сообщением (аналог register_next_step_handler)
+_next_step: dict[int, Callable[[types.Message], Awaitable[None]]] = {}
+
+
+async def in_thread(fn, *args):
+    # с контекстом: этапы из потока попадают в трассу текущего запроса
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(blocking, functools.partial(ctx.run, fn, *args))
+
+# ──────────────────────────────────────────────────────────────────────────────
+# OpenAI
+# ──────────────────────────────────────────────────────────────────────────────
+
+async def gpt_reply(uid: int, text: str) -> str:
+    try:
+        messages = await in_thread(core.chat_messages, uid, text)
+        with metrics.stage("openai.chat"):
+            resp = await core.openai_up.acall("chat", lambda timeout: aclient().chat.completions.create(
+                model=core.CHAT_MODEL,
+                messages=messages,
+                max_tokens=1200,
+                temperature=0.9,
+                timeout=timeout,
+            ))
+        msg = resp.choices[0].message.content
+        await in_thread(core.remember_turn, uid, text, msg)
+        return msg
+    except Exception as e:
+        return core.chat_failed(e)
+
+
+async def gpt_stream(uid: int, text: str):
+    t0 = time.perf_counter()
+    messages = await in_thread(core.chat_messages, uid, text)
+    stream = await core.openai_up.acall("stream", lambda timeout: aclient().chat.completions.create(
+        model=core.CHAT_MODEL,
+        messages=messages,
+        max_tokens=1200,
+        temperature=0.9,
+        stream=True,
+        timeout=timeout,
+    ), discard=lambda s: s.close())
+    first = True
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first:
+                metrics.observe_stage("openai.chat.first_token", time.perf_counter() - t0)
+                first = False
+            yield chunk.choices[0].delta.content
+    metrics.observe_stage("openai.chat.stream", time.perf_counter() - t0)
+
+
+async def voice_to_text(data: bytes) -> str:
+    with metrics.stage("openai.stt"):
+        tr = await core.openai_up.acall("stt", lambda timeout: aclient().audio.transcriptions.create(
+            model=core.WHISPER_MODEL, file=("voice.ogg", data), timeout=timeout,
+        ))
+    return tr.text
+
+
+async def text_to_voice(text: str) -> BytesIO:
+    with metrics.stage("openai.tts"):
+        rsp = await core.openai_up.acall("tts", lambda timeout: aclient().audio.speech.create(
+            input=text,
+            model=core.VOICE_TTS_MODEL,
+            voice="nova",
+            response_format="opus",
+            timeout=timeout,
+        ))
+    return BytesIO(rsp.content)
+
+
+async def generate_image_from_prompt(prompt: str) -> str:
+    import openai
+    try:
+        with metrics.stage("openai.image"):
+            rsp = await core.openai_up.acall("image", lambda timeout: aclient().images.generate(
+                model=core.IMG_MODEL, prompt=prompt, n=1, size="1024x1024", timeout=timeout,
+            ))
+        return rsp.data[0].url
+    except openai.BadRequestError:
+        return ""
+    except Exception as e:
+        core.upstream_failed("Image generation", e)
+        return ""
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Хэндлеры Telegram
+# ──────────────────────────────────────────────────────────────────────────────
+
+@abot.message_handler(func=lambda m: m.chat.id in _next_step, content_types=["text"])
+@metrics.track()
+async def on_next_step(message: types.Message):
+    # апдейты обрабатываются параллельно: шаг мог забрать соседнее сообщение
+    step = _next_step.pop(message.chat.id, None)
+    if step is None:
+        await on_text(message)
+        return
+    await step(message)
+
+
+@abot.message_handler(commands=["start"])
+@metrics.track()
+async def on_start(message: types.Message):
+    await abot.send_message(
+        message.chat.id,
+        f"Привет, {message.from_user.first_name}!\nОриентируйся на меню ниже:",
+        reply_markup=core.main_menu_kb(),
+    )
+
+
+@abot.message_handler(commands=["trend"])
+@metrics.track()
+async def on_trend(message: types.Message):
+    reply = await in_thread(core.trend_reply, (message.text or "").partition(" ")[2])
+    await abot.send_message(message.chat.id, reply)
+
+
+@abot.inline_handler(func=lambda query: True)
+@metrics.track()
+async def on_inline(query: types.InlineQuery):
+    # только память и фоновые загрузки — можно прямо в цикле событий
+    results = core.inline_results(query.query)
+    await abot.answer_inline_query(query.id, results, cache_time=core.INLINE_CACHE_TIME if results else 1)
+
+
+@abot.message_handler(func=lambda m: m.text and core.media_command(m.text, "Сними") is not None)
+@metrics.track()
+async def on_t2v(message: types.Message):
+    # Очередь видео общая с обычным режимом: она сама правит статус и шлёт ролик
+    prompt, fresh = core.media_command(message.text, "Сними")
+    await in_thread(functools.partial(
+        core.enqueue_video, message.chat.id, message.from_user.id,
+        prompt or "A sports car driving on a beach at sunset", fresh=fresh,
+        aspect_ratio="16:9", resolution="480p", num_frames=81, fps=16,
+    ))
+
+
+@abot.message_handler(func=lambda m: m.text and core.media_command(m.text, "Нарисуй") is not None)
+@metrics.track()
+async def on_image(message: types.Message):
+    prompt, fresh = core.media_command(message.text, "Нарисуй")
+    key = core.image_key(prompt)
+    # кэш — SQLite под локом: из цикла событий только через поток
+    file_id = None if fresh else await in_thread(core.media_cache.get, key)
+    if file_id:
+        try:
+            await abot.send_photo(message.chat.id, file_id)
+            return
+        except ApiTelegramException as e:
+            log.warning("file_id из кэша не принят (%s), генерируем заново", e.description)
+            await in_thread(core.media_cache.forget, key)
+    url = await generate_image_from_prompt(prompt)
+    if not url:
+        await abot.send_message(message.chat.id, "Картинку сгенерировать не вышло.")
+        return
+    await abot.send_message(message.chat.id, "Вот картинка по твоему запросу:")
+    sent = await abot.send_photo(message.chat.id, url)
+    file_id = core.sent_file_id(sent)
+    if file_id:
+        await in_thread(core.media_cache.put, key, "photo", file_id, prompt)
+
+
+@abot.message_handler(content_types=["voice"])
+@metrics.track()
+async def on_voice(message: types.Message):
+    file_info = await abot.get_file(message.voice.file_id)
+    data = await abot.download_file(file_info.file_path)
+    uid, chat_id = message.from_user.id, message.chat.id
+
+    # Та же схема, что voice_pipeline.run_voice_pipeline: фразы озвучиваются
+    # задачами, пока модель пишет дальше, а уходят строго по порядку; сбой
+    # STT/чата — объяснение голосом, фраза без синтеза — текстом
+    chunker = SentenceChunker()
+    pending: list[tuple[str, asyncio.Task]] = []
+
+    def speak(chunk: str) -> None:
+        pending.append((chunk, asyncio.create_task(text_to_voice(chunk))))
+
+    async def send_ready(block: bool) -> None:
+        while pending and (block or pending[0][1].done()):
+            chunk, task = pending.pop(0)
+            try:
+                voice = await task
+            except Exception as e:
+                core.chat_failed(e, "OpenAI TTS (voice)")
+                await abot.send_message(chat_id, chunk)
+                continue
+            await abot.send_voice(chat_id, voice)
+
+    text, reply, tail = "", "", []
+    try:
+        text = await voice_to_text(data)
+    except Exception as e:
+        tail = [core.chat_failed(e, "OpenAI STT (voice)")]
+    else:
+        try:
+            async for delta in gpt_stream(uid, text):
+                reply += delta
+                for chunk in chunker.feed(delta):
+                    speak(chunk)
+                await send_ready(block=False)
+        except Exception as e:
+            tail = [core.chat_failed(e, "OpenAI chat (voice)")]
+        if reply.strip():
+            tail = chunker.flush()
+        elif not tail:
+            tail = [core.CHAT_FAILED_TEXT]
+
+    for chunk in tail:
+        speak(chunk)
+    try:
+        await send_ready(block=True)
+    finally:
+        for _, task in pending:
+            task.cancel()
+    if reply.strip():
+        await in_thread(core.remember_turn, uid, text, reply)
+
+
+@abot.message_handler(content_types=["text"])
+@metrics.track()
+async def on_text(message: types.Message):
+    if message.chat.type != "private":
+        return
+
+    chat_id = message.chat.id
+    t = message.text.strip()
+
+    if t == core.BTN_BY_CODE:
+        # шаг — до подсказки: быстрый ответ не должен проскочить мимо него
+        _next_step[chat_id] = _ask_code
+        await abot.send_message(chat_id, "Введи код:")
+    elif t == core.BTN_DATES:
+        await abot.send_message(chat_id, "Выберите пункт:", reply_markup=core.dates_menu_kb())
+    elif t == core.BTN_THIS_MONTH:
+        await _send_month_list(chat_id, core.upcoming_months(1)[0])
+    elif t == core.BTN_OTHER_MONTH:
+        _next_step[chat_id] = _ask_month
+        await abot.send_message(chat_id, core.ASK_MONTH_TEXT)
+    elif t == core.BTN_REPORT:
+        _next_step[chat_id] = _ask_report_month
+        await abot.send_message(chat_id, core.ASK_MONTH_TEXT)
+    elif t == core.BTN_SEAGULL:
+        shows = await in_thread(core.upcoming_seagull)
+        if not shows:
+            await abot.send_message(chat_id, core.NO_SEAGULL_DATES_TEXT, parse_mode="MarkdownV2")
+        else:
+            await abot.send_message(chat_id, "Выбери дату:", reply_markup=core.seagull_dates_kb(shows))
+    elif t == core.BTN_MISC:
+        await abot.send_message(chat_id, "Выберите пункт:", reply_markup=core.misc_menu_kb())
+    elif t == core.BTN_BACK:
+        await on_start(message)
+    elif t == core.BTN_ADD_SEAGULL:
+        await _quick_add_seagull(chat_id)
+    elif t == core.BTN_RELOAD:
+        await abot.send_message(chat_id, core.RELOAD_TEXT)
+        await abot.send_message(chat_id, await in_thread(core.reload_scraping))
+    elif t == core.BTN_INFO:
+        await abot.send_message(chat_id, core.INFO_TEXT)
+    else:
+        # Иначе — простой диалог с GPT
+        await _chat_reply(chat_id, message.from_user.id, t)
+
+
+async def _chat_reply(chat_id: int, uid: int, text: str):
+    if not core.CHAT_STREAM:
+        await abot.send_message(chat_id, await gpt_reply(uid, text))
+        return
+
+    pager = StreamPager(core.STREAM_EDIT_INTERVAL)
+    msg_ids: dict[int, int] = {}
+    failed = core.CHAT_FAILED_TEXT
+    try:
+        async for delta in gpt_stream(uid, text):
+            await _apply_stream_ops(chat_id, pager, pager.feed(delta), msg_ids)
+    except Exception as e:
+        failed = core.chat_failed(e, "OpenAI chat stream")
+
+    if not pager.text.strip():
+        await abot.send_message(chat_id, failed)
+        return
+    for _ in range(3):
+        if await _apply_stream_ops(chat_id, pager, pager.finish(), msg_ids, wait=True):
+            break
+    await in_thread(core.remember_turn, uid, text, pager.text)
+
+
+async def _apply_stream_ops(chat_id: int, pager: StreamPager, ops, msg_ids: dict[int, int], wait: bool = False) -> bool:
+    ok = True
+    for op, page, text in ops:
+        try:
+            if op == "send":
+                msg_ids[page] = (await abot.send_message(chat_id, text)).message_id
+            else:
+                await abot.edit_message_text(text, chat_id, msg_ids[page])
+        except ApiTelegramException as e:
+            if "message is not modified" in str(e.description):
+                continue
+            retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 0)
+            log.warning("Правка потокового ответа не прошла: %s", e.description)
+            pager.failed(op, page, retry_after)
+            if wait and retry_after:
+                await asyncio.sleep(retry_after)
+            ok = False
+    return ok
+
+
+@abot.callback_query_handler(func=lambda call: call.data.startswith(core.VIDEO_CANCEL_PREFIX))
+@metrics.track()
+async def on_video_cancel(call: types.CallbackQuery):
+    job_id = int(call.data[len(core.VIDEO_CANCEL_PREFIX):])
+    ok = await in_thread(core.video_jobs.cancel, job_id, call.from_user.id)
+    await abot.answer_callback_query(call.id, "Отменено." if ok else "Отменить уже нельзя.")
+
+
+@abot.callback_query_handler(func=lambda call: True)
+@metrics.track()
+async def on_choice(call: types.CallbackQuery):
+    # Клик по дате из списка "Чайки"
+    code = await in_thread(core.seagull_code_for, call.data)
+    if code:
+        await abot.answer_callback_query(call.id)
+        await abot.send_message(call.message.chat.id, await in_thread(core.fetch_show_by_code, code))
+
+
+async def _ask_code(message: types.Message):
+    code = (message.text or "").strip()
+    if not code.isdigit():
+        await abot.send_message(message.chat.id, "Нужен числовой код показа.")
+        return
+    await abot.send_message(message.chat.id, "Смотрю билеты…")
+    await abot.send_message(message.chat.id, await in_thread(core.fetch_show_by_code, code))
+
+
+async def _ask_month(message: types.Message):
+    month = (message.text or "").strip()
+    if not re.fullmatch(r"\d{2}\.\d{4}", month):
+        await abot.send_message(message.chat.id, "Формат: мм.гггг (например, 09.2025)")
+        return
+    await _send_month_list(message.chat.id, month)
+
+
+async def _ask_report_month(message: types.Message):
+    month = (message.text or "").strip()
+    if not re.fullmatch(r"\d{2}\.\d{4}", month):
+        await abot.send_message(message.chat.id, "Формат: мм.гггг (например, 09.2025)")
+        return
+    await _send_month_report(message.chat.id, month)
+
+
+async def _send_month_report(chat_id: int, month: str):
+    try:
+        items = list(await in_thread(core.get_month, month))
+    except PoolTimeout:
+        await abot.send_message(chat_id, core.BUSY_TEXT)
+        return
+    except AfishaAuthError:
+        await abot.send_message(chat_id, core.LOGIN_FAILED_TEXT)
+        return
+    except ScrapeFailed as e:
+        log.warning("Парсинг: %s", e)
+        await abot.send_message(chat_id, core.SCRAPE_FAILED_TEXT)
+        return
+    if not items:
+        await abot.send_message(chat_id, "Спектаклей не найдено.")
+        return
+    await abot.send_message(chat_id, f"Собираю продажи {len(items)} показов за {month}…")
+
+    # Тот же общий пул, что и в обычном режиме: fan-out ограничен им
+    loop = asyncio.get_running_loop()
+
+    async def one(item):
+        try:
+            return item, await loop.run_in_executor(core.report_executor, core.get_show, item.code), None
+        except Exception as e:
+            return item, None, e
+
+    pager = StreamPager(core.STREAM_EDIT_INTERVAL, cursor="\n…")
+    msg_ids: dict[int, int] = {}
+    infos = {}
+    failed = 0
+    for next_done in asyncio.as_completed([one(it) for it in items]):
+        item, info, err = await next_done
+        if err is not None:
+            log.warning("Сводка %s: показ %s: %s", month, item.code, err)
+            failed += 1
+        else:
+            infos[item.code] = info
+        await _apply_stream_ops(chat_id, pager, pager.feed(core.report_row(item, info) + "\n"), msg_ids)
+
+    pager.feed("\n" + core.totals_text(list(infos.values()), failed))
+    for _ in range(3):
+        if await _apply_stream_ops(chat_id, pager, pager.finish(), msg_ids, wait=True):
+            break
+    doc = BytesIO(core.to_csv(items, infos))
+    doc.name = f"sales_{month}.csv"
+    await abot.send_document(chat_id, doc, caption=f"Продажи за {month}")
+
+
+async def _send_month_list(chat_id: int, month: str):
+    await abot.send_message(chat_id, "Ищу все спектакли выбранного месяца…")
+    try:
+        shows = await in_thread(core.get_month, month)
+    except PoolTimeout:
+        await abot.send_message(chat_id, core.BUSY_TEXT)
+        return
+    except AfishaAuthError:
+        await abot.send_message(chat_id, core.LOGIN_FAILED_TEXT)
+        return
+    except ScrapeFailed as e:
+        log.warning("Парсинг: %s", e)
+        await abot.send_message(chat_id, core.SCRAPE_FAILED_TEXT)
+        return
+    if not shows:
+        await abot.send_message(chat_id, "Спектаклей не найдено.")
+        return
+    await outbox.asend(chat_id, core.month_list_blocks(shows),
+                       lambda block: abot.send_message(chat_id, block, parse_mode="MarkdownV2"))
+
+
+async def _quick_add_seagull(chat_id: int):
+    await abot.send_message(chat_id, "Ищу все даты «Чайки» и добавляю в быстрый доступ…")
+    try:
+        shows = await in_thread(core.find_seagull_shows)
+    except PoolTimeout:
+        await abot.send_message(chat_id, core.BUSY_TEXT)
+        return
+    except AfishaAuthError:
+        await abot.send_message(chat_id, core.LOGIN_FAILED_TEXT)
+        return
+    except ScrapeFailed as e:
+        log.warning("Парсинг: %s", e)
+        await abot.send_message(chat_id, core.SCRAPE_FAILED_TEXT)
+        return
+    if not shows:
+        await abot.send_message(chat_id, "Дат на ближайшие пару месяцев не обнаружено…")
+        return
+    added = await in_thread(core.remember_seagull, shows)
+    await abot.send_message(chat_id, f"Даты добавлены (новых: {added}). Можно смотреть продажи!")
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Вебхук
+# ──────────────────────────────────────────────────────────────────────────────
+
+_update_tasks: set[asyncio.Task] = set()
+
+
+async def _on_webhook(request: web.Request) -> web.Response:
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    update = types.Update.de_json(await request.json())
+    # Telegram ждёт быстрый 200, обработка идёт отдельной задачей
+    task = asyncio.create_task(abot.process_new_updates([update]))
+    _update_tasks.add(task)
+    task.add_done_callback(_update_tasks.discard)
+    return web.Response()
+
+
+def make_webhook_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, _on_webhook)
+    return app
+
+
+async def serve_webhook() -> None:
+    host, _, port = WEBHOOK_LISTEN.rpartition(":")
+    runner = web.AppRunner(make_webhook_app())
+    await runner.setup()
+    await web.TCPSite(runner, host or "0.0.0.0", int(port)).start()
+    await abot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+    log.info("Вебхук слушает %s, адрес %s", WEBHOOK_LISTEN, WEBHOOK_URL + WEBHOOK_PATH)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main() -> None:
+    if core.PREFETCH_ENABLED:
+        core.prefetcher.start()
+    core.video_jobs.start()
+    if core.METRICS_PORT:
+        metrics.serve(core.METRICS_PORT, core.METRICS_HOST)
+    core.warmup.start()
+    log.info("NeuroSeagull (async) started.")
+    if WEBHOOK_URL:
+        await serve_webhook()
+    else:
+        await abot.remove_webhook()
+        await abot.infinity_polling(timeout=60, request_timeout=90)
+
+# ──────────────────────────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    asyncio.run(main())
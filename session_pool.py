@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+Пул тяжёлых сессий (залогиненных headless-Chrome и т. п.).
+
+Вместо одного глобального драйвера держим до N сессий: хэндлер берёт
+свободную (checkout), работает с ней и возвращает. Если свободных нет —
+ждёт в очереди не дольше таймаута. Перед выдачей сессия проверяется,
+упавшая выбрасывается и при следующем запросе заменяется новой.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Generic, Optional, TypeVar
+
+log = logging.getLogger("neuroseagull.pool")
+
+T = TypeVar("T")
+
+
+class PoolTimeout(Exception):
+    """Свободная сессия не появилась за отведённое время."""
+
+
+class PoolClosed(Exception):
+    """Пул уже закрыт (процесс завершается)."""
+
+
+class SessionPool(Generic[T]):
+    """
+    Потокобезопасный пул сессий с ленивым созданием.
+
+    factory  — создаёт новую готовую сессию (например, залогиненный драйвер);
+    check    — быстрая проверка «живости» перед выдачей;
+    dispose  — корректно закрывает сессию.
+    """
+
+    def __init__(
+            self,
+            factory: Callable[[], T],
+            size: int = 2,
+            timeout: float = 60.0,
+            check: Optional[Callable[[T], bool]] = None,
+            dispose: Optional[Callable[[T], None]] = None,
+            name: str = "session",
+    ):
+        if size < 1:
+            raise ValueError("size должен быть >= 1")
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+        self._factory = factory
+        self._check = check
+        self._dispose = dispose
+        self._idle: deque[T] = deque()
+        self._busy = 0          # выданные сессии + создаваемые прямо сейчас
+        self._waiting = 0
+        self._replaced = 0
+        self._closed = False
+        self._epoch = 0         # растёт при recycle(): сессии старше — на выброс
+        self._born: dict[int, int] = {}
+        self._cond = threading.Condition()
+
+    # ── выдача / возврат ─────────────────────────────────────────────────────
+
+    def acquire(self, timeout: Optional[float] = None) -> T:
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            with self._cond:
+                sess = self._reserve(deadline)
+            if sess is None:
+                try:
+                    return self._create()
+                except Exception:
+                    self._free_slot()
+                    raise
+            if self._alive(sess):
+                return sess
+            log.warning("%s: сессия не отвечает, заменяю новой", self.name)
+            self._close(sess)
+            self._free_slot(replaced=True)
+
+    def _reserve(self, deadline: float) -> Optional[T]:
+        """Под локом: свободная сессия либо None (= слот под новую)."""
+        self._waiting += 1
+        try:
+            while True:
+                if self._closed:
+                    raise PoolClosed(self.name)
+                if self._idle:
+                    self._busy += 1
+                    # LIFO: «горячий» драйвер с прогретым кэшем браузера
+                    return self._idle.pop()
+                if self._busy + len(self._idle) < self.size:
+                    self._busy += 1
+                    return None
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise PoolTimeout(f"{self.name}: все {self.size} сессий заняты")
+                self._cond.wait(left)
+        finally:
+            self._waiting -= 1
+
+    def release(self, sess: T, broken: bool = False) -> None:
+        with self._cond:
+            self._busy -= 1
+            keep = not (broken or self._closed or self._born.get(id(sess)) != self._epoch)
+            if keep:
+                self._idle.append(sess)
+            else:
+                self._replaced += int(broken)
+            self._cond.notify()
+        if not keep:
+            self._close(sess)
+
+    @contextmanager
+    def session(self, timeout: Optional[float] = None):
+        """
+        with pool.session() as drv: ...
+
+        Если внутри блока вылетело исключение, сессия перед возвратом
+        проверяется: мёртвая закрывается, на её место потом встанет новая.
+        """
+        sess = self.acquire(timeout)
+        broken = False
+        try:
+            yield sess
+        except BaseException:
+            broken = not self._alive(sess)
+            raise
+        finally:
+            self.release(sess, broken=broken)
+
+    # ── обслуживание ─────────────────────────────────────────────────────────
+
+    def warm(self, count: int = 1) -> None:
+        """Заранее создать до count сессий (не больше размера пула)."""
+        for _ in range(count):
+            with self._cond:
+                if self._closed or self._busy + len(self._idle) >= self.size:
+                    return
+                self._busy += 1
+            try:
+                sess = self._create()
+            except Exception:
+                self._free_slot()
+                raise
+            self.release(sess)
+
+    def recycle(self) -> int:
+        """
+        Заменить все сессии свежими, не останавливая пул: свободные
+        закрываются сразу, занятые — когда их вернут. Новые создаются по
+        первому запросу. Возвращает, сколько закрыто сразу.
+        """
+        with self._cond:
+            self._epoch += 1
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for sess in idle:
+            self._close(sess)
+        log.info("%s: сессии пересоздаются (закрыто свободных: %d)", self.name, len(idle))
+        return len(idle)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for sess in idle:
+            self._close(sess)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "busy": self._busy,
+                "waiting": self._waiting,
+                "replaced": self._replaced,
+            }
+
+    # ── внутреннее ───────────────────────────────────────────────────────────
+
+    def _create(self) -> T:
+        epoch = self._epoch
+        sess = self._factory()
+        with self._cond:
+            self._born[id(sess)] = epoch
+        return sess
+
+    def _free_slot(self, replaced: bool = False) -> None:
+        with self._cond:
+            self._busy -= 1
+            self._replaced += int(replaced)
+            self._cond.notify()
+
+    def _alive(self, sess: T) -> bool:
+        if self._check is None:
+            return True
+        try:
+            return bool(self._check(sess))
+        except Exception:
+            return False
+
+    def _close(self, sess: T) -> None:
+        with self._cond:
+            self._born.pop(id(sess), None)
+        if self._dispose is None:
+            return
+        try:
+            self._dispose(sess)
+        except Exception:
+            log.debug("%s: ошибка при закрытии сессии", self.name, exc_info=True)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+Поиск показов по названию, дате и коду — в памяти, для inline-режима.
+
+    index = ShowIndex()
+    index.update("09.2025", items, start=lambda it: ...)   # после разбора меню месяца
+    index.search("чай 12.09")                              # → [Entry, ...] за микросекунды
+
+Ключи показа — слова строки меню и названия, дата («12.09», «19:00»,
+«сентября») и код. Запрос режется на слова; показ подходит, если каждое
+слово — начало одного из его ключей или, от трёх букв, кусок ключа
+(«ишн» найдёт «Вишнёвый»). Начала ищутся bisect'ом по отсортированному
+списку ключей, куски — по триграммам ключей. Регистр не важен, ё = е.
+
+update() заменяет показы одного месяца: ключи новых показов добавляются,
+пропавших — удаляются, остальной индекс не трогается. Лок держится только
+на правку словарей, а скрейпы идут снаружи, поэтому поиск никогда не ждёт
+админку.
+
+Скорость поиска на сезоне показов:
+
+    python show_index.py
+"""
+
+import re
+import sys
+import time
+import bisect
+import random
+import threading
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from afisha_parser import MenuItem
+
+_WORD_RE = re.compile(r"\w+(?:[.:]\w+)*")
+_DAY_MONTH_RE = re.compile(r"\b\d{1,2}\.(\d{2})\b")
+_MONTHS = (
+    "январь января", "февраль февраля", "март марта", "апрель апреля", "май мая", "июнь июня",
+    "июль июля", "август августа", "сентябрь сентября", "октябрь октября", "ноябрь ноября", "декабрь декабря",
+)
+_EMPTY: frozenset = frozenset()
+
+
+def words(text: str) -> list[str]:
+    """Слова для индекса и запроса: «Вишнёвый сад, 12.09 19:00» → вишневый, сад, 12.09, 19:00."""
+    return _WORD_RE.findall(text.casefold().replace("ё", "е"))
+
+
+def _grams(key: str) -> set[str]:
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+@dataclass(frozen=True, slots=True)
+class Entry:
+    code: str
+    date: str           # как в меню: "12.09 19:00"
+    title: str
+    month: str          # "мм.гггг" — из какого меню пришёл
+    starts_at: Optional[float]
+
+
+def _keys(item: MenuItem) -> set[str]:
+    keys = set(words(item.text)) | set(words(item.title)) | set(words(item.date)) | {item.code}
+    m = _DAY_MONTH_RE.search(item.date)
+    if m and 1 <= int(m.group(1)) <= 12:
+        keys.update(_MONTHS[int(m.group(1)) - 1].split())
+    return keys
+
+
+class ShowIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[Entry, frozenset[str]]] = {}     # код → (показ, его ключи)
+        self._by_month: dict[str, set[str]] = {}
+        self._postings: dict[str, set[str]] = {}                        # ключ → коды
+        self._sorted: list[str] = []                                    # ключи по алфавиту
+        self._grams: dict[str, set[str]] = {}                           # триграмма → ключи
+        self.updates = 0
+
+    # ── обновление ───────────────────────────────────────────────────────────
+
+    def update(
+            self,
+            month: str,
+            items: Iterable[MenuItem],
+            start: Optional[Callable[[MenuItem], Optional[float]]] = None,
+    ) -> tuple[int, int]:
+        """Заменить показы месяца; вернуть (добавлено или изменено, удалено)."""
+        fresh = {
+            it.code: (Entry(it.code, it.date, it.title, month, start(it) if start else None), frozenset(_keys(it)))
+            for it in items
+        }
+        added = removed = 0
+        with self._lock:
+            for code in self._by_month.get(month, set()) - fresh.keys():
+                self._remove(code)
+                removed += 1
+            for code, (entry, keys) in fresh.items():
+                if self._entries.get(code) == (entry, keys):
+                    continue
+                if code in self._entries:
+                    self._remove(code)
+                self._add(entry, keys)
+                added += 1
+            self.updates += 1
+        return added, removed
+
+    def _add(self, entry: Entry, keys: frozenset[str]) -> None:
+        self._entries[entry.code] = (entry, keys)
+        self._by_month.setdefault(entry.month, set()).add(entry.code)
+        for key in keys:
+            codes = self._postings.get(key)
+            if codes is None:
+                codes = self._postings[key] = set()
+                bisect.insort(self._sorted, key)
+                for g in _grams(key):
+                    self._grams.setdefault(g, set()).add(key)
+            codes.add(entry.code)
+
+    def _remove(self, code: str) -> None:
+        entry, keys = self._entries.pop(code)
+        self._by_month.get(entry.month, set()).discard(code)
+        for key in keys:
+            codes = self._postings[key]
+            codes.discard(code)
+            if codes:
+                continue
+            del self._postings[key]
+            del self._sorted[bisect.bisect_left(self._sorted, key)]
+            for g in _grams(key):
+                self._grams[g].discard(key)
+                if not self._grams[g]:
+                    del self._grams[g]
+
+    # ── поиск ────────────────────────────────────────────────────────────────
+
+    def search(self, query: str, limit: int = 20, since: Optional[float] = None) -> list[Entry]:
+        """
+        Показы, где каждое слово запроса — начало или кусок ключа; пустой
+        запрос — все. since — не раньше (показы без даты не отсекаются).
+        Ближайшие — первыми.
+        """
+        qwords = words(query)
+        with self._lock:
+            if not qwords:
+                found = [e for e, _ in self._entries.values()]
+            else:
+                codes: Optional[set[str]] = None
+                for w in qwords:
+                    match = self._codes_for(w)
+                    codes = match if codes is None else codes & match
+                    if not codes:
+                        return []
+                found = [self._entries[c][0] for c in codes]
+        if since is not None:
+            found = [e for e in found if e.starts_at is None or e.starts_at >= since]
+        found.sort(key=lambda e: (e.starts_at is None, e.starts_at or 0, e.code))
+        return found[:limit]
+
+    def _codes_for(self, word: str) -> set[str]:
+        """Под локом: коды показов, у которых есть ключ, начинающийся с word или содержащий его."""
+        codes: set[str] = set()
+        i = bisect.bisect_left(self._sorted, word)
+        while i < len(self._sorted) and self._sorted[i].startswith(word):
+            codes |= self._postings[self._sorted[i]]
+            i += 1
+        if len(word) >= 3:
+            postings = sorted((self._grams.get(g, _EMPTY) for g in _grams(word)), key=len)
+            keys = set(postings[0]).intersection(*postings[1:]) if postings else set()
+            for key in keys:
+                if word in key and not key.startswith(word):
+                    codes |= self._postings[key]
+        return codes
+
+    def get(self, code: str) -> Optional[Entry]:
+        with self._lock:
+            hit = self._entries.get(code)
+        return hit[0] if hit else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "shows": len(self._entries),
+                "months": sum(bool(c) for c in self._by_month.values()),
+                "keys": len(self._sorted),
+                "updates": self.updates,
+            }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Скорость: сезон репертуара, запросы как из inline-режима
+# ──────────────────────────────────────────────────────────────────────────────
+
+_REPERTOIRE = (
+    "ЧАЙКА", "ДЯДЯ ВАНЯ", "ВИШНЁВЫЙ САД", "ТРИ СЕСТРЫ", "ИВАНОВ", "ГРОЗА", "БЕСПРИДАННИЦА",
+    "РЕВИЗОР", "ГОРЕ ОТ УМА", "НА ДНЕ", "МАСКАРАД", "ЖЕНИТЬБА", "ЛЕС", "ВАССА ЖЕЛЕЗНОВА",
+)
+
+
+def _season(months: int = 10, per_month: int = 45) -> dict[str, list[MenuItem]]:
+    rnd = random.Random(1)
+    out = {}
+    for m in range(months):
+        month, year = (8 + m) % 12 + 1, 2025 + (8 + m) // 12
+        items = []
+        for i in range(per_month):
+            title = rnd.choice(_REPERTOIRE)
+            date = f"{i % 28 + 1:02d}.{month:02d} {rnd.choice(('12:00', '19:00'))}"
+            code = f"{month:02d}{year % 100:02d}{i:03d}"
+            items.append(MenuItem(code=code, text=f"Пт, {date} {title}", date=date, title=title))
+        out[f"{month:02d}.{year}"] = items
+    return out
+
+
+def _bench(queries: int = 20_000) -> int:
+    index = ShowIndex()
+    season = _season()
+    t0 = time.perf_counter()
+    for month, items in season.items():
+        index.update(month, items, start=lambda it: None)
+    build = time.perf_counter() - t0
+
+    everything = [it for items in season.values() for it in items]
+    rnd = random.Random(2)
+    samples = []
+    for _ in range(queries):
+        it = rnd.choice(everything)
+        kind = rnd.random()
+        if kind < 0.4:
+            q = it.title.split()[0][:rnd.randint(1, 6)]           # набирают название
+        elif kind < 0.6:
+            q = it.title[1:4]                                     # кусок из середины
+        elif kind < 0.8:
+            q = f"{it.title[:3]} {it.date[:5]}"                   # название и дата
+        else:
+            q = it.code[:rnd.randint(2, len(it.code))]            # код
+        samples.append(q)
+
+    lat = []
+    for q in samples:
+        q0 = time.perf_counter()
+        index.search(q)
+        lat.append(time.perf_counter() - q0)
+    lat.sort()
+    p50, p99, worst = (lat[int(len(lat) * q)] * 1e6 for q in (0.5, 0.99, 0.999))
+
+    # месяц перечитали: два показа сняли, один добавили
+    month, items = next(iter(season.items()))
+    changed = items[2:] + [MenuItem("9999001", "Пт, 30.09 19:00 ЧАЙКА", "30.09 19:00", "ЧАЙКА")]
+    t0 = time.perf_counter()
+    added, removed = index.update(month, changed)
+    upd = time.perf_counter() - t0
+
+    checks = {
+        "«ишн» находит «Вишнёвый сад»": any(e.title == "ВИШНЁВЫЙ САД" for e in index.search("ишн")),
+        "«вишневый» без ё": any(e.title == "ВИШНЁВЫЙ САД" for e in index.search("вишневый")),
+        "«чай 30.09» — ровно новый показ": [e.code for e in index.search("чай 30.09")] == ["9999001"],
+        "«сентября» — только сентябрь": all(e.month == "09.2025" for e in index.search("сентября", limit=100)),
+        "снятый показ не находится": not index.search(items[0].code),
+    }
+    st = index.stats()
+    print(f"индекс: {st['shows']} показов, {st['keys']} ключей, построен за {build * 1000:.1f} мс")
+    print(f"поиск ({queries} запросов): p50 {p50:.1f} мкс, p99 {p99:.1f} мкс, p99.9 {worst:.1f} мкс")
+    print(f"перечитали месяц: +{added} −{removed} за {upd * 1e6:.0f} мкс")
+    for what, ok in checks.items():
+        print(f"{'ok ' if ok else 'ОШИБКА'}  {what}")
+    # у inline-запроса несколько секунд на всё; на поиск должно уходить меньше миллисекунды
+    return 0 if p99 < 1000 and all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(_bench())
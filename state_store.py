@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""
+Состояние бота, которое должно переживать перезапуск: сохранённые даты
+«Чайки» и небольшая память диалогов.
+
+Источник правды во время работы — словари в памяти: чтение никогда не
+ходит в базу повторно, а запись только помечает ключ «грязным». Фоновый
+поток раз в flush_interval секунд сбрасывает все накопленные изменения
+одной транзакцией, поэтому хэндлер не ждёт fsync. close() дописывает
+остаток при выходе.
+
+Показы загружаются из базы при первом обращении (одним SELECT), записи
+памяти диалога — по одной, когда пользователь впервые пишет после
+перезапуска.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+log = logging.getLogger("neuroseagull.state")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shows (
+    code      TEXT PRIMARY KEY,
+    date      TEXT NOT NULL,
+    title     TEXT NOT NULL,
+    starts_at REAL,
+    added     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shows_date ON shows(date);
+CREATE TABLE IF NOT EXISTS kv (
+    ns      TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    value   TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+"""
+
+_MISSING = object()
+
+
+@dataclass(frozen=True, slots=True)
+class SavedShow:
+    code: str
+    date: str                   # как в меню: "12.09 19:00"
+    title: str
+    starts_at: Optional[float]  # epoch; None — не удалось разобрать дату
+    added: float = 0.0
+
+
+class StateStore:
+    def __init__(
+            self,
+            path: str,
+            flush_interval: float = 1.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db_lock = threading.Lock()        # соединение: загрузка и сброс
+        self._lock = threading.RLock()          # словари и очередь записи
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+        self._shows: Optional[dict[str, SavedShow]] = None
+        self._by_date: dict[str, str] = {}
+        self._kv: dict[tuple[str, str], Any] = {}
+        self._dirty_shows: set[str] = set()
+        self._dirty_kv: set[tuple[str, str]] = set()
+        self._unload: set[tuple[str, str]] = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ── показы ───────────────────────────────────────────────────────────────
+
+    def _loaded_shows(self) -> dict[str, SavedShow]:
+        with self._lock:
+            if self._shows is None:
+                with self._db_lock:
+                    rows = self._db.execute(
+                        "SELECT code, date, title, starts_at, added FROM shows"
+                    ).fetchall()
+                self._shows = {r[0]: SavedShow(*r) for r in rows}
+                self._by_date = {s.date: s.code for s in self._shows.values()}
+            return self._shows
+
+    def add_shows(self, shows: Iterable[SavedShow]) -> int:
+        """Добавить/обновить показы; вернуть, сколько из них новых."""
+        added = 0
+        with self._lock:
+            known = self._loaded_shows()
+            for show in shows:
+                old = known.get(show.code)
+                if old is None:
+                    added += 1
+                    show = SavedShow(show.code, show.date, show.title, show.starts_at, self._clock())
+                elif (old.date, old.title, old.starts_at) == (show.date, show.title, show.starts_at):
+                    continue
+                else:
+                    show = SavedShow(show.code, show.date, show.title, show.starts_at, old.added)
+                    if self._by_date.get(old.date) == old.code:
+                        del self._by_date[old.date]
+                known[show.code] = show
+                self._by_date[show.date] = show.code
+                self._dirty_shows.add(show.code)
+        self._schedule_flush()
+        return added
+
+    def show(self, code: str) -> Optional[SavedShow]:
+        return self._loaded_shows().get(code)
+
+    def code_for_date(self, date: str) -> Optional[str]:
+        with self._lock:
+            self._loaded_shows()
+            return self._by_date.get(date)
+
+    def upcoming_shows(self, since: float) -> list[SavedShow]:
+        """Показы, начинающиеся не раньше since (и с неразобранной датой), по времени."""
+        with self._lock:
+            shows = [s for s in self._loaded_shows().values() if s.starts_at is None or s.starts_at >= since]
+        return sorted(shows, key=lambda s: (s.starts_at is None, s.starts_at or 0, s.date))
+
+    # ── ключ-значение (память диалогов и т.п.) ───────────────────────────────
+
+    def get(self, ns: str, key: Any, default: Any = None) -> Any:
+        k = (ns, str(key))
+        with self._lock:
+            value = self._kv.get(k, _MISSING)
+            if value is _MISSING:
+                with self._db_lock:
+                    row = self._db.execute("SELECT value FROM kv WHERE ns = ? AND key = ?", k).fetchone()
+                value = json.loads(row[0]) if row else None
+                self._kv[k] = value
+        return default if value is None else value
+
+    def put(self, ns: str, key: Any, value: Any) -> None:
+        """value=None удаляет ключ."""
+        k = (ns, str(key))
+        with self._lock:
+            self._kv[k] = value
+            self._dirty_kv.add(k)
+        self._schedule_flush()
+
+    def drop(self, ns: str, key: Any) -> None:
+        """Выгрузить ключ из памяти; в базе он остаётся (несохранённый — после записи)."""
+        k = (ns, str(key))
+        with self._lock:
+            if k in self._dirty_kv:
+                self._unload.add(k)
+            else:
+                self._kv.pop(k, None)
+
+    # ── запись в базу ────────────────────────────────────────────────────────
+
+    def flush(self) -> None:
+        with self._lock:
+            shows = [self._shows[c] for c in self._dirty_shows] if self._shows else []
+            kv = [(k, self._kv[k]) for k in self._dirty_kv]
+            self._dirty_shows.clear()
+            self._dirty_kv.clear()
+        if not shows and not kv:
+            return
+        now = self._clock()
+        try:
+            with self._db_lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO shows (code, date, title, starts_at, added) VALUES (?, ?, ?, ?, ?)",
+                    [(s.code, s.date, s.title, s.starts_at, s.added) for s in shows],
+                )
+                self._db.executemany(
+                    "DELETE FROM kv WHERE ns = ? AND key = ?", [k for k, v in kv if v is None],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO kv (ns, key, value, updated) VALUES (?, ?, ?, ?)",
+                    [(*k, json.dumps(v, ensure_ascii=False), now) for k, v in kv if v is not None],
+                )
+        except sqlite3.Error:
+            # не потерять изменения: вернуть их в очередь до следующей попытки
+            log.exception("Состояние: не удалось сохранить")
+            with self._lock:
+                self._dirty_shows.update(s.code for s in shows)
+                self._dirty_kv.update(k for k, _ in kv)
+            return
+        with self._lock:
+            for k in self._unload - self._dirty_kv:
+                self._kv.pop(k, None)
+            self._unload &= self._dirty_kv
+
+    def _schedule_flush(self) -> None:
+        # поток записи поднимается при первом изменении
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="state-flush", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            # копим изменения flush_interval секунд и пишем пачкой
+            self._stop.wait(self.flush_interval)
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
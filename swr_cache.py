@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+TTL-кэш со stale-while-revalidate и склейкой одинаковых запросов.
+
+• свежая запись (моложе ttl) отдаётся сразу;
+• устаревшая, но ещё «терпимая» (моложе ttl + stale_ttl) — тоже сразу,
+  а в фоне запускается одно обновление;
+• если записи нет, то из толпы одновременных запросов по одному ключу
+  грузит только первый, остальные ждут его результат;
+• число записей ограничено, лишние вытесняются по LRU.
+
+Ошибки загрузчика не кэшируются — их получают все, кто ждал.
+
+peek()/warm() — для тех, кому ждать нельзя совсем (inline-запросы):
+взять что есть и, если надо, попросить загрузку в фоне.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional
+
+log = logging.getLogger("neuroseagull.cache")
+
+
+class SWRCache:
+    def __init__(
+            self,
+            ttl: float,
+            stale_ttl: float = 0.0,
+            max_entries: int = 256,
+            name: str = "cache",
+            clock: Callable[[], float] = time.monotonic,
+            refresh_workers: int = 2,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._inflight: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(
+            max_workers=refresh_workers, thread_name_prefix=f"{name}-refresh",
+        )
+        self._stats = {"hit": 0, "stale": 0, "miss": 0, "coalesced": 0, "evicted": 0}
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = self._clock() - stored_at
+                if age < self.ttl + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    if age < self.ttl:
+                        self._stats["hit"] += 1
+                    else:
+                        self._stats["stale"] += 1
+                        self._schedule_refresh(key, loader)
+                    return value
+
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+                self._stats["miss"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not owner:
+            return fut.result()
+        return self._load(key, loader, fut)
+
+    def peek(self, key: Hashable) -> Any:
+        """Значение без загрузки и ожидания: свежее или ещё терпимое, иначе None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or self._clock() - entry[1] >= self.ttl + self.stale_ttl:
+                return None
+            return entry[0]
+
+    def warm(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        """Если записи нет или она устарела — загрузить в фоне; сам не ждёт и не бросает."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._clock() - entry[1] < self.ttl:
+                return
+            self._schedule_refresh(key, loader)
+
+    def refresh(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Принудительно перезагрузить ключ (или дождаться уже идущей загрузки)."""
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            return fut.result()
+        return self._load(key, loader, fut)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, size=len(self._data), inflight=len(self._inflight))
+
+    # ── внутреннее ───────────────────────────────────────────────────────────
+
+    def _load(self, key: Hashable, loader: Callable[[], Any], fut: Future) -> Any:
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            self._data[key] = (value, self._clock())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._stats["evicted"] += 1
+            self._inflight.pop(key, None)
+        fut.set_result(value)
+        return value
+
+    def _schedule_refresh(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        """Под локом: одно фоновое обновление на ключ."""
+        if key in self._inflight:
+            return
+        fut = self._inflight[key] = Future()
+        self._refresher.submit(self._refresh_in_background, key, loader, fut)
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Any], fut: Future) -> None:
+        try:
+            self._load(key, loader, fut)
+        except Exception as e:
+            log.warning("%s: фоновое обновление %r не удалось: %s", self.name, key, e)
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+"""
+Исходящие сообщения Telegram: упаковка и отправка в пределах лимитов.
+
+Длинный список (все спектакли месяца) раньше уходил порциями по 20 строк
+подряд, без пауз: на больших месяцах Telegram отвечал 429, и хвост списка
+терялся. Теперь:
+
+    blocks = pack(md_escape(line) for line in lines)     # ≤ 4096 символов, строки целые
+    outbox.send(chat_id, blocks, lambda text: bot.send_message(chat_id, text, parse_mode="MarkdownV2"))
+
+pack() набивает сообщение готовыми (уже экранированными) кусками до
+лимита и никогда не режет кусок пополам — MarkdownV2 не ломается.
+
+Outbox держит два ведра токенов: общее на бота (Telegram пускает около
+30 сообщений в секунду) и своё у каждого чата (около одного в секунду,
+с небольшим запасом на всплеск). Перед каждой отправкой ждём токен из
+обоих, поэтому несколько пользователей, разом запросивших списки, идут
+ровным потоком, а не пачкой под 429.
+
+Повтор — только там, где Telegram точно не принял сообщение: 429 (ждём
+retry_after), 5xx, соединение не установилось. 429 с retry_after дольше
+интервала чата — это уже общий лимит бота: тогда ждут все чаты, а не
+только тот, что нарвался. После обрыва на чтении
+ответа сообщение могло уже дойти — повтор дал бы дубль в чате, поэтому
+такую ошибку отдаём наверх.
+
+Асинхронный бот — тот же Outbox через asend() (ожидание — asyncio.sleep).
+
+Проверки упаковки и реакции на 429 (assert), затем сравнение со старой
+отправкой против подделки Telegram с лимитами; код выхода 1 — что-то не так:
+
+    python tg_outbox.py
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
+
+import requests
+
+from tg_stream import TG_TEXT_LIMIT, split_pages
+
+log = logging.getLogger("neuroseagull.outbox")
+
+T = TypeVar("T")
+
+
+def pack(parts: Iterable[str], limit: int = TG_TEXT_LIMIT) -> list[str]:
+    """Склеить куски в сообщения не длиннее limit, не разрывая ни один кусок."""
+    blocks: list[str] = []
+    buf: list[str] = []
+    size = 0
+    for part in parts:
+        if size + len(part) > limit and buf:
+            blocks.append("".join(buf))
+            buf, size = [], 0
+        if len(part) > limit:
+            # одна строка длиннее сообщения — такого в списках не бывает, но не теряем её
+            blocks.extend(split_pages(part, limit))
+            continue
+        buf.append(part)
+        size += len(part)
+    if buf:
+        blocks.append("".join(buf))
+    return blocks
+
+
+class TokenBucket:
+    """
+    rate токенов в секунду, не больше burst про запас. reserve() забирает
+    токен сразу (в долг, если их нет) и говорит, сколько подождать, — так
+    очередь ждущих обслуживается по порядку, без гонки за освободившийся токен.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Telegram попросил подождать: ближайшие seconds токенов нет ни у кого."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    @property
+    def full(self) -> bool:
+        with self._lock:
+            self._refill()
+            return self._tokens >= self.burst
+
+
+class Outbox:
+    def __init__(
+            self,
+            rate: float = 25.0,
+            chat_rate: float = 1.0,
+            chat_burst: float = 3.0,
+            max_attempts: int = 5,
+            not_sent: tuple[type[BaseException], ...] = (requests.ConnectionError,),
+            max_chats: int = 10_000,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_attempts = max_attempts
+        self._not_sent = not_sent
+        self._max_chats = max_chats
+        self._clock = clock
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._global = TokenBucket(rate, max(1.0, rate / 5), clock)
+        self._chats: OrderedDict[int, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.waited = 0.0
+
+    # ── отправка ─────────────────────────────────────────────────────────────
+
+    def send(self, chat_id: int, texts: Iterable[str], send: Callable[[str], T]) -> list[T]:
+        """Отправить тексты по порядку; бросает исключение, если кусок так и не ушёл."""
+        return [self.deliver(chat_id, lambda t=text: send(t)) for text in texts]
+
+    def deliver(self, chat_id: int, call: Callable[[], T]) -> T:
+        """Один вызов Bot API в пределах лимитов, с повтором при отказе."""
+        attempt = 0
+        while True:
+            attempt += 1
+            for wait in self._waits(chat_id):
+                if wait:
+                    time.sleep(wait)
+            try:
+                result = call()
+            except Exception as e:
+                delay = self._retry_delay(chat_id, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.sent += 1
+            return result
+
+    async def asend(self, chat_id: int, texts: Iterable[str], send: Callable[[str], Awaitable[T]]) -> list[T]:
+        return [await self.adeliver(chat_id, lambda t=text: send(t)) for text in texts]
+
+    async def adeliver(self, chat_id: int, call: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            attempt += 1
+            for wait in self._waits(chat_id):
+                if wait:
+                    await asyncio.sleep(wait)
+            try:
+                result = await call()
+            except Exception as e:
+                delay = self._retry_delay(chat_id, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.sent += 1
+            return result
+
+    # ── внутреннее ───────────────────────────────────────────────────────────
+
+    def _chat(self, chat_id: int) -> TokenBucket:
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst, self._clock)
+                # полные вёдра давно молчавших чатов ничего не помнят — их можно забыть
+                while len(self._chats) > self._max_chats:
+                    old_id, old = next(iter(self._chats.items()))
+                    if not old.full:
+                        break
+                    del self._chats[old_id]
+            else:
+                self._chats.move_to_end(chat_id)
+            return bucket
+
+    def _waits(self, chat_id: int):
+        """Сначала токен чата, потом общий: пока ждём свой чат, общий не занимаем."""
+        for bucket in (self._chat(chat_id), self._global):
+            wait = bucket.reserve()
+            self.waited += wait
+            yield wait
+
+    def _retry_delay(self, chat_id: int, e: Exception, attempt: int) -> Optional[float]:
+        """Через сколько повторить; None — не повторять (ошибка уходит наверх)."""
+        code = getattr(e, "error_code", None)
+        if code == 429:
+            params = (getattr(e, "result_json", None) or {}).get("parameters", {})
+            delay = float(params.get("retry_after") or 1)
+            self._chat(chat_id).pause(delay)
+            # дольше интервала чата — упёрлись в общий лимит: иначе остальные чаты шлют прямо в него
+            if delay > 1.0 / self._chat_rate:
+                self._global.pause(delay)
+        elif isinstance(code, int) and code >= 500:
+            delay = min(0.5 * 2 ** (attempt - 1), 10.0)
+        elif isinstance(e, self._not_sent) or isinstance(e.__cause__, self._not_sent):
+            delay = min(0.5 * 2 ** (attempt - 1), 10.0)
+        else:
+            delay = None
+        if delay is None or attempt >= self.max_attempts:
+            self.failed += 1
+            return None
+        self.retried += 1
+        log.warning("Telegram не принял сообщение в чат %s (%s), повтор через %.1f с", chat_id, e, delay)
+        return delay
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "waited": round(self.waited, 1),
+            "chats": len(self._chats),
+        }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Сравнение: старая отправка порциями по 20 против Outbox
+# ──────────────────────────────────────────────────────────────────────────────
+
+class _FakeTelegramError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too Many Requests: retry after {retry_after:g}")
+        self.error_code = 429
+        self.result_json = {"ok": False, "error_code": 429, "parameters": {"retry_after": retry_after}}
+
+
+class _FakeTelegram:
+    """Лимиты примерно как у Bot API: ~1 сообщение/с в чат (запас 3) и 30/с на бота."""
+
+    def __init__(self, latency: float = 0.03):
+        self.latency = latency
+        self._global = TokenBucket(30, 30)
+        self._chats: dict[int, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.delivered: dict[int, list[str]] = {}
+        self.rejected = 0
+
+    def send_message(self, chat_id: int, text: str) -> int:
+        time.sleep(self.latency)
+        with self._lock:
+            chat = self._chats.setdefault(chat_id, TokenBucket(1, 3))
+            if len(text) > TG_TEXT_LIMIT:
+                raise ValueError("message is too long")
+            if chat.reserve() > 0 or self._global.reserve() > 0:
+                self.rejected += 1
+                raise _FakeTelegramError(retry_after=1)
+            self.delivered.setdefault(chat_id, []).append(text)
+            return len(self.delivered[chat_id])
+
+
+def _legacy_blocks(lines: list[str], chunk: int = 20) -> list[str]:
+    return ["".join(lines[i:i + chunk]) for i in range(0, len(lines), chunk)]
+
+
+def _asserts() -> None:
+    """Детерминированная часть: pack() и паузы после 429 на подставных часах."""
+    parts = [f"{i:03d} " + "x" * (i % 50) + "\n" for i in range(500)]
+    blocks = pack(parts, limit=300)
+    assert "".join(blocks) == "".join(parts)
+    assert all(len(b) <= 300 and b.endswith("\n") for b in blocks)
+    # сообщение набито до отказа: первый кусок следующего в него бы не влез
+    assert all(len(b) + len(nxt.split("\n", 1)[0]) + 1 > 300 for b, nxt in zip(blocks, blocks[1:]))
+    assert pack([]) == []
+    assert all(len(b) <= 300 for b in pack(["a\n", "y" * 700, "b\n"], limit=300))
+
+    now = [0.0]
+    box = Outbox(rate=30, chat_rate=1, chat_burst=1, clock=lambda: now[0])
+    # 429 чата (retry_after = интервалу чата): ждёт только он
+    assert box._retry_delay(1, _FakeTelegramError(1), 1) == 1
+    assert list(box._waits(2)) == [0.0, 0.0]
+    assert next(box._waits(1)) >= 1
+    # 429 общего лимита: ждут и чаты, которые сами отказов не получали
+    assert box._retry_delay(1, _FakeTelegramError(5), 1) == 5
+    chat_wait, global_wait = box._waits(3)
+    assert chat_wait == 0 and global_wait >= 5
+    now[0] += 6
+    assert list(box._waits(4)) == [0.0, 0.0]
+    print("ok   pack() и паузы после 429 (assert)")
+
+
+def _demo(users: int = 6, shows: int = 160) -> int:
+    from concurrent.futures import ThreadPoolExecutor
+
+    lines = [f"{d % 28 + 1:02d}\\.10 19:00\n\"ВИШНЁВЫЙ САД\"\nКод: `10{d:04d}`\n\n" for d in range(shows)]
+    expected = "".join(lines)
+    rc = 0
+
+    def run(name: str, one_user: Callable[[_FakeTelegram, int], None]) -> None:
+        nonlocal rc
+        tg = _FakeTelegram()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(users) as pool:
+            list(pool.map(lambda u: _try(one_user, tg, u), range(users)))
+        wall = time.perf_counter() - t0
+        complete = sum("".join(tg.delivered.get(u, [])) == expected for u in range(users))
+        msgs = sum(len(v) for v in tg.delivered.values())
+        print(f"{name:28s} сообщений {msgs:4d}  отказов 429 {tg.rejected:4d}  "
+              f"полных списков {complete}/{users}  {wall:5.2f} с")
+        if name.startswith("outbox") and complete != users:
+            rc = 1
+
+    def legacy(tg: _FakeTelegram, u: int) -> None:
+        for block in _legacy_blocks(lines):
+            tg.send_message(u, block)
+
+    outbox = Outbox()
+
+    def packed(tg: _FakeTelegram, u: int) -> None:
+        outbox.send(u, pack(lines), lambda text: tg.send_message(u, text))
+
+    print(f"{users} пользователей разом запрашивают месяц из {shows} показов:")
+    run("порции по 20 подряд", legacy)
+    run("outbox: pack + вёдра токенов", packed)
+    print(f"outbox: {outbox.stats()}")
+    return rc
+
+
+def _try(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return e
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    _asserts()
+    sys.exit(_demo())
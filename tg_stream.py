@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Показ потокового ответа в Telegram правками сообщения.
+
+StreamPager ничего не отправляет сам: он копит текст и говорит, какие
+сообщения отправить или поправить ("send"/"edit", номер страницы, текст).
+Так одна и та же логика работает и с TeleBot, и с AsyncTeleBot.
+
+• первое сообщение уходит с первым же непустым куском ответа;
+• дальше правки не чаще, чем раз в interval секунд (лимиты Telegram);
+• длинный ответ режется на страницы по 4096 символов — каждая страница
+  своё сообщение;
+• пока ответ пишется, в конце последней страницы стоит курсор.
+"""
+
+import time
+from typing import Callable, Optional
+
+TG_TEXT_LIMIT = 4096
+
+# (операция, номер страницы, текст)
+Op = tuple[str, int, str]
+
+
+def split_pages(text: str, limit: int = TG_TEXT_LIMIT) -> list[str]:
+    """Разрезать текст на куски ≤ limit, по возможности по переводу строки или пробелу."""
+    pages = []
+    rest = text.strip()
+    while len(rest) > limit:
+        cut = rest.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = rest.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        pages.append(rest[:cut].rstrip())
+        rest = rest[cut:].lstrip()
+    if rest:
+        pages.append(rest)
+    return pages
+
+
+class StreamPager:
+    def __init__(
+            self,
+            interval: float = 1.2,
+            limit: int = TG_TEXT_LIMIT,
+            cursor: str = " ▌",
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.text = ""
+        self._interval = interval
+        self._limit = limit
+        self._cursor = cursor
+        self._clock = clock
+        self._shown: list[Optional[str]] = []   # None — страницу ещё надо отправить
+        self._next_at = 0.0
+
+    def feed(self, delta: str) -> list[Op]:
+        self.text += delta
+        if self._clock() < self._next_at:
+            return []
+        return self._render(final=False)
+
+    def finish(self) -> list[Op]:
+        return self._render(final=True)
+
+    def failed(self, op: str, page: int, retry_after: float = 0.0) -> None:
+        """Операция не прошла: повторим при следующем рендере, но не раньше retry_after."""
+        self._shown[page] = None if op == "send" else ""
+        self._next_at = max(self._next_at, self._clock() + retry_after)
+
+    def _render(self, final: bool) -> list[Op]:
+        pages = split_pages(self.text, self._limit - len(self._cursor))
+        ops: list[Op] = []
+        for i, page in enumerate(pages):
+            if not final and i == len(pages) - 1:
+                page += self._cursor
+            if i >= len(self._shown):
+                self._shown.append(None)
+            if self._shown[i] is None:
+                ops.append(("send", i, page))
+            elif self._shown[i] != page:
+                ops.append(("edit", i, page))
+            else:
+                continue
+            self._shown[i] = page
+        if ops:
+            self._next_at = self._clock() + self._interval
+        return ops
@@ -0,0 +1,631 @@
+# -*- coding: utf-8 -*-
+
+"""
+Очередь генерации видео через HTTP API Replicate.
+
+Вместо rep.run(), который держит поток всё время рендера, задача
+заводится в таблице SQLite, а один фоновый поток создаёт предсказания
+и опрашивает их статус. Хэндлер Telegram только ставит задачу в очередь
+и сразу освобождается.
+
+• одновременно рендерится не больше max_running роликов, у одного
+  пользователя — не больше max_per_user; остальные ждут в очереди;
+• о каждой задаче сообщается через notify(job, position): место в
+  очереди, запуск, прогресс из логов модели, итог — бот правит этим
+  одно статусное сообщение;
+• cancel() снимает задачу из очереди или отменяет предсказание;
+• готовый ролик скачивается и отдаётся в deliver(job, video) в
+  отдельном пуле, не в потоке опроса;
+• после перезапуска незавершённые задачи подхватываются из таблицы.
+
+Проверка против встроенного фейкового Replicate (без ключей и сети):
+
+    python video_jobs.py
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import logging
+import threading
+from io import BytesIO
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Union
+
+import requests
+
+from metrics import metrics
+from resilience import CircuitOpen, Upstream
+
+log = logging.getLogger("neuroseagull.video")
+
+QUEUED, RUNNING, DELIVERING, DONE, FAILED, CANCELED = (
+    "queued", "running", "delivering", "done", "failed", "canceled",
+)
+ACTIVE_STATES = (QUEUED, RUNNING, DELIVERING)
+
+# Видео больше этого Telegram от бота не примет — отдаём ссылкой
+TG_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+
+class VideoQueueFull(Exception):
+    """У пользователя уже слишком много задач в очереди."""
+
+
+class ReplicateError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status        # HTTP-статус ответа; None — до ответа не дошло
+
+
+@dataclass
+class Job:
+    id: int
+    user_id: int
+    chat_id: int
+    message_id: Optional[int]
+    prompt: str
+    params: dict = field(default_factory=dict)
+    state: str = QUEUED
+    prediction_id: str = ""
+    progress: Optional[float] = None
+    output: str = ""
+    error: str = ""
+    created: float = 0.0
+    started: float = 0.0
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Replicate HTTP API
+# ──────────────────────────────────────────────────────────────────────────────
+
+class ReplicateApi:
+    """
+    Три вызова, которые нужны очереди: создать, прочитать, отменить.
+    С upstream (операции create/get/cancel) — его таймауты, повторы и
+    предохранитель; create повторяется только на 429, чтобы не завести
+    два предсказания.
+    """
+
+    def __init__(self, token: str, base_url: str = "https://api.replicate.com", timeout: float = 30,
+                 upstream: Optional[Upstream] = None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.upstream = upstream
+        self.http = requests.Session()
+        self.http.headers["Authorization"] = f"Bearer {token}"
+
+    def create(self, model: str, inputs: dict) -> dict:
+        # "владелец/модель" — последняя версия; "владелец/модель:версия" — конкретная
+        name, _, version = model.partition(":")
+        if version:
+            return self._call("create", "POST", "/v1/predictions", {"version": version, "input": inputs})
+        return self._call("create", "POST", f"/v1/models/{name}/predictions", {"input": inputs})
+
+    def get(self, prediction_id: str) -> dict:
+        return self._call("get", "GET", f"/v1/predictions/{prediction_id}")
+
+    def cancel(self, prediction_id: str) -> dict:
+        return self._call("cancel", "POST", f"/v1/predictions/{prediction_id}/cancel")
+
+    def _call(self, op: str, method: str, path: str, body: Optional[dict] = None) -> dict:
+        with metrics.stage(f"replicate.{op}"):
+            if self.upstream is None:
+                return self._request(method, path, body, self.timeout)
+            try:
+                return self.upstream.call(op, lambda timeout: self._request(method, path, body, timeout))
+            except CircuitOpen as e:
+                raise ReplicateError(str(e)) from e
+
+    def _request(self, method: str, path: str, body: Optional[dict], timeout: float) -> dict:
+        try:
+            rsp = self.http.request(method, self.base_url + path, json=body, timeout=timeout)
+        except requests.RequestException as e:
+            raise ReplicateError(f"Replicate недоступен: {e}") from e
+        if rsp.status_code >= 400:
+            detail = rsp.text[:300]
+            try:
+                detail = rsp.json().get("detail", detail)
+            except ValueError:
+                pass
+            raise ReplicateError(f"Replicate {rsp.status_code}: {detail}", rsp.status_code)
+        return rsp.json()
+
+
+# tqdm в логах моделей: " 45%|████▌     | 9/20 [00:12<00:15, ...]"
+_PCT_RE = re.compile(r"(\d{1,3})%\|")
+_STEPS_RE = re.compile(r"\b(\d+)/(\d+) \[")
+
+
+def parse_progress(logs: Optional[str]) -> Optional[float]:
+    """Последний прогресс-бар из логов → 0..1; None, если его нет."""
+    if not logs:
+        return None
+    pct = _PCT_RE.findall(logs)
+    if pct:
+        return min(int(pct[-1]), 100) / 100
+    steps = _STEPS_RE.findall(logs)
+    if steps:
+        done, total = map(int, steps[-1])
+        return min(done / total, 1.0) if total else None
+    return None
+
+
+def output_url(output: Any) -> str:
+    """Вывод модели (ссылка или список ссылок) → первая ссылка."""
+    if isinstance(output, (list, tuple)):
+        output = next((o for o in output if isinstance(o, str) and o.strip()), "")
+    if isinstance(output, str) and output.strip():
+        return output.strip()
+    raise ReplicateError("Replicate: пустой вывод модели")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Таблица задач
+# ──────────────────────────────────────────────────────────────────────────────
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id       INTEGER NOT NULL,
+    chat_id       INTEGER NOT NULL,
+    message_id    INTEGER,
+    prompt        TEXT NOT NULL,
+    params        TEXT NOT NULL DEFAULT '{}',
+    state         TEXT NOT NULL,
+    prediction_id TEXT NOT NULL DEFAULT '',
+    progress      REAL,
+    output        TEXT NOT NULL DEFAULT '',
+    error         TEXT NOT NULL DEFAULT '',
+    created       REAL NOT NULL,
+    started       REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS video_jobs_state ON video_jobs(state, id);
+"""
+
+
+class JobStore:
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+
+    def add(self, user_id: int, chat_id: int, message_id: Optional[int], prompt: str,
+            params: dict, now: float, limit: Optional[int] = None) -> Job:
+        """limit — сколько активных задач у пользователя может быть; проверка и вставка — одной транзакцией."""
+        with self._lock, self._db:
+            if limit is not None:
+                (mine,) = self._db.execute(
+                    f"SELECT COUNT(*) FROM video_jobs WHERE user_id = ?"
+                    f" AND state IN ({','.join('?' * len(ACTIVE_STATES))})",
+                    (user_id, *ACTIVE_STATES),
+                ).fetchone()
+                if mine >= limit:
+                    raise VideoQueueFull(f"уже {mine} задач(и) в очереди")
+            cur = self._db.execute(
+                "INSERT INTO video_jobs (user_id, chat_id, message_id, prompt, params, state, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, message_id, prompt, json.dumps(params), QUEUED, now),
+            )
+        return self.get(cur.lastrowid)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM video_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def active(self) -> list[Job]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM video_jobs WHERE state IN ({','.join('?' * len(ACTIVE_STATES))}) ORDER BY id",
+                ACTIVE_STATES,
+            ).fetchall()
+        return [self._job(r) for r in rows]
+
+    def transition(self, job_id: int, from_states: tuple[str, ...], **values: Any) -> bool:
+        """Обновить задачу, только если она всё ещё в одном из from_states (гонка с отменой)."""
+        sets = ", ".join(f"{k} = ?" for k in values)
+        with self._lock, self._db:
+            cur = self._db.execute(
+                f"UPDATE video_jobs SET {sets} WHERE id = ? AND state IN ({','.join('?' * len(from_states))})",
+                (*values.values(), job_id, *from_states),
+            )
+        return cur.rowcount == 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Job:
+        d = dict(row)
+        d["params"] = json.loads(d["params"] or "{}")
+        return Job(**d)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Очередь
+# ──────────────────────────────────────────────────────────────────────────────
+
+Video = Union[bytes, str]       # скачанный ролик или ссылка, если он слишком большой
+
+
+class VideoJobs:
+    def __init__(
+            self,
+            api: ReplicateApi,
+            store: JobStore,
+            model: str,
+            build_input: Callable[..., dict],
+            notify: Callable[[Job, int], None],
+            deliver: Callable[[Job, Video], None],
+            max_running: int = 2,
+            max_per_user: int = 1,
+            max_queued_per_user: int = 3,
+            poll_interval: float = 2.0,
+            job_timeout: float = 900.0,
+            download_workers: int = 2,
+            clock: Callable[[], float] = time.time,
+    ):
+        self.api = api
+        self.store = store
+        self.model = model
+        self.max_running = max_running
+        self.max_per_user = max_per_user
+        self.max_queued_per_user = max_queued_per_user
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self._build_input = build_input
+        self._notify = notify
+        self._deliver = deliver
+        self._clock = clock
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._downloads = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="video-dl")
+        self._delivering: set[int] = set()
+        self._shown: dict[int, tuple] = {}      # что последний раз сообщили по задаче
+        self._shown_lock = threading.Lock()     # _report зовут цикл, загрузчики и cancel() из хэндлеров
+        self._http = requests.Session()
+
+    # ── для хэндлеров ─────────────────────────────────────────────────────────
+
+    def submit(self, user_id: int, chat_id: int, message_id: Optional[int], prompt: str, **params: Any) -> Job:
+        job = self.store.add(user_id, chat_id, message_id, prompt, params, self._clock(),
+                             limit=self.max_queued_per_user)
+        self._wake.set()
+        return job
+
+    def cancel(self, job_id: int, user_id: int) -> bool:
+        job = self.store.get(job_id)
+        if job is None or job.user_id != user_id:
+            return False
+        if not self.store.transition(job_id, (QUEUED, RUNNING), state=CANCELED):
+            return False
+        if job.prediction_id:
+            try:
+                self.api.cancel(job.prediction_id)
+            except ReplicateError as e:
+                log.warning("Отмена предсказания %s: %s", job.prediction_id, e)
+        self._report(self.store.get(job_id), 0)
+        self._wake.set()
+        return True
+
+    def stats(self) -> dict:
+        jobs = self.store.active()
+        return {s: sum(j.state == s for j in jobs) for s in ACTIVE_STATES}
+
+    # ── фоновый цикл ─────────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._recover()
+        self._thread = threading.Thread(target=self._run, name="video-jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._downloads.shutdown(wait=False)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                log.exception("Очередь видео: ошибка цикла")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _recover(self) -> None:
+        for job in self.store.active():
+            if job.state == RUNNING and not job.prediction_id:
+                # упали между созданием предсказания и записью его id — запускаем заново
+                self.store.transition(job.id, (RUNNING,), state=QUEUED)
+            elif job.state == DELIVERING:
+                self._start_delivery(job)
+        log.info("Очередь видео: подхвачено задач после перезапуска: %d", len(self.store.active()))
+
+    def tick(self) -> None:
+        """Один проход: опросить запущенные, запустить ждущие, обновить статусы."""
+        for job in self.store.active():
+            if job.state == RUNNING:
+                self._poll(job)
+            elif job.state == DELIVERING and job.id not in self._delivering:
+                self._start_delivery(job)
+
+        jobs = self.store.active()
+        running = [j for j in jobs if j.state == RUNNING]
+        for job in (j for j in jobs if j.state == QUEUED):
+            if len(running) >= self.max_running:
+                break
+            if sum(r.user_id == job.user_id for r in running) >= self.max_per_user:
+                continue
+            if self._launch(job):
+                running.append(job)
+
+        position = 0
+        for job in self.store.active():
+            if job.state == QUEUED:
+                position += 1
+                self._report(job, position)
+
+    def _launch(self, job: Job) -> bool:
+        started = self._clock()
+        if not self.store.transition(job.id, (QUEUED,), state=RUNNING, started=started):
+            return False
+        metrics.observe_stage("video.queue_wait", started - job.created)
+        try:
+            pred = self.api.create(self.model, self._build_input(job.prompt, **job.params))
+        except ReplicateError as e:
+            self._finish(job, FAILED, error=str(e))
+            return False
+        if not self.store.transition(job.id, (RUNNING,), prediction_id=pred["id"]):
+            # отменили, пока создавали — отменяем и на стороне Replicate
+            try:
+                self.api.cancel(pred["id"])
+            except ReplicateError:
+                pass
+            return False
+        self._report(self.store.get(job.id), 0)
+        return True
+
+    def _poll(self, job: Job) -> None:
+        try:
+            pred = self.api.get(job.prediction_id)
+        except ReplicateError as e:
+            log.warning("Очередь видео: опрос %s: %s", job.prediction_id, e)
+            return
+        status = pred.get("status")
+        if status == "succeeded":
+            metrics.observe_stage("video.render", self._clock() - job.started)
+            try:
+                url = output_url(pred.get("output"))
+            except ReplicateError as e:
+                self._finish(job, FAILED, error=str(e))
+                return
+            if self.store.transition(job.id, (RUNNING,), state=DELIVERING, output=url, progress=1.0):
+                self._start_delivery(self.store.get(job.id))
+        elif status in ("failed", "canceled"):
+            error = pred.get("error") or (pred.get("logs") or "")[-300:] or status
+            self._finish(job, FAILED if status == "failed" else CANCELED, error=str(error))
+        elif self._clock() - job.started > self.job_timeout:
+            try:
+                self.api.cancel(job.prediction_id)
+            except ReplicateError:
+                pass
+            self._finish(job, FAILED, error=f"рендер дольше {int(self.job_timeout)} с")
+        else:
+            progress = parse_progress(pred.get("logs"))
+            if progress is not None and progress != job.progress:
+                self.store.transition(job.id, (RUNNING,), progress=progress)
+                job.progress = progress
+            self._report(job, 0)
+
+    def _finish(self, job: Job, state: str, error: str = "") -> None:
+        if self.store.transition(job.id, ACTIVE_STATES, state=state, error=error):
+            self._report(self.store.get(job.id), 0)
+
+    # ── выдача результата ────────────────────────────────────────────────────
+
+    def _start_delivery(self, job: Job) -> None:
+        self._delivering.add(job.id)
+        self._report(job, 0)
+        self._downloads.submit(self._deliver_job, job)
+
+    @metrics.track("video_deliver")
+    def _deliver_job(self, job: Job) -> None:
+        try:
+            try:
+                with metrics.stage("replicate.download"):
+                    video = self._download(job.output)
+            except requests.RequestException as e:
+                log.warning("Очередь видео: не скачали %s (%s), отдаём ссылкой", job.output, e)
+                video = job.output
+            self._deliver(job, video)
+            self._finish(job, DONE)
+        except Exception as e:
+            log.exception("Очередь видео: не доставили задачу %s", job.id)
+            self._finish(job, FAILED, error=f"не удалось отправить видео: {e}")
+        finally:
+            self._delivering.discard(job.id)
+            with self._shown_lock:
+                self._shown.pop(job.id, None)
+
+    def _download(self, url: str) -> Video:
+        with self._http.get(url, stream=True, timeout=60) as rsp:
+            rsp.raise_for_status()
+            buf = BytesIO()
+            for part in rsp.iter_content(256 * 1024):
+                buf.write(part)
+                if buf.tell() > TG_UPLOAD_LIMIT:
+                    return url
+            return buf.getvalue()
+
+    def _report(self, job: Optional[Job], position: int) -> None:
+        if job is None:
+            return
+        # правим сообщение, только если что-то видимое поменялось (прогресс — шагом 10%)
+        step = int((job.progress or 0) * 10)
+        key = (job.state, position, step)
+        with self._shown_lock:
+            if self._shown.get(job.id) == key:
+                return
+            self._shown[job.id] = key
+            if job.state not in ACTIVE_STATES:
+                self._shown.pop(job.id, None)
+        try:
+            self._notify(job, position)
+        except Exception:
+            log.exception("Очередь видео: ошибка уведомления по задаче %s", job.id)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Проверка против фейкового Replicate
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _fake_replicate(render_seconds: float = 1.5):
+    """HTTP-сервер, отвечающий как Replicate; рендер идёт render_seconds."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    preds: dict[str, dict] = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: Any, ctype: str = "application/json") -> None:
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _view(self, pid: str) -> dict:
+            p = preds[pid]
+            if p["status"] == "processing":
+                done = min((time.time() - p["t0"]) / render_seconds, 1.0)
+                p["logs"] = f"{int(done * 100):3d}%|####      | {int(done * 20)}/20 [00:01<00:01]\n"
+                if done >= 1.0:
+                    p["status"] = "succeeded"
+                    p["output"] = f"http://{self.headers['Host']}/files/{pid}.mp4"
+            return {k: v for k, v in p.items() if k != "t0"}
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or "{}")
+            with lock:
+                if self.path.endswith("/cancel"):
+                    pid = self.path.split("/")[3]
+                    preds[pid]["status"] = "canceled"
+                    return self._send(200, self._view(pid))
+                pid = f"p{len(preds) + 1}"
+                preds[pid] = {"id": pid, "status": "processing", "input": body["input"],
+                              "logs": "", "output": None, "error": None, "t0": time.time()}
+                return self._send(201, self._view(pid))
+
+        def do_GET(self):
+            if self.path.startswith("/files/"):
+                return self._send(200, b"\x00\x00\x00\x18ftypmp42 fake video", "video/mp4")
+            with lock:
+                return self._send(200, self._view(self.path.rsplit("/", 1)[1]))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _selfcheck() -> int:
+    import tempfile
+
+    logging.basicConfig(level="WARNING")
+    server = _fake_replicate()
+    events: list[tuple[int, str, int, Optional[float]]] = []
+    delivered: dict[int, Video] = {}
+
+    def notify(job: Job, position: int) -> None:
+        events.append((job.id, job.state, position, job.progress))
+        where = f"место {position}" if position else (f"{int((job.progress or 0) * 100)}%" if job.state == RUNNING else "")
+        print(f"  задача {job.id} (пользователь {job.user_id}): {job.state} {where}".rstrip())
+
+    def deliver(job: Job, video: Video) -> None:
+        delivered[job.id] = video
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = VideoJobs(
+            ReplicateApi("fake", f"http://127.0.0.1:{server.server_port}"),
+            JobStore(os.path.join(tmp, "jobs.sqlite3")),
+            model="owner/model",
+            build_input=lambda prompt, **kw: {"prompt": prompt, **kw},
+            notify=notify, deliver=deliver,
+            max_running=2, max_per_user=1, max_queued_per_user=2, poll_interval=0.2,
+        )
+        # восемь нажатий «Сними» разом от одного пользователя: в очередь попадают ровно два
+        race = VideoJobs(
+            ReplicateApi("fake", f"http://127.0.0.1:{server.server_port}"), JobStore(":memory:"),
+            model="owner/model", build_input=lambda prompt, **kw: {"prompt": prompt},
+            notify=notify, deliver=deliver, max_queued_per_user=2,
+        )
+        barrier = threading.Barrier(8)
+
+        def racer(i: int) -> bool:
+            barrier.wait()
+            try:
+                race.submit(4, 4, None, f"r{i}")
+                return True
+            except VideoQueueFull:
+                return False
+
+        with ThreadPoolExecutor(8) as pool:
+            raced = sum(pool.map(racer, range(8)))
+        race.store.close()
+
+        print("Очередь видео против фейкового Replicate: 2 слота, 1 на пользователя")
+        a1 = jobs.submit(1, 1, None, "a1")
+        a2 = jobs.submit(1, 1, None, "a2")
+        b1 = jobs.submit(2, 2, None, "b1")
+        c1 = jobs.submit(3, 3, None, "c1")
+        try:
+            jobs.submit(1, 1, None, "a3")
+            overflow = False
+        except VideoQueueFull:
+            overflow = True
+        jobs.start()
+        time.sleep(0.5)
+        jobs.cancel(c1.id, 3)
+        deadline = time.time() + 15
+        while time.time() < deadline and jobs.store.active():
+            time.sleep(0.1)
+        jobs.stop()
+
+        states = {j: jobs.store.get(j).state for j in (a1.id, a2.id, b1.id, c1.id)}
+        # у пользователя 1 второй ролик стартует только после первого
+        order = [(e[0], e[1]) for e in events]
+        checks = {
+            "лишняя задача отклонена": overflow,
+            f"8 задач разом при лимите 2 — принято {raced}": raced == 2,
+            "все ролики доставлены": set(delivered) == {a1.id, a2.id, b1.id},
+            "отмена сработала": states[c1.id] == CANCELED,
+            "a2 стартовала после a1": order.index((a2.id, RUNNING)) > order.index((a1.id, DELIVERING)),
+            "прогресс сообщался": any(e[1] == RUNNING and (e[3] or 0) > 0 for e in events),
+        }
+    server.shutdown()
+    for name, ok in checks.items():
+        print(f"  {'ok ' if ok else 'FAIL'} {name}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(_selfcheck())
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""
+Конвейер голосового ответа без временных файлов.
+
+OGG из Telegram передаётся в распознавание прямо байтами, ответ GPT
+читается потоком и режется на фразы, а синтез речи для первой фразы
+стартует, пока модель ещё дописывает следующие. Готовые голосовые
+уходят пользователю строго по порядку, как только готовы.
+
+Все внешние шаги — параметры (stt, chat_stream, tts, send), поэтому
+конвейер гоняется на заглушках. Сбой любого шага — не тишина: с failed
+пользователь получает объяснение голосом, а если лёг сам синтез — текстом
+(send_text), как и фразы, которые не удалось озвучить.
+
+    python voice_pipeline.py          # сбои шагов (assert) и замер на заглушках
+"""
+
+import re
+import sys
+import time
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+# Конец фразы: знак препинания (+ закрывающие кавычки/скобки) и пробел
+_SENTENCE_END = re.compile(r"[.!?…]+[\"»)]*\s+|\n+")
+
+
+class SentenceChunker:
+    """
+    Копит поток текста и отдаёт куски из целых фраз.
+
+    Первый кусок короткий (first_min), чтобы голос зазвучал как можно
+    раньше; дальше — подлиннее (min_chars), чтобы не плодить десяток
+    крошечных голосовых. Совсем длинная фраза режется по max_chars.
+    """
+
+    def __init__(self, first_min: int = 40, min_chars: int = 200, max_chars: int = 800):
+        self._first_min = first_min
+        self._min = min_chars
+        self._max = max_chars
+        self._buf = ""
+        self._emitted = 0
+
+    def feed(self, delta: str) -> list[str]:
+        self._buf += delta
+        out = []
+        while True:
+            need = self._first_min if self._emitted == 0 else self._min
+            cut = self._cut_at(need)
+            if cut is None:
+                break
+            out.append(self._take(cut))
+        return out
+
+    def flush(self) -> list[str]:
+        tail = self._take(len(self._buf))
+        return [tail] if tail else []
+
+    def _cut_at(self, need: int):
+        end = None
+        for m in _SENTENCE_END.finditer(self._buf):
+            end = m.end()
+            if end >= need:
+                return end
+        if len(self._buf) >= self._max:
+            space = self._buf.rfind(" ", 0, self._max)
+            return space if space > 0 else self._max
+        return None
+
+    def _take(self, cut: int) -> str:
+        chunk, self._buf = self._buf[:cut].strip(), self._buf[cut:]
+        if chunk:
+            self._emitted += 1
+        return chunk
+
+
+def run_voice_pipeline(
+        audio: bytes,
+        stt: Callable[[bytes], str],
+        chat_stream: Callable[[str], Iterable[str]],
+        tts: Callable[[str], Any],
+        send: Callable[[Any], Any],
+        executor: Executor,
+        chunker: SentenceChunker | None = None,
+        fallback: str = "",
+        failed: Callable[[Exception, str], str] | None = None,
+        send_text: Callable[[str], Any] | None = None,
+) -> str:
+    """
+    Голос → текст → потоковый ответ → озвучка по фразам → отправка по порядку.
+    Возвращает полный текст ответа (пустой, если модель ничего не сказала —
+    тогда озвучивается fallback).
+
+    failed(e, шаг) — что сказать пользователю, когда шаг ("STT", "chat",
+    "TTS") упал; без него ошибка летит наружу. Фраза, которую не удалось
+    озвучить, уходит текстом через send_text.
+    """
+    chunker = chunker or SentenceChunker()
+    pending: list[tuple[str, Future]] = []
+
+    def speak(chunk: str) -> None:
+        pending.append((chunk, executor.submit(tts, chunk)))
+
+    def send_ready(block: bool) -> None:
+        while pending and (block or pending[0][1].done()):
+            chunk, fut = pending.pop(0)
+            try:
+                voice = fut.result()
+            except Exception as e:
+                if failed is None or send_text is None:
+                    raise
+                failed(e, "TTS")
+                send_text(chunk)
+                continue
+            send(voice)
+
+    try:
+        question = stt(audio)
+    except Exception as e:
+        if failed is None:
+            raise
+        speak(failed(e, "STT"))
+        send_ready(block=True)
+        return ""
+
+    reply = ""
+    try:
+        for delta in chat_stream(question):
+            reply += delta
+            for chunk in chunker.feed(delta):
+                speak(chunk)
+            send_ready(block=False)
+    except Exception as e:
+        if failed is None:
+            raise
+        fallback = failed(e, "chat")
+
+    tail = chunker.flush()
+    if not reply.strip() and fallback:
+        tail = [fallback]
+    for chunk in tail:
+        speak(chunk)
+    send_ready(block=True)
+    return reply
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Замер на заглушках
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _asserts() -> None:
+    """Сбои шагов: пользователь всегда получает ответ, голосом или текстом."""
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    def run(stt=lambda a: a.decode(), chat=None, tts=lambda c: f"🔊{c}") -> tuple[str, list[str], list[str]]:
+        out, errors = [], []
+
+        def failed(e: Exception, step: str) -> str:
+            errors.append(f"{step}: {e}")
+            return f"сбой {step}"
+
+        reply = run_voice_pipeline(
+            "вопрос".encode(), stt, chat or (lambda q: iter([f"Ответ на {q}. ", "Ещё фраза. "])), tts,
+            send=out.append, executor=executor, chunker=SentenceChunker(first_min=1, min_chars=1),
+            fallback="пусто", failed=failed, send_text=lambda t: out.append(f"✉{t}"),
+        )
+        return reply, out, errors
+
+    def boom(*_):
+        raise RuntimeError("нет")
+
+    def stream_then_boom(q: str):
+        yield "Начало ответа. "
+        raise TimeoutError("оборвалось")
+
+    assert run() == ("Ответ на вопрос. Ещё фраза. ", ["🔊Ответ на вопрос.", "🔊Ещё фраза."], [])
+    assert run(stt=boom) == ("", ["🔊сбой STT"], ["STT: нет"])
+    assert run(chat=boom) == ("", ["🔊сбой chat"], ["chat: нет"])
+    assert run(chat=lambda q: iter([" "]))[1] == ["🔊пусто"]
+    # начало ответа уже ушло — его и оставляем, без извинений следом
+    assert run(chat=stream_then_boom) == ("Начало ответа. ", ["🔊Начало ответа."], ["chat: оборвалось"])
+    # синтез лёг: ответ и объяснение сбоя STT — текстом
+    assert run(tts=boom)[1:] == (["✉Ответ на вопрос.", "✉Ещё фраза."], ["TTS: нет", "TTS: нет"])
+    assert run(stt=boom, tts=boom)[1] == ["✉сбой STT"]
+    executor.shutdown()
+    print("ok   сбои STT, чата и TTS — ответ всё равно приходит (assert)")
+
+
+def _bench(users: int = 8) -> int:
+    stt_delay, token_delay, tts_per_char = 0.3, 0.02, 0.004
+    sentence = "Жизнь — это театр, где каждый вечер премьера. "
+
+    def stt(audio: bytes) -> str:
+        time.sleep(stt_delay)
+        return audio.decode()
+
+    def words(text: str) -> list[str]:
+        return [w + " " for w in f"{text}: {sentence}".split(" ")] * 6
+
+    def chat_stream(text: str):
+        for word in words(text):
+            time.sleep(token_delay)
+            yield word
+
+    def tts(chunk: str) -> str:
+        time.sleep(len(chunk) * tts_per_char)
+        return chunk
+
+    def sequential(audio: bytes, send) -> None:
+        reply = "".join(chat_stream(stt(audio)))
+        send(tts(reply))
+
+    def run(mode: str) -> tuple[float, float, bool]:
+        first, total, ok = [], [], True
+        lock = threading.Lock()
+        executor = ThreadPoolExecutor(max_workers=users)
+
+        def one(uid: int) -> None:
+            nonlocal ok
+            t0 = time.perf_counter()
+            got: list[str] = []
+
+            def send(seg: str) -> None:
+                if not got:
+                    first.append(time.perf_counter() - t0)
+                got.append(seg)
+
+            audio = f"реплика {uid}".encode()
+            if mode == "конвейер":
+                run_voice_pipeline(audio, stt, chat_stream, tts, send, executor)
+            else:
+                sequential(audio, send)
+            total.append(time.perf_counter() - t0)
+            # каждый получил свои фразы и в правильном порядке
+            expected = "".join(words(audio.decode())).split()
+            with lock:
+                ok = ok and " ".join(got).split() == expected
+
+        threads = [threading.Thread(target=one, args=(u,)) for u in range(users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        executor.shutdown()
+        return sum(first) / len(first), max(total), ok
+
+    print(f"{users} одновременных голосовых, заглушки: STT {stt_delay} с, токен {token_delay} с")
+    bad = 0
+    for mode in ("последовательно", "конвейер"):
+        first, worst, ok = run(mode)
+        bad += not ok
+        print(f"  {mode:16s} первое голосовое через {first:.2f} с, последний ответ {worst:.2f} с, "
+              f"{'порядок и адресаты верны' if ok else 'ПЕРЕПУТАНЫ ФРАЗЫ'}")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    _asserts()
+    sys.exit(_bench())
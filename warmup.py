@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ленивая инициализация и фоновый прогрев.
+
+Тяжёлое (клиент OpenAI с его импортом, логин в админку, Chrome, словарь
+токенизатора) не создаётся при импорте бота: бот сразу начинает опрос
+Telegram и отвечает на всё, что этого не требует. Нужное создаётся при
+первом обращении (Lazy) или заранее в фоне, когда бот уже слушает:
+
+    client = Lazy(lambda: OpenAI(api_key=KEY))
+    client().chat.completions.create(...)
+
+    warmup = Warmup(delay=1.0)
+    warmup.add("openai", client)
+    warmup.start()                  # после старта опроса
+    warmup.ready("openai")          # готово ли (для /stats, метрик, хэндлеров)
+
+Если пользователь успел раньше прогрева, Lazy создаст объект сам —
+ровно один раз, остальные потоки подождут его же.
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+log = logging.getLogger("neuroseagull.warmup")
+
+T = TypeVar("T")
+
+PENDING, RUNNING, READY, FAILED = "pending", "running", "ready", "failed"
+
+
+class Lazy(Generic[T]):
+    """Объект, создаваемый при первом вызове; потокобезопасно и один раз."""
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+        self._done = False
+
+    def __call__(self) -> T:
+        if not self._done:
+            with self._lock:
+                if not self._done:
+                    self._value = self._factory()
+                    self._done = True
+        return self._value
+
+    @property
+    def created(self) -> bool:
+        return self._done
+
+
+class _Task:
+    __slots__ = ("fn", "state", "seconds", "error", "done")
+
+    def __init__(self, fn: Callable[[], object]):
+        self.fn = fn
+        self.state = PENDING
+        self.seconds = 0.0
+        self.error = ""
+        self.done = threading.Event()
+
+
+class Warmup:
+    def __init__(self, delay: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.delay = delay
+        self._clock = clock
+        self._tasks: dict[str, _Task] = {}
+        self._started = False
+
+    def add(self, name: str, fn: Callable[[], object]) -> None:
+        self._tasks[name] = _Task(fn)
+
+    def start(self) -> None:
+        """Каждую задачу — в своём потоке, через delay секунд (первые апдейты важнее)."""
+        if self._started:
+            return
+        self._started = True
+        for name, task in self._tasks.items():
+            threading.Thread(target=self._run, args=(name, task), name=f"warmup-{name}", daemon=True).start()
+
+    def _run(self, name: str, task: _Task) -> None:
+        if self.delay:
+            time.sleep(self.delay)
+        task.state = RUNNING
+        t0 = self._clock()
+        try:
+            task.fn()
+            task.state = READY
+        except Exception as e:
+            # не страшно: при первом настоящем обращении попробуют ещё раз
+            task.state = FAILED
+            task.error = str(e) or type(e).__name__
+            log.warning("Прогрев %s не удался: %s", name, task.error)
+        task.seconds = self._clock() - t0
+        task.done.set()
+        if task.state == READY:
+            log.info("Прогрев %s: %.2f с", name, task.seconds)
+
+    def ready(self, name: str) -> bool:
+        task = self._tasks.get(name)
+        return task is None or task.state == READY
+
+    def wait(self, name: str, timeout: Optional[float] = None) -> bool:
+        task = self._tasks.get(name)
+        return task is None or (task.done.wait(timeout) and task.state == READY)
+
+    def status(self) -> dict[str, dict]:
+        return {
+            name: {"state": t.state, "seconds": round(t.seconds, 3), "error": t.error}
+            for name, t in self._tasks.items()
+        }